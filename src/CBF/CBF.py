@@ -6,11 +6,12 @@ import scipy.sparse.linalg as sLA
 from sklearn.feature_extraction.text import TfidfTransformer
 from src.utils.feature_weighting import *
 from src.utils.matrix_utils import compute_cosine, top_k_filtering
-from src.utils.BaseRecommender import BaseRecommender
+from src.utils.BaseRecommender import ProductRecommender
+from src.utils.evaluator import FoldContext
 
 
 # 0.1187796227953781
-class ContentBasedFiltering(BaseRecommender):
+class ContentBasedFiltering(ProductRecommender):
 
     def __init__(self, shrinkage=10, k_filtering=100):
         # final matrix of predictions
@@ -24,7 +25,7 @@ class ContentBasedFiltering(BaseRecommender):
         self.shrinkage = shrinkage
         self.k_filtering = k_filtering
 
-    def fit(self, urm, target_playlist, target_tracks, dataset, urm_weight=0.8):
+    def fit(self, urm, target_playlist, target_tracks, dataset, urm_weight=0.8, fold=None):
         """
         urm: user rating matrix
         target playlist is a list of playlist id
@@ -33,8 +34,11 @@ class ContentBasedFiltering(BaseRecommender):
         S = ICM' ICM
         R = URM S
         In between eliminate useless row of URM and useless cols of S
+        fold: FoldContext of urm, built if not given
         """
         # initialization
+        fold = FoldContext.ensure(fold, urm, target_playlist, target_tracks,
+                                  dataset)
 
         self.pl_id_list = list(target_playlist)
         self.tr_id_list = list(target_tracks)
@@ -79,8 +83,7 @@ class ContentBasedFiltering(BaseRecommender):
         # icm = vstack([icm.multiply(2), iucm], format='csr')
         # applytfidf
         # icm = TfidfTransformer(norm='l1').fit_transform(icm.transpose()).transpose()
-        S = compute_cosine(icm.transpose()[[dataset.get_track_index_from_id(x)
-                                            for x in self.tr_id_list]],
+        S = compute_cosine(icm.transpose()[fold.tr_indices],
                            icm,
                            k_filtering=self.k_filtering,
                            shrinkage=self.shrinkage,
@@ -92,18 +95,12 @@ class ContentBasedFiltering(BaseRecommender):
 
         # compute ratings
         print("Similarity matrix ready!")
-        urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                           for x in self.pl_id_list]]
+        urm_cleaned = fold.urm_target
         self.S = S.transpose()
 
-        # compute ratings
-        R_hat = urm_cleaned.dot(S.transpose().tocsc()).tocsr()
-        print("R_hat done")
-        urm_cleaned = urm_cleaned[:, [dataset.get_track_index_from_id(x)
-                                      for x in self.tr_id_list]]
-        R_hat[urm_cleaned.nonzero()] = 0
-        R_hat.eliminate_zeros()
-        self.R_hat = top_k_filtering(R_hat, 20)
+        # ratings are computed by predict, R_hat keeps the top 20
+        self.set_product(urm_cleaned, self.S, fold.urm_target_tracks,
+                         filter_k=20)
 
     def getW(self):
         """
@@ -112,33 +109,6 @@ class ContentBasedFiltering(BaseRecommender):
         """
         return self.S.tocsr()
 
-    def predict(self, at=5):
-        """
-        returns a dictionary of
-        'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
-        """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
-
-    def getR_hat(self):
-        return self.R_hat
-
-    def get_model(self):
-        """
-        Returns the complete R_hat
-        """
-        return self.R_hat.copy()
-
 
 def applyTfIdf(matrix, topK=False, norm='l1'):
     transf = TfidfTransformer(norm=norm)
@@ -6,7 +6,7 @@ import scipy.sparse.linalg as sLA
 from sklearn.feature_extraction.text import TfidfTransformer
 from src.utils.feature_weighting import *
 from sklearn.metrics.pairwise import pairwise_distances
-from src.utils.matrix_utils import compute_cosine, top_k_filtering
+from src.utils.matrix_utils import compute_cosine, top_k_filtering, csr_topk, top_k_to_recs
 
 
 class ContentBasedFiltering(object):
@@ -53,7 +53,8 @@ class ContentBasedFiltering(object):
         ufm = csr_matrix(ufm.multiply(Iu)).transpose()
         ucm = csr_matrix(dataset.build_ucm())
         ucm = vstack([ucm, urm.transpose().multiply, ufm], format='csr')
-        u_sim = compute_cosine(ucm.transpose(), ucm, k_filtering=k_filtering, shrinkage=shrinkage)
+        u_sim = compute_cosine(ucm.transpose(), ucm, k_filtering=k_filtering, shrinkage=shrinkage,
+                               symmetric=True)
         u_sim_norm = u_sim.sum(axis=1)
         # normalize
         u_sim = u_sim.multiply(np.reciprocal(u_sim_norm))
@@ -73,17 +74,13 @@ class ContentBasedFiltering(object):
         # aUrm.data = np.ones_like(aUrm.data)
         # put all to one:
         icm = dataset.add_playlist_to_icm(icm, aUrm, 0.4)
-        S = compute_cosine(icm.transpose()[[dataset.get_track_index_from_id(x)
-                                       for x in self.tr_id_list]], icm, k_filtering=k_filtering, shrinkage=shrinkage)
+        S = compute_cosine(icm.transpose()[dataset.track_indices(self.tr_id_list)], icm, k_filtering=k_filtering, shrinkage=shrinkage)
         sim_norm = S.sum(axis=1)
         # normalize
         S = S.multiply(np.reciprocal(sim_norm))
-        R_hat = aUrm[[dataset.get_playlist_index_from_id(x)
-                     for x in self.pl_id_list]].dot(S.transpose())
-        urm_red = urm[[dataset.get_playlist_index_from_id(x)
-                       for x in self.pl_id_list]]
-        urm_red = urm_red[:, [dataset.get_track_index_from_id(x)
-                              for x in self.tr_id_list]]
+        R_hat = aUrm[dataset.playlist_indices(self.pl_id_list)].dot(S.transpose())
+        urm_red = urm[dataset.playlist_indices(self.pl_id_list)]
+        urm_red = urm_red[:, dataset.track_indices(self.tr_id_list)]
         R_hat[urm_red.nonzero()] = 0
         R_hat.eliminate_zeros()
 
@@ -97,8 +94,7 @@ class ContentBasedFiltering(object):
         S is IxT
         """
         W = lil_matrix((self.S.shape[0], self.S.shape[0]))
-        W[:, [self.dataset.get_track_index_from_id(
-            x) for x in self.tr_id_list]] = self.S
+        W[:, self.dataset.track_indices(self.tr_id_list)] = self.S
         return W
 
     def predict(self, at=5):
@@ -106,18 +102,8 @@ class ContentBasedFiltering(object):
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def get_model(self):
         """
@@ -6,7 +6,7 @@ import numpy.linalg as la
 import scipy.sparse.linalg as sLA
 from sklearn.feature_extraction.text import TfidfTransformer
 from src.utils.feature_weighting import *
-from src.utils.matrix_utils import compute_cosine, top_k_filtering, max_normalize, normalize_by_row
+from src.utils.matrix_utils import compute_cosine, top_k_filtering, max_normalize, normalize_by_row, csr_topk, top_k_to_recs
 from src.utils.BaseRecommender import BaseRecommender
 from src.CBF.CBF_MF import ContentBasedFiltering
 
@@ -57,15 +57,15 @@ class IBF(BaseRecommender):
             self.r_hat_aug = cbf.getR_hat()
 
         # do collaborative filtering
-        S_cf = compute_cosine(self.r_hat_aug.transpose()[[dataset.get_track_index_from_id(x) for x in self.tr_id_list]], self.r_hat_aug, k_filtering=k_filtering, shrinkage=shrinkage)
+        S_cf = compute_cosine(self.r_hat_aug.transpose()[dataset.track_indices(self.tr_id_list)], self.r_hat_aug, k_filtering=k_filtering, shrinkage=shrinkage)
 
         # normalize
         S_cf = normalize_by_row(S_cf)
 
-        self.R_hat = csr_matrix(urm[[dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]].dot(S_cf.transpose()))
+        self.R_hat = csr_matrix(urm[dataset.playlist_indices(self.pl_id_list)].dot(S_cf.transpose()))
 
-        urm_cleaned = urm[[dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]]
-        urm_cleaned = urm_cleaned[:, [dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        urm_cleaned = urm[dataset.playlist_indices(self.pl_id_list)]
+        urm_cleaned = urm_cleaned[:, dataset.track_indices(self.tr_id_list)]
 
         self.R_hat[urm_cleaned.nonzero()] = 0
         self.R_hat.eliminate_zeros()
@@ -85,18 +85,8 @@ class IBF(BaseRecommender):
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def get_model(self):
         """
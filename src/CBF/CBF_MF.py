@@ -2,7 +2,7 @@ from src.utils.loader import *
 from scipy.sparse import *
 import numpy as np
 from src.utils.feature_weighting import *
-from src.utils.matrix_utils import compute_cosine, top_k_filtering, yadistance
+from src.utils.matrix_utils import compute_cosine, top_k_filtering, yadistance, csr_topk, top_k_to_recs
 from src.utils.BaseRecommender import BaseRecommender
 
 
@@ -83,7 +83,8 @@ class ContentBasedFiltering(BaseRecommender):
                            k_filtering=self.k_filtering,
                            shrinkage=self.shrinkage,
                            n_threads=4,
-                           chunksize=1000)
+                           chunksize=1000,
+                           symmetric=True)
         s_norm = S.sum(axis=1)
 
         # Normalize S
@@ -117,18 +118,8 @@ class ContentBasedFiltering(BaseRecommender):
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def getR_hat(self):
         return self.R_hat
@@ -5,7 +5,7 @@ import numpy.linalg as la
 import scipy.sparse.linalg as sLA
 from sklearn.feature_extraction.text import TfidfTransformer
 from src.utils.feature_weighting import *
-from src.utils.matrix_utils import compute_cosine, top_k_filtering, applyTfIdf
+from src.utils.matrix_utils import compute_cosine, top_k_filtering, applyTfIdf, csr_topk, top_k_to_recs
 
 
 class ContentBasedFiltering():
@@ -61,8 +61,7 @@ class ContentBasedFiltering():
         # icm = vstack([icm.multiply(0), iucm], format='csr')
         iucm = applyTfIdf(iucm, 100)
 
-        S_user = compute_cosine(iucm.transpose()[[dataset.get_track_index_from_id(x)
-                                                   for x in self.tr_id_list]],
+        S_user = compute_cosine(iucm.transpose()[dataset.track_indices(self.tr_id_list)],
                                  iucm, k_filtering=k_filtering, normalize=True)
 
         # To filter or not to filter? Who knows?
@@ -82,8 +81,7 @@ class ContentBasedFiltering():
         # created_at = created_at.multiply(0.01)
 
         # compute cosine similarity (only for tg tracks) wrt to all tracks
-        S = compute_cosine(icm.transpose()[[dataset.get_track_index_from_id(x)
-                                            for x in self.tr_id_list]],
+        S = compute_cosine(icm.transpose()[dataset.track_indices(self.tr_id_list)],
                            icm, k_filtering=k_filtering, chunksize=1000)
 
         # compute a weighted average
@@ -94,8 +92,7 @@ class ContentBasedFiltering():
         S = S.multiply(csr_matrix(np.reciprocal(s_norm)))
 
         # keep only target rows of URM and target columns
-        urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                           for x in self.pl_id_list]]
+        urm_cleaned = urm[dataset.playlist_indices(self.pl_id_list)]
 
         # save S
         self.S = S.transpose()
@@ -104,8 +101,7 @@ class ContentBasedFiltering():
         R_hat = urm_cleaned.dot(S.transpose()).tocsr()
 
         # apply mask for eliminating already rated items
-        urm_cleaned = urm_cleaned[:, [dataset.get_track_index_from_id(x)
-                                      for x in self.tr_id_list]]
+        urm_cleaned = urm_cleaned[:, dataset.track_indices(self.tr_id_list)]
         R_hat[urm_cleaned.nonzero()] = 0
         R_hat.eliminate_zeros()
 
@@ -124,18 +120,8 @@ class ContentBasedFiltering():
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def get_model(self):
         """
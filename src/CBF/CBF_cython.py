@@ -5,7 +5,7 @@ import numpy.linalg as la
 import scipy.sparse.linalg as sLA
 from sklearn.feature_extraction.text import TfidfTransformer
 from src.utils.feature_weighting import *
-from src.utils.matrix_utils import compute_cosine, top_k_filtering
+from src.utils.matrix_utils import compute_cosine, top_k_filtering, csr_topk, top_k_to_recs
 from src.CBF.cosineSim import Cosine_Similarity
 
 
@@ -74,17 +74,13 @@ class ContentBasedFiltering(object):
 
         start_time = time.time()
 
-        u_sim = cosine_cython.compute_similarity().transpose()[[dataset.get_playlist_index_from_id(x)
-                       for x in self.pl_id_list]]
+        u_sim = cosine_cython.compute_similarity().transpose()[dataset.playlist_indices(self.pl_id_list)]
         u_sim_norm = u_sim.sum(axis=1)
         # normalize
         u_sim = u_sim.multiply(np.reciprocal(u_sim_norm))
-        R_hat = u_sim.dot(aUrm[:, [dataset.get_track_index_from_id(x)
-                                   for x in self.tr_id_list]])
-        urm_red = urm[[dataset.get_playlist_index_from_id(x)
-                       for x in self.pl_id_list]]
-        urm_red = urm_red[:, [dataset.get_track_index_from_id(x)
-                              for x in self.tr_id_list]]
+        R_hat = u_sim.dot(aUrm[:, dataset.track_indices(self.tr_id_list)])
+        urm_red = urm[dataset.playlist_indices(self.pl_id_list)]
+        urm_red = urm_red[:, dataset.track_indices(self.tr_id_list)]
         R_hat[urm_red.nonzero()] = 0
         R_hat.eliminate_zeros()
 
@@ -104,18 +100,8 @@ class ContentBasedFiltering(object):
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
 
     def get_model(self):
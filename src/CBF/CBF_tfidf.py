@@ -3,10 +3,11 @@ from scipy.sparse import *
 import numpy as np
 from src.utils.feature_weighting import *
 from src.utils.matrix_utils import compute_cosine, top_k_filtering
-from src.utils.BaseRecommender import BaseRecommender
+from src.utils.BaseRecommender import ProductRecommender
+from src.utils.evaluator import FoldContext
 
 
-class ContentBasedFiltering(BaseRecommender):
+class ContentBasedFiltering(ProductRecommender):
 
     """
     Good conf: tag aggr 3,10; tfidf l1 norm over all matrix
@@ -43,7 +44,7 @@ class ContentBasedFiltering(BaseRecommender):
         self.shrinkage = shrinkage
         self.k_filtering = k_filtering
 
-    def fit(self, urm, target_playlist, target_tracks, dataset):
+    def fit(self, urm, target_playlist, target_tracks, dataset, fold=None):
         """
         urm: user rating matrix
         target playlist is a list of playlist id
@@ -52,8 +53,11 @@ class ContentBasedFiltering(BaseRecommender):
         S = ICM' ICM
         R = URM S
         In between eliminate useless row of URM and useless cols of S
+        fold: FoldContext of urm, built if not given
         """
         # initialization
+        fold = FoldContext.ensure(fold, urm, target_playlist, target_tracks,
+                                  dataset)
 
         self.pl_id_list = list(target_playlist)
         self.tr_id_list = list(target_tracks)
@@ -84,8 +88,7 @@ class ContentBasedFiltering(BaseRecommender):
         icm = vstack([icm, tags, urm], format='csr')
         # icm = vstack([icm, tags, applyTFIDF(urm)], format='csr')
 
-        S = compute_cosine(icm.transpose()[[dataset.get_track_index_from_id(x)
-                                            for x in self.tr_id_list]],
+        S = compute_cosine(icm.transpose()[fold.tr_indices],
                            icm,
                            k_filtering=self.k_filtering,
                            shrinkage=self.shrinkage,
@@ -98,22 +101,12 @@ class ContentBasedFiltering(BaseRecommender):
         print("Similarity matrix ready!")
 
         # Keep only the target playlists in the URM
-        urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                           for x in self.pl_id_list]]
+        urm_cleaned = fold.urm_target
         self.S = S.transpose()
 
-        # Compute ratings
-        R_hat = urm_cleaned.dot(S.transpose().tocsc()).tocsr()
-        print("R_hat done")
-
-        # Remove the entries in R_hat that are already present in the URM
-        urm_cleaned = urm_cleaned[:, [dataset.get_track_index_from_id(x)
-                                      for x in self.tr_id_list]]
-        R_hat[urm_cleaned.nonzero()] = 0
-        R_hat.eliminate_zeros()
-
-        print("Shape of final matrix: ", R_hat.shape)
-        self.R_hat = R_hat
+        # Ratings without the entries already present in the URM,
+        # computed by predict
+        self.set_product(urm_cleaned, self.S, fold.urm_target_tracks)
 
     def getW(self):
         """
@@ -122,33 +115,6 @@ class ContentBasedFiltering(BaseRecommender):
         """
         return self.S.tocsr()
 
-    def predict(self, at=5):
-        """
-        returns a dictionary of
-        'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
-        """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
-
-    def getR_hat(self):
-        return self.R_hat
-
-    def get_model(self):
-        """
-        Returns the complete R_hat
-        """
-        return self.R_hat.copy()
-
 
 def applyTFIDF(matrix):
     from sklearn.feature_extraction.text import TfidfTransformer
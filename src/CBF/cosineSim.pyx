@@ -3,14 +3,317 @@ import time
 import numpy as np
 cimport numpy as np
 from cpython.array cimport array, clone
+from cython.parallel import parallel, prange
+from libc.stdlib cimport malloc, calloc, free
 
 import scipy.sparse as sps
 
+from src.utils.parallel import get_n_workers
+
+
+cdef inline bint heap_less(double v, int i, double w, int j) noexcept nogil:
+    # Order of the heap: by weight, ties by the smaller column
+    return v < w or (v == w and i < j)
+
+
+cdef inline void heap_sift_up(double* vals, int* idx, int pos) noexcept nogil:
+    # Min heap: the smallest of the kept weights is in the root
+    cdef int parent
+    cdef double v = vals[pos]
+    cdef int i = idx[pos]
+    while pos > 0:
+        parent = (pos - 1) // 2
+        if not heap_less(v, i, vals[parent], idx[parent]):
+            break
+        vals[pos] = vals[parent]
+        idx[pos] = idx[parent]
+        pos = parent
+    vals[pos] = v
+    idx[pos] = i
+
+
+cdef inline void heap_sift_down(double* vals, int* idx, int size, int pos) noexcept nogil:
+    cdef int child
+    cdef double v = vals[pos]
+    cdef int i = idx[pos]
+    while True:
+        child = 2 * pos + 1
+        if child >= size:
+            break
+        if child + 1 < size and heap_less(vals[child + 1], idx[child + 1],
+                                          vals[child], idx[child]):
+            child = child + 1
+        if not heap_less(vals[child], idx[child], v, i):
+            break
+        vals[pos] = vals[child]
+        idx[pos] = idx[child]
+        pos = child
+    vals[pos] = v
+    idx[pos] = i
+
+
+def cosine_top_k(X, Y, int top_k, double shrinkage=0, bint skip_diagonal=False, int n_threads=0):
+    """
+    Fused X * Y with shrinkage and top-K filtering, the same result of
+    the 'dot' kind of matrix_utils.compute_similarities in a single pass
+    over each row.
+    For every row of X the dot products and the number of co-occurring
+    features are accumulated together, the shrinkage
+    S_ij * n_ij / (n_ij + shrinkage) is applied and only the top_k
+    weights are kept with a bounded heap, ties by the larger column as
+    in score_top_k.
+    Rows are processed in parallel without the gil, n_threads defaults
+    to the core budget.
+    Returns a (X.shape[0], Y.shape[1]) csr matrix
+    """
+
+    if top_k < 1:
+        raise ValueError("top_k must be a positive integer, got {}".format(top_k))
+
+    X = X.tocsr()
+    Y = Y.tocsr()
+
+    cdef int n_rows = X.shape[0]
+    cdef int n_cols = Y.shape[1]
+    top_k = min(top_k, n_cols)
+    if n_threads <= 0:
+        n_threads = get_n_workers()
+
+    cdef int[:] x_indptr = X.indptr.astype(np.int32)
+    cdef int[:] x_indices = X.indices.astype(np.int32)
+    cdef double[:] x_data = X.data.astype(np.float64)
+    cdef int[:] y_indptr = Y.indptr.astype(np.int32)
+    cdef int[:] y_indices = Y.indices.astype(np.int32)
+    cdef double[:] y_data = Y.data.astype(np.float64)
+
+    # Each row keeps at most top_k weights, compacted at the end
+    out_indices_np = np.zeros((n_rows, top_k), dtype=np.int32)
+    out_data_np = np.zeros((n_rows, top_k), dtype=np.float64)
+    out_count_np = np.zeros(n_rows, dtype=np.int32)
+    cdef int[:, :] out_indices = out_indices_np
+    cdef double[:, :] out_data = out_data_np
+    cdef int[:] out_count = out_count_np
+    # set by the threads that could not allocate their buffers
+    cdef int[:] failed = np.zeros(1, dtype=np.int32)
+
+    # Per thread buffers: dense accumulators, the columns touched by the
+    # current row and the heap
+    cdef double* acc
+    cdef int* cnt
+    cdef int* touched
+    cdef double* heap_vals
+    cdef int* heap_idx
+
+    cdef int row, p, q, f, j, c, n_touched, size
+    cdef double x, v
+
+    with nogil, parallel(num_threads=n_threads):
+        acc = <double*> calloc(n_cols, sizeof(double))
+        cnt = <int*> calloc(n_cols, sizeof(int))
+        touched = <int*> malloc(n_cols * sizeof(int))
+        heap_vals = <double*> malloc(top_k * sizeof(double))
+        heap_idx = <int*> malloc(top_k * sizeof(int))
+
+        for row in prange(n_rows, schedule='dynamic', chunksize=64):
+            if acc == NULL or cnt == NULL or touched == NULL or \
+                    heap_vals == NULL or heap_idx == NULL:
+                failed[0] = 1
+                continue
+
+            # Accumulate dot products and co-occurrences of the row
+            n_touched = 0
+            for p in range(x_indptr[row], x_indptr[row + 1]):
+                f = x_indices[p]
+                x = x_data[p]
+                for q in range(y_indptr[f], y_indptr[f + 1]):
+                    j = y_indices[q]
+                    if cnt[j] == 0:
+                        touched[n_touched] = j
+                        n_touched = n_touched + 1
+                    acc[j] = acc[j] + x * y_data[q]
+                    cnt[j] = cnt[j] + 1
+
+            # Shrink, select the top_k and reset the accumulators
+            size = 0
+            for c in range(n_touched):
+                j = touched[c]
+                v = acc[j]
+                if shrinkage != 0:
+                    v = v * cnt[j] / (cnt[j] + shrinkage)
+                acc[j] = 0
+                cnt[j] = 0
+
+                if v == 0 or (skip_diagonal and j == row):
+                    continue
+
+                if size < top_k:
+                    heap_vals[size] = v
+                    heap_idx[size] = j
+                    heap_sift_up(heap_vals, heap_idx, size)
+                    size = size + 1
+                elif heap_less(heap_vals[0], heap_idx[0], v, j):
+                    heap_vals[0] = v
+                    heap_idx[0] = j
+                    heap_sift_down(heap_vals, heap_idx, size, 0)
+
+            for c in range(size):
+                out_indices[row, c] = heap_idx[c]
+                out_data[row, c] = heap_vals[c]
+            out_count[row] = size
+
+        free(acc)
+        free(cnt)
+        free(touched)
+        free(heap_vals)
+        free(heap_idx)
+
+    if failed[0]:
+        raise MemoryError("cosine_top_k could not allocate the buffers of "
+                          "{} columns".format(n_cols))
+
+    # Compact the kept weights in a csr matrix
+    indptr = np.zeros(n_rows + 1, dtype=np.int32)
+    np.cumsum(out_count_np, out=indptr[1:])
+    mask = np.arange(top_k) < out_count_np[:, None]
+    W = sps.csr_matrix((out_data_np[mask], out_indices_np[mask], indptr),
+                       shape=(n_rows, n_cols))
+    W.sort_indices()
+    return W
+
+
+def score_top_k(X, S, int top_k, seen=None, int n_threads=0):
+    """
+    Top-K recommendation of X * S without building it: for every row of
+    X the rows of S of its items are accumulated in a dense buffer of the
+    thread, the columns of the same row of seen and the zero scores are
+    skipped and the top_k scores are kept with a bounded heap.
+    Rows are processed in parallel without the gil, n_threads defaults
+    to the core budget.
+    Returns the (X.shape[0], top_k) columns of matrix_utils.csr_topk:
+    by decreasing score, ties by the larger column, -1 padded
+    """
+
+    if top_k < 1:
+        raise ValueError("top_k must be a positive integer, got {}".format(top_k))
+
+    X = sps.csr_matrix(X)
+    S = sps.csr_matrix(S)
+    if seen is None:
+        seen = sps.csr_matrix((X.shape[0], S.shape[1]))
+    seen = sps.csr_matrix(seen)
+
+    cdef int n_rows = X.shape[0]
+    cdef int n_cols = S.shape[1]
+    if n_threads <= 0:
+        n_threads = get_n_workers()
+
+    cdef int[:] x_indptr = X.indptr.astype(np.int32)
+    cdef int[:] x_indices = X.indices.astype(np.int32)
+    cdef double[:] x_data = X.data.astype(np.float64)
+    cdef int[:] s_indptr = S.indptr.astype(np.int32)
+    cdef int[:] s_indices = S.indices.astype(np.int32)
+    cdef double[:] s_data = S.data.astype(np.float64)
+    cdef int[:] seen_indptr = seen.indptr.astype(np.int32)
+    cdef int[:] seen_indices = seen.indices.astype(np.int32)
+
+    out_np = np.full((n_rows, top_k), -1, dtype=np.int64)
+    cdef long long[:, :] out = out_np
+
+    # set by the threads that could not allocate their buffers
+    cdef int[:] failed = np.zeros(1, dtype=np.int32)
+
+    # Per thread buffers: dense accumulator, state of each column
+    # (0 untouched, 1 touched, 2 seen), columns touched by the row, heap
+    cdef double* acc
+    cdef char* state
+    cdef int* touched
+    cdef double* heap_vals
+    cdef int* heap_idx
+
+    cdef int row, p, q, f, j, c, n_touched, size
+    cdef double x, v
+
+    with nogil, parallel(num_threads=n_threads):
+        acc = <double*> calloc(n_cols, sizeof(double))
+        state = <char*> calloc(n_cols, sizeof(char))
+        touched = <int*> malloc(n_cols * sizeof(int))
+        heap_vals = <double*> malloc(top_k * sizeof(double))
+        heap_idx = <int*> malloc(top_k * sizeof(int))
+
+        for row in prange(n_rows, schedule='dynamic', chunksize=64):
+            if acc == NULL or state == NULL or touched == NULL or \
+                    heap_vals == NULL or heap_idx == NULL:
+                failed[0] = 1
+                continue
+
+            for p in range(seen_indptr[row], seen_indptr[row + 1]):
+                state[seen_indices[p]] = 2
+
+            # Accumulate the similarity rows of the items of the row
+            n_touched = 0
+            for p in range(x_indptr[row], x_indptr[row + 1]):
+                f = x_indices[p]
+                x = x_data[p]
+                for q in range(s_indptr[f], s_indptr[f + 1]):
+                    j = s_indices[q]
+                    if state[j] == 2:
+                        continue
+                    if state[j] == 0:
+                        state[j] = 1
+                        touched[n_touched] = j
+                        n_touched = n_touched + 1
+                    acc[j] = acc[j] + x * s_data[q]
+
+            # Select the top_k and reset the buffers
+            size = 0
+            for c in range(n_touched):
+                j = touched[c]
+                v = acc[j]
+                acc[j] = 0
+                state[j] = 0
+                if v == 0:
+                    continue
+
+                if size < top_k:
+                    heap_vals[size] = v
+                    heap_idx[size] = j
+                    heap_sift_up(heap_vals, heap_idx, size)
+                    size = size + 1
+                elif heap_less(heap_vals[0], heap_idx[0], v, j):
+                    heap_vals[0] = v
+                    heap_idx[0] = j
+                    heap_sift_down(heap_vals, heap_idx, size, 0)
+
+            for p in range(seen_indptr[row], seen_indptr[row + 1]):
+                state[seen_indices[p]] = 0
+
+            # Pop the heap from the smallest, best column first
+            while size > 0:
+                size = size - 1
+                out[row, size] = heap_idx[0]
+                heap_vals[0] = heap_vals[size]
+                heap_idx[0] = heap_idx[size]
+                heap_sift_down(heap_vals, heap_idx, size, 0)
+
+        free(acc)
+        free(state)
+        free(touched)
+        free(heap_vals)
+        free(heap_idx)
+
+    if failed[0]:
+        raise MemoryError("score_top_k could not allocate the buffers of "
+                          "{} columns".format(n_cols))
+
+    return out_np
+
 
 cdef class Cosine_Similarity:
 
     cdef int TopK
     cdef long n_items
+    cdef double shrinkage
+    cdef object URM
 
     # Arrays containing the sparse data
     cdef int[:] user_to_item_row_ptr, user_to_item_cols
@@ -21,11 +324,12 @@ cdef class Cosine_Similarity:
     cdef double[:,:] W_dense
 
     
-    def __init__(self, URM, TopK = 100):
+    def __init__(self, URM, TopK = 100, shrinkage = 0):
         """
         Dataset must be a matrix with items as columns
         :param dataset:
         :param TopK:
+        :param shrinkage: only used by compute_similarity_fused
         """
 
         super(Cosine_Similarity, self).__init__()
@@ -33,8 +337,10 @@ cdef class Cosine_Similarity:
         self.n_items = URM.shape[1]
 
         self.TopK = min(TopK, self.n_items)
+        self.shrinkage = shrinkage
 
         URM = URM.tocsr()
+        self.URM = URM
         self.user_to_item_row_ptr = URM.indptr
         self.user_to_item_cols = URM.indices
         self.user_to_item_data = np.array(URM.data, dtype=np.float64)
@@ -216,3 +522,23 @@ cdef class Cosine_Similarity:
 
             return W_sparse
 
+
+    def compute_similarity_fused(self, int n_threads=0):
+        """
+        Same as compute_similarity, with the shrinkage, computed by the
+        parallel cosine_top_k kernel. Column i holds the TopK
+        neighbours of item i
+        """
+
+        if self.TopK == 0:
+            return self.compute_similarity()
+
+        start_time = time.time()
+
+        W = cosine_top_k(self.URM.T, self.URM, self.TopK, shrinkage=self.shrinkage,
+                         skip_diagonal=True, n_threads=n_threads)
+
+        print("Similarity of {} items computed in {:.2f} seconds".format(
+            self.n_items, time.time() - start_time))
+
+        return W.T.tocsr().astype(np.float32)
@@ -46,7 +46,7 @@ def objective(params):
                                 inferred_playcount / 100)
 
     ev = Evaluator()
-    ev.cross_validation(3, ds.train_final.copy())
+    ev.shared_cross_validation('cv3', 3, ds)
     for i in range(3):
         urm, tg_tracks, tg_playlist = ev.get_fold(ds)
         cbf = ContentBasedFiltering()
@@ -0,0 +1,108 @@
+import sys
+import numpy as np
+import scipy.sparse as sps
+from src.utils.matrix_utils import compute_cosine, recommend_top_k
+from src.utils.numeric import set_float_dtype
+
+# Parity of the compiled kernels of cosineSim.pyx with the numpy code.
+# Build them first with:
+#   cd src/CBF && python compileCython.py cosineSim.pyx build_ext --inplace
+# then run from the root of the repository:
+#   python -m src.CBF.test_cosineSim
+
+
+def random_urm(n_rows, n_cols, density, seed, empty_rows=()):
+    """
+    Random csr matrix with continuous weights, so that the top-K has no
+    ties, without entries in empty_rows
+    """
+    matrix = sps.random(n_rows, n_cols, density=density, format='csr',
+                        random_state=seed)
+    keep = np.ones(n_rows)
+    keep[list(empty_rows)] = 0
+    matrix = sps.diags(keep).dot(matrix).tocsr()
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def same_csr(A, B):
+    """
+    True if the csr matrices have the same entries
+    """
+    A = sps.csr_matrix(A, copy=True)
+    B = sps.csr_matrix(B, copy=True)
+    A.sort_indices()
+    B.sort_indices()
+    return A.shape == B.shape and \
+        np.array_equal(A.indptr, B.indptr) and \
+        np.array_equal(A.indices, B.indices) and \
+        np.allclose(A.data, B.data, rtol=1e-9, atol=1e-12)
+
+
+def report(name, ok):
+    print('{}: {}'.format(name, 'ok' if ok else 'MISMATCH'))
+    return ok
+
+
+def check_cosine_top_k():
+    """
+    cosine_top_k against the numpy path of compute_cosine, with and
+    without shrinkage, k below and above the number of columns and rows
+    with fewer than k neighbors (a feature-less item has an empty row)
+    """
+    # items x features, item 3 has no features
+    icm = random_urm(60, 400, 0.05, 1, empty_rows=[3])
+    X = icm
+    Y = icm.transpose().tocsr()
+    ok = True
+    for shrinkage in [0, 10]:
+        for k in [5, 30, 100]:
+            for start, end in [(0, 60), (10, 35)]:
+                expected = compute_cosine(X[start:end], Y, k,
+                                          shrinkage=shrinkage, n_threads=2,
+                                          chunksize=7, cache=False)
+                result = compute_cosine(X[start:end], Y, k,
+                                        shrinkage=shrinkage, n_threads=2,
+                                        use_cython=True, cache=False)
+                ok &= report('cosine_top_k shrinkage={} k={} rows [{}, {})'
+                             .format(shrinkage, k, start, end),
+                             same_csr(expected, result))
+    return ok
+
+
+def check_score_top_k():
+    """
+    score_top_k against recommend_top_k, with and without seen entries,
+    k below and above the number of columns (the -1 padding) and
+    playlists without tracks
+    """
+    # playlists x tracks, playlists 0 and 7 are empty
+    urm = random_urm(50, 80, 0.08, 2, empty_rows=[0, 7])
+    S = compute_cosine(urm.transpose().tocsr(), urm, 20, cache=False)
+    ok = True
+    for seen in [None, urm]:
+        for k in [5, 100]:
+            expected = recommend_top_k(urm, S, k, seen=seen, n_threads=2)
+            result = recommend_top_k(urm, S, k, seen=seen, n_threads=2,
+                                     use_cython=True)
+            ok &= report('score_top_k seen={} k={}'.format(
+                seen is not None, k), np.array_equal(expected, result))
+    return ok
+
+
+def main():
+    # in float64 the kernels and the numpy code round the same way
+    set_float_dtype('float64')
+    try:
+        import src.CBF.cosineSim  # noqa: F401
+    except ImportError:
+        print("cosineSim is not built, see the top of this file")
+        sys.exit(1)
+    ok = check_cosine_top_k()
+    ok &= check_score_top_k()
+    print('All kernels match' if ok else 'Some kernels do not match')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
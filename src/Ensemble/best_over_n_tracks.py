@@ -46,13 +46,8 @@ def results_cbf(dataset, ev, urm, tg_tracks, tg_playlist, n_clusters):
             list(tg_playlist),
             list(tg_tracks),
             dataset)
-    recs = cbf.predict()
-    ev.evaluate_fold(recs)
-
-    map_playlists = ev.get_map_playlists()
-    maps = np.array([map_playlists[x] for x in list(tg_playlist)])
-    urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                       for x in list(tg_playlist)]]
+    maps = ev.fold_maps_at(cbf)
+    urm_cleaned = urm[dataset.playlist_indices(list(tg_playlist))]
 
     print("Computing MAP n_tracks clustering...")
     # Compute MAP@5 per cluster of n_tracks
@@ -70,13 +65,8 @@ def results_ibf(dataset, ev, urm, tg_tracks, tg_playlist, n_clusters):
             list(tg_playlist),
             list(tg_tracks),
             dataset)
-    recs = ibf.predict()
-    ev.evaluate_fold(recs)
-
-    map_playlists = ev.get_map_playlists()
-    maps = np.array([map_playlists[x] for x in list(tg_playlist)])
-    urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                       for x in list(tg_playlist)]]
+    maps = ev.fold_maps_at(ibf)
+    urm_cleaned = urm[dataset.playlist_indices(list(tg_playlist))]
 
     print("Computing MAP n_tracks clustering...")
     # Compute MAP@5 per cluster of n_tracks
@@ -94,13 +84,8 @@ def results_ubf(dataset, ev, urm, tg_tracks, tg_playlist, n_clusters):
             list(tg_playlist),
             list(tg_tracks),
             dataset)
-    recs = ubf.predict()
-    ev.evaluate_fold(recs)
-
-    map_playlists = ev.get_map_playlists()
-    maps = np.array([map_playlists[x] for x in list(tg_playlist)])
-    urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                       for x in list(tg_playlist)]]
+    maps = ev.fold_maps_at(ubf)
+    urm_cleaned = urm[dataset.playlist_indices(list(tg_playlist))]
 
     print("Computing MAP n_tracks clustering...")
     # Compute MAP@5 per cluster of n_tracks
@@ -118,13 +103,8 @@ def result_pop_cbf(dataset, ev, urm, tg_tracks, tg_playlist, n_clusters):
             list(tg_playlist),
             list(tg_tracks),
             dataset)
-    recs = cbf.predict()
-    ev.evaluate_fold(recs)
-
-    map_playlists = ev.get_map_playlists()
-    maps = np.array([map_playlists[x] for x in list(tg_playlist)])
-    urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                       for x in list(tg_playlist)]]
+    maps = ev.fold_maps_at(cbf)
+    urm_cleaned = urm[dataset.playlist_indices(list(tg_playlist))]
 
     print("Computing MAP n_tracks clustering...")
     # Compute MAP@5 per cluster of n_tracks
@@ -146,13 +126,8 @@ def results_mf(dataset, ev, urm, tg_tracks, tg_playlist, n_clusters):
     r_hat_aug = cbf_aug.getR_hat()
     model = MF_BPR_KNN(r_hat_aug)
     model.fit(urm, list(tg_playlist), list(tg_tracks), dataset)
-    recs = model.predict()
-    ev.evaluate_fold(recs)
-
-    map_playlists = ev.get_map_playlists()
-    maps = np.array([map_playlists[x] for x in list(tg_playlist)])
-    urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                       for x in list(tg_playlist)]]
+    maps = ev.fold_maps_at(model)
+    urm_cleaned = urm[dataset.playlist_indices(list(tg_playlist))]
 
     print("Computing MAP n_tracks clustering...")
     # Compute MAP@5 per cluster of n_tracks
@@ -1,10 +1,12 @@
+import inspect
 from src.utils.loader import *
 from src.utils.evaluator import *
 from scipy.sparse import *
 import numpy as np
 import numpy.linalg as LA
 import scipy.sparse.linalg as sLA
-from src.utils.matrix_utils import compute_cosine, top_k_filtering
+from src.utils.matrix_utils import compute_cosine, top_k_filtering, csr_topk, top_k_to_recs
+from src.utils.matrix_utils import max_normalize, weighted_sum
 from src.utils.cluster import build_user_cluster
 from src.Pop.popularity import Popularity
 from src.FWUM.UICF import xSquared
@@ -29,32 +31,32 @@ class Ensemble(object):
         takes an array of models all with R_hat as atttribute
         and mixes them using params
         params: array of attributes
+        the R_hat may be csr or dense, the mix is csr or dense
+        depending on its density (see adapt_r_hat)
         """
-        R_hat_mixed = lil_matrix(
-            (self.models[0].R_hat.shape[0], self.models[0].R_hat.shape[1]))
+        r_hats = []
         for i in range(len(self.models)):
             if self.normalize_ratings:
                 current_r_hat = self.max_normalize(self.models[i].R_hat)
             else:
                 current_r_hat = self.models[i].R_hat
-            R_hat_mixed += current_r_hat.multiply(params[i])
-        return R_hat_mixed.tocsr()
+            r_hats.append(current_r_hat)
+        return weighted_sum(r_hats, params[:len(self.models)])
 
     def mix_cluster(self, models, params, tg_playlist, urm=None, icm=None, ds=None):
 
-        urm_red = urm[[ds.get_playlist_index_from_id(x) for x in tg_playlist]]
-        ucm = ds.build_ucm()[:, [ds.get_playlist_index_from_id(x)
-                                 for x in tg_playlist]]
+        urm_red = urm[ds.playlist_indices(tg_playlist)]
+        ucm = ds.build_ucm()[:, ds.playlist_indices(tg_playlist)]
 
         # user cluster contains only cluster of target users
         user_cluster = build_user_cluster(
             urm_red, icm, ucm, int(len(params)))  # / 3))
 
-        R_hat_mixed = lil_matrix(
-            (models[0].R_hat.shape[0], models[0].R_hat.shape[1]))
+        r_hats = []
+        weights_per_model = []
         for i in range(len(models)):
             # normalize weights to 0,1 if needed
-            if normalize_ratings:
+            if self.normalize_ratings:
                 current_r_hat = max_normalize(models[i].R_hat)
             else:
                 current_r_hat = models[i].R_hat
@@ -65,18 +67,17 @@ class Ensemble(object):
             # weights as column vector
             np_weights = np.reshape(np.array(weights), (-1, 1))
 
-            # multiply weights by the current matrix
-            R_hat_mixed += current_r_hat.multiply(np_weights)
+            r_hats.append(current_r_hat)
+            weights_per_model.append(np_weights)
 
-        return R_hat_mixed.tocsr()
+        # multiply weights by the matrices and sum them
+        return weighted_sum(r_hats, weights_per_model)
 
     def max_normalize(self, X):
         """
-        Normalizes X by rows dividing each row by its max
+        Normalizes X (sparse or dense) by rows dividing each row by its max
         """
-        max_r = X.max(axis=1)
-        max_r.data = np.reciprocal(max_r.data)
-        return X.multiply(max_r)
+        return max_normalize(X)
 
     def predict(self, params, at=5):
         # Mix them all
@@ -85,18 +86,8 @@ class Ensemble(object):
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = R_hat.data[R_hat.indptr[i]:
-                                R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [R_hat.indices[R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def predict_interleave(self, params, at=5):
         """
@@ -142,16 +133,22 @@ class Ensemble(object):
                 print("Done: ", (i / len(self.pl_id_list)) * 100)
         return recs
 
-    def fit(self, urm, tg_tracks, tg_playlist, ds):
+    def fit(self, urm, tg_tracks, tg_playlist, ds, fold=None):
         """
         Fit all models
+        Models accepting a fold share the same FoldContext,
+        so the urm is sliced only once for all of them
         """
         self.tr_id_list = tg_tracks
         self.pl_id_list = tg_playlist
+        fold = FoldContext.ensure(fold, urm, tg_playlist, tg_tracks, ds)
 
         # call fit on all models
         for model in self.models:
-            model.fit(urm.copy(), tg_playlist, tg_tracks, ds)
+            if 'fold' in inspect.signature(model.fit).parameters:
+                model.fit(fold.urm, tg_playlist, tg_tracks, ds, fold=fold)
+            else:
+                model.fit(urm.copy(), tg_playlist, tg_tracks, ds)
 
     def fit_cluster(self, params):
 
@@ -166,7 +163,8 @@ def main():
     ds.set_playlist_attr_weights(1, 1, 1, 1, 1)
     ev = Evaluator(seed=False)
     ev.cross_validation(5, ds.train_final.copy())
-    urm, tg_tracks, tg_playlist = ev.get_fold(ds)
+    fold = ev.get_fold(ds)
+    urm, tg_tracks, tg_playlist = fold
 
     # create models
     cbf = ContentBasedFiltering()
@@ -180,7 +178,7 @@ def main():
     ensemble = Ensemble(models, normalize_ratings=True)
 
     # call fit on ensemble to fit all models
-    ensemble.fit(urm, list(tg_tracks), list(tg_playlist), ds)
+    ensemble.fit(urm, list(tg_tracks), list(tg_playlist), ds, fold=fold)
 
     # Mix them all
     recs_mix = ensemble.predict_interleave([2, 2, 1])
@@ -130,7 +130,7 @@ def linear_ensemble():
                                 1.0, 1.0, 0.0, 0.0)
     ds.set_playlist_attr_weights(1, 1, 1, 1, 1)
     ev = Evaluator()
-    ev.cross_validation(5, ds.train_final.copy())
+    ev.shared_cross_validation('cv5', 5, ds)
     urm, tg_tracks, tg_playlist = ev.get_fold(ds)
 
     # augment r_hat
@@ -201,7 +201,7 @@ def opt_sim_ensemble():
     ds.set_track_attr_weights(1, 0.9, 0.2, 0.2, 0.2)
     ds.set_playlist_attr_weights(0.5, 0.5, 0.5, 0.05, 0.05)
     ev = Evaluator()
-    ev.cross_validation(4, ds.train_final.copy())
+    ev.shared_cross_validation('cv4', 4, ds)
     urm, tg_tracks, tg_playlist = ev.get_fold(ds)
     sim_ensemble.fit(urm, list(tg_playlist), list(tg_tracks), ds)
     res = forest_minimize(sim_objective, space, x0=x0s, verbose=True, n_random_starts=20, n_calls=200, n_jobs=-1, callback=result)
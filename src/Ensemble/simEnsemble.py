@@ -3,7 +3,7 @@ from scipy.sparse import *
 import numpy as np
 from src.utils.loader import *
 from src.utils.evaluator import *
-from src.utils.matrix_utils import top_k_filtering, compute_cosine
+from src.utils.matrix_utils import top_k_filtering, compute_cosine, csr_topk, top_k_to_recs
 from src.MF.iALS import IALS
 from src.ML.CSLIM_parallel import SLIM
 
@@ -35,20 +35,20 @@ class SimEnsemble():
         slim = SLIM()
         slim.fit(urm, self.pl_id_list, self.tr_id_list, dataset)
         S_cslim = slim.getW()
-        S_cslim = S_cslim[:, [dataset.get_track_index_from_id(x) for x in self.tr_id_list]].transpose()
+        S_cslim = S_cslim[:, dataset.track_indices(self.tr_id_list)].transpose()
 
         # Build content based similarity
         icm = dataset.build_icm()
-        S_cbf = compute_cosine(icm.transpose()[[dataset.get_track_index_from_id(x) for x in self.tr_id_list]], icm, k_filtering=200, shrinkage=10)
+        S_cbf = compute_cosine(icm.transpose()[dataset.track_indices(self.tr_id_list)], icm, k_filtering=200, shrinkage=10)
 
         # Build collaborative similarity
-        S_cf = compute_cosine(urm.transpose()[[dataset.get_track_index_from_id(x) for x in self.tr_id_list]], urm, k_filtering=200, shrinkage=10)
+        S_cf = compute_cosine(urm.transpose()[dataset.track_indices(self.tr_id_list)], urm, k_filtering=200, shrinkage=10)
 
         # Build similarity from implicit model
         # ials = IALS(500, 50, 1e-4, 800)
         # ials.fit(urm, tg_playlist, tg_tracks, dataset)
         # item_factors = ials.model.item_factors
-        # S_ials = compute_cosine(item_factors[[dataset.get_track_index_from_id(x) for x in self.tr_id_list]], item_factors.transpose(), k_filtering=200, shrinkage=10)
+        # S_ials = compute_cosine(item_factors[dataset.track_indices(self.tr_id_list)], item_factors.transpose(), k_filtering=200, shrinkage=10)
 
         # append all similarities
         self.similarities.append(S_cbf)
@@ -71,10 +71,10 @@ class SimEnsemble():
         s_norm = S_mixed.sum(axis=1)
         # normalize s
         S_mixed = S_mixed.multiply(csr_matrix(np.reciprocal(s_norm)))
-        R_hat_mixed = urm[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]].dot(S_mixed.transpose()).tocsr()
+        R_hat_mixed = urm[self.dataset.playlist_indices(self.pl_id_list)].dot(S_mixed.transpose()).tocsr()
         # clean
-        urm_cleaned = urm[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]]
-        urm_cleaned = urm_cleaned[:, [self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        urm_cleaned = urm[self.dataset.playlist_indices(self.pl_id_list)]
+        urm_cleaned = urm_cleaned[:, self.dataset.track_indices(self.tr_id_list)]
         R_hat_mixed[urm_cleaned.nonzero()] = 0
         R_hat_mixed.eliminate_zeros()
         R_hat_mixed = top_k_filtering(R_hat_mixed, topK=20)
@@ -82,15 +82,5 @@ class SimEnsemble():
 
     def predict(self, params, at=5):
         self.R_hat = self.mix(params)
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
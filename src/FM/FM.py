@@ -4,7 +4,7 @@ from scipy.sparse import *
 import numpy as np
 from sklearn.feature_extraction.text import TfidfTransformer
 from src.utils.feature_weighting import *
-from src.utils.matrix_utils import compute_cosine, top_k_filtering
+from src.utils.matrix_utils import compute_cosine, top_k_filtering, csr_topk, top_k_to_recs
 from src.utils.BaseRecommender import BaseRecommender
 from fastFM.mcmc import FMRegression
 from itertools import product
@@ -121,10 +121,8 @@ class FM(BaseRecommender):
 
         n_rows_test = n_tg_user * n_tg_items
 
-        tg_pl_index = [dataset.get_playlist_index_from_id(x)
-                       for x in self.pl_id_list]
-        tg_tr_index = [dataset.get_track_index_from_id(x)
-                       for x in self.tr_id_list]
+        tg_pl_index = dataset.playlist_indices(self.pl_id_list)
+        tg_tr_index = dataset.track_indices(self.tr_id_list)
 
         # columns are tg_tr_index tiled n _tg_user times
         cols = np.tile(tg_tr_index, n_tg_user)
@@ -209,18 +207,8 @@ class FM(BaseRecommender):
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def getR_hat(self):
         return self.R_hat
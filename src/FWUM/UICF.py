@@ -5,7 +5,7 @@ import numpy as np
 import numpy.linalg as LA
 import scipy.sparse.linalg as sLA
 from sklearn.decomposition import TruncatedSVD
-from src.utils.matrix_utils import compute_cosine, top_k_filtering
+from src.utils.matrix_utils import compute_cosine, top_k_filtering, csr_topk, top_k_to_recs
 
 # MAP@5: 0.08292090778858459
 class xSquared():
@@ -52,12 +52,12 @@ class xSquared():
         ucm_red = dataset.build_ucm()
         # build the user feature matrix
         # FxUt
-        ufm = urm.dot(icm.transpose())[[dataset.get_playlist_index_from_id(x) for x in target_playlist]].transpose()
+        ufm = urm.dot(icm.transpose())[dataset.playlist_indices(target_playlist)].transpose()
         print("Start filtering")
 
         ufm = self.filter_by_topic(ufm, dataset).transpose()
         # Iu contains for each user the number of tracks rated
-        Iu = urm[[dataset.get_playlist_index_from_id(x) for x in target_playlist]].sum(axis=1)
+        Iu = urm[dataset.playlist_indices(target_playlist)].sum(axis=1)
         # save from divide by zero!
         Iu[Iu == 0] = 1
         # since we have to divide the ufm get the reciprocal of this vector
@@ -65,12 +65,12 @@ class xSquared():
         # multiply the ufm by Iu. Normalize UFM
         print("UFM ready")
         ufm = ufm.multiply(Iu).transpose()
-        ucm = vstack([ufm, ucm_red[:,[dataset.get_playlist_index_from_id(x) for x in target_playlist]]], format='csr')
+        ucm = vstack([ufm, ucm_red[:,dataset.playlist_indices(target_playlist)]], format='csr')
         print("UCM ready")
         ## User Based content profile
         # uFxI
-        iucm = ucm_red.dot(urm)[:, [dataset.get_track_index_from_id(x) for x in target_tracks]]
-        i_sum = urm[:, [dataset.get_track_index_from_id(x) for x in target_tracks]].sum(axis=0)
+        iucm = ucm_red.dot(urm)[:, dataset.track_indices(target_tracks)]
+        i_sum = urm[:, dataset.track_indices(target_tracks)].sum(axis=0)
         # save from divide by zero!
         i_sum[i_sum == 0] = 1
         # since we have to divide the ufm get the reciprocal of this vector
@@ -94,7 +94,7 @@ class xSquared():
 
         numtracks = dataset.build_numtracks_matrix(iucm)
         numtracks = top_k_filtering(numtracks, 10)
-        icm = vstack([icm[:, [dataset.get_track_index_from_id(x) for x in target_tracks]], title, owner, created_at, duration, numtracks], format='csr')
+        icm = vstack([icm[:, dataset.track_indices(target_tracks)], title, owner, created_at, duration, numtracks], format='csr')
 
         print("UFM and ICM Done!")
         # NEIGHBOR FORMATION
@@ -103,13 +103,13 @@ class xSquared():
 
         # R_hat computation
         self.R_hat = R_hat_1.tocsr()
-        # self.R_hat = self.R_hat[[dataset.get_playlist_index_from_id(x) for x in target_playlist]]
-        # self.R_hat = self.R_hat[:, [dataset.get_track_index_from_id(x) for x in target_tracks]]
+        # self.R_hat = self.R_hat[dataset.playlist_indices(target_playlist)]
+        # self.R_hat = self.R_hat[:, dataset.track_indices(target_tracks)]
         # restore original ratings
         # self.R_hat[self.urm.nonzero()] = 1
         # clean urm
-        self.urm = self.urm[:, [dataset.get_track_index_from_id(x) for x in target_tracks]]
-        self.urm = self.urm[[dataset.get_playlist_index_from_id(x) for x in target_playlist]]
+        self.urm = self.urm[:, dataset.track_indices(target_tracks)]
+        self.urm = self.urm[dataset.playlist_indices(target_playlist)]
         # put to zero already rated elements
         self.R_hat[self.urm.nonzero()] = 0
         self.R_hat.eliminate_zeros()
@@ -121,18 +121,8 @@ class xSquared():
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def predict_one(self, pl_id, at=5, shrinkage=130, k_filtering=95):
         """
@@ -156,7 +146,7 @@ class xSquared():
         norm[(norm == 0)] = 1
         # normalize
         icm_w = icm_w.multiply(csr_matrix(1 / norm))
-        icm_t = icm_w.transpose()[[self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        icm_t = icm_w.transpose()[self.dataset.track_indices(self.tr_id_list)]
         # calculate similarity
         print("Calculating similarity")
         sim = icm_t.dot(icm_w)
@@ -173,7 +163,7 @@ class xSquared():
         # S_den.data = 1 / S_den.data
         # S_num.data *= S_den.data
         # remove rows from S_num
-        # S_num = S_num[[self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        # S_num = S_num[self.dataset.track_indices(self.tr_id_list)]
         # normalize each row
         s_norm = sim.sum(axis=1)
         s_norm[s_norm == 0] = 1
@@ -5,7 +5,7 @@ import numpy as np
 import numpy.linalg as LA
 import scipy.sparse.linalg as sLA
 from sklearn.decomposition import TruncatedSVD
-from src.utils.matrix_utils import compute_cosine, top_k_filtering, dot_chunked
+from src.utils.matrix_utils import compute_cosine, top_k_filtering, dot_chunked, csr_topk, top_k_to_recs
 
 
 class UserItemFiltering():
@@ -58,13 +58,13 @@ class UserItemFiltering():
         ucm_red = dataset.add_playlist_num_rating_to_icm(ucm_red, urm)
         # build the user feature matrix
         # FxUt
-        ufm = urm.dot(icm.transpose())[[dataset.get_playlist_index_from_id(x) for x in target_playlist]].transpose()
+        ufm = urm.dot(icm.transpose())[dataset.playlist_indices(target_playlist)].transpose()
         print("Start filtering")
 
         # ufm = self.filter_by_topic(ufm, dataset).transpose()
         ufm = top_k_filtering(ufm.transpose(), topK=1000)
         # Iu contains for each user the number of tracks rated
-        Iu = urm[[dataset.get_playlist_index_from_id(x) for x in target_playlist]].sum(axis=1)
+        Iu = urm[dataset.playlist_indices(target_playlist)].sum(axis=1)
         # save from divide by zero!
         Iu[Iu == 0] = 1
         # since we have to divide the ufm get the reciprocal of this vector
@@ -73,7 +73,7 @@ class UserItemFiltering():
         print("UFM ready")
         ufm = ufm.multiply(Iu).transpose()
         # build owner feature model
-        orm = dataset.build_owner_item_matrix(ucm_red, urm)[[dataset.get_playlist_index_from_id(x) for x in target_playlist]]
+        orm = dataset.build_owner_item_matrix(ucm_red, urm)[dataset.playlist_indices(target_playlist)]
         ofm = orm.dot(icm.transpose()).transpose()
         # filtering
         # ofm = self.filter_by_topic(ofm, dataset).transpose()
@@ -87,12 +87,12 @@ class UserItemFiltering():
         print("OFM ready")
         ofm = ofm.multiply(Iu).transpose()
         ufm = ufm.multiply(0.8) + ofm.multiply(0.2)
-        ucm = vstack([ufm, ucm_red[:, [dataset.get_playlist_index_from_id(x) for x in target_playlist]]], format='csr')
+        ucm = vstack([ufm, ucm_red[:, dataset.playlist_indices(target_playlist)]], format='csr')
         print("UCM ready")
         ## User Based content profile
         # uFxI
-        iucm = ucm_red.dot(urm)[:, [dataset.get_track_index_from_id(x) for x in target_tracks]]
-        i_sum = urm[:, [dataset.get_track_index_from_id(x) for x in target_tracks]].sum(axis=0)
+        iucm = ucm_red.dot(urm)[:, dataset.track_indices(target_tracks)]
+        i_sum = urm[:, dataset.track_indices(target_tracks)].sum(axis=0)
         # save from divide by zero!
         i_sum[i_sum == 0] = 1
         # since we have to divide the ufm get the reciprocal of this vector
@@ -115,7 +115,7 @@ class UserItemFiltering():
 
         # numtracks = dataset.build_numtracks_matrix(iucm)
         # numtracks = top_k_filtering(numtracks, 10)
-        iucm = vstack([icm[:, [dataset.get_track_index_from_id(x) for x in target_tracks]], iucm], format='csr')
+        iucm = vstack([icm[:, dataset.track_indices(target_tracks)], iucm], format='csr')
 
         # NEIGHBOR FORMATION
         # normalize matrix
@@ -123,7 +123,7 @@ class UserItemFiltering():
         R_hat_1 = dot_chunked(ucm.transpose(), iucm, topK=500)
 
         icm = dataset.add_playlist_to_icm(icm, urm, 0.5)
-        S_cbf = compute_cosine(icm.transpose()[[dataset.get_track_index_from_id(x) for x in target_tracks]], icm, k_filtering=100, shrinkage=50)
+        S_cbf = compute_cosine(icm.transpose()[dataset.track_indices(target_tracks)], icm, k_filtering=100, shrinkage=50)
         norm = S_cbf.sum(axis=1)
         # save from divide by zero!
         norm[norm == 0] = 1
@@ -131,17 +131,17 @@ class UserItemFiltering():
         norm = np.reciprocal(norm)
         # multiply the ufm by Iu. Normalize UFM
         S_cbf = csr_matrix(S_cbf.multiply(norm))
-        R_hat_2 = urm[[dataset.get_playlist_index_from_id(x) for x in target_playlist]].dot(S_cbf.transpose())
+        R_hat_2 = urm[dataset.playlist_indices(target_playlist)].dot(S_cbf.transpose())
 
         # R_hat computation
         self.R_hat = R_hat_1.multiply(R_hat_2)
-        # self.R_hat = self.R_hat[[dataset.get_playlist_index_from_id(x) for x in target_playlist]]
-        # self.R_hat = self.R_hat[:, [dataset.get_track_index_from_id(x) for x in target_tracks]]
+        # self.R_hat = self.R_hat[dataset.playlist_indices(target_playlist)]
+        # self.R_hat = self.R_hat[:, dataset.track_indices(target_tracks)]
         # restore original ratings
         # self.R_hat[self.urm.nonzero()] = 1
         # clean urm
-        self.urm = self.urm[:, [dataset.get_track_index_from_id(x) for x in target_tracks]]
-        self.urm = self.urm[[dataset.get_playlist_index_from_id(x) for x in target_playlist]]
+        self.urm = self.urm[:, dataset.track_indices(target_tracks)]
+        self.urm = self.urm[dataset.playlist_indices(target_playlist)]
         # put to zero already rated elements
         self.R_hat[self.urm.nonzero()] = 0
         self.R_hat.eliminate_zeros()
@@ -152,18 +152,8 @@ class UserItemFiltering():
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def predict_one(self, pl_id, at=5, shrinkage=130, k_filtering=95):
         """
@@ -187,7 +177,7 @@ class UserItemFiltering():
         norm[(norm == 0)] = 1
         # normalize
         icm_w = icm_w.multiply(csr_matrix(1 / norm))
-        icm_t = icm_w.transpose()[[self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        icm_t = icm_w.transpose()[self.dataset.track_indices(self.tr_id_list)]
         # calculate similarity
         print("Calculating similarity")
         sim = icm_t.dot(icm_w)
@@ -204,7 +194,7 @@ class UserItemFiltering():
         # S_den.data = 1 / S_den.data
         # S_num.data *= S_den.data
         # remove rows from S_num
-        # S_num = S_num[[self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        # S_num = S_num[self.dataset.track_indices(self.tr_id_list)]
         # normalize each row
         s_norm = sim.sum(axis=1)
         s_norm[s_norm == 0] = 1
@@ -4,7 +4,7 @@ import numpy as np
 import numpy.linalg as LA
 from sklearn.decomposition import TruncatedSVD
 from src.utils.BaseRecommender import BaseRecommender
-from src.utils.matrix_utils import dot_chunked_single, top_k_filtering
+from src.utils.matrix_utils import dot_chunked_single, top_k_filtering, csr_topk, top_k_to_recs
 
 # map@5 around 0.055 with owner feature
 # MAP@5: 0.056282892256653706 with owner features weighted 0.1 and following weights:
@@ -63,10 +63,10 @@ class xSquared(BaseRecommender):
 
         # CONTENT BASED USER PROFILE
         # build the user feature matrix
-        ufm = self.urm[[dataset.get_playlist_index_from_id(x) for x in target_playlist]].dot(self.icm.transpose())
+        ufm = self.urm[dataset.playlist_indices(target_playlist)].dot(self.icm.transpose())
 
         # Iu contains for each user the number of tracks rated
-        Iu = urm[[dataset.get_playlist_index_from_id(x) for x in target_playlist]].sum(axis=1)
+        Iu = urm[dataset.playlist_indices(target_playlist)].sum(axis=1)
         # save from divide by zero!
         Iu[Iu == 0] = 1
         # since we have to divide the ufm get the reciprocal of this vector
@@ -78,7 +78,7 @@ class xSquared(BaseRecommender):
         print("User feature matrix done")
 
         # build owner rating matrix
-        orm = dataset.build_owner_item_matrix(self.ucm, urm)[[dataset.get_playlist_index_from_id(x) for x in target_playlist]]
+        orm = dataset.build_owner_item_matrix(self.ucm, urm)[dataset.playlist_indices(target_playlist)]
 
         # build owner feature matrix
         # for each owner the average of the feature of its tracks
@@ -101,21 +101,18 @@ class xSquared(BaseRecommender):
 
         # now stack ucm and ufm
         ucm_ext = vstack([ufm.transpose().multiply(10),
-                          self.ucm[:, [dataset.get_playlist_index_from_id(x)
-                                       for x in target_playlist]]],
+                          self.ucm[:, dataset.playlist_indices(target_playlist)]],
                          format='csr')
         print("UCM ready")
 
         # now build the item user content matrix
         # User Feature x tg_Items
         iucm = self.ucm.dot(urm[:,
-                                [dataset.get_track_index_from_id(x)
-                                 for x in target_tracks]])
+                                dataset.track_indices(target_tracks)])
 
         # usual normalization
         Iu = urm[:,
-                 [dataset.get_track_index_from_id(x)
-                  for x in target_tracks]].sum(axis=0)
+                 dataset.track_indices(target_tracks)].sum(axis=0)
         # save from divide by zero!
         Iu[Iu == 0] = 1
         # since we have to divide the ufm get the reciprocal of this vector
@@ -125,20 +122,19 @@ class xSquared(BaseRecommender):
         print("IUCM ready")
 
         # now stack icm and user content matrix
-        icm_ext = vstack([self.icm[:, [dataset.get_track_index_from_id(x)
-                                       for x in target_tracks]].multiply(10),
+        icm_ext = vstack([self.icm[:, dataset.track_indices(target_tracks)].multiply(10),
                           iucm],
                          format='csr')
 
-        #ucm_ext = ucm_ext[:, [dataset.get_playlist_index_from_id(x) for x in target_playlist]]
-        #icm_ext = icm_ext[:, [dataset.get_track_index_from_id(x) for x in target_tracks]]
+        #ucm_ext = ucm_ext[:, dataset.playlist_indices(target_playlist)]
+        #icm_ext = icm_ext[:, dataset.track_indices(target_tracks)]
 
         # now compute the dot product
         R_hat = dot_chunked_single(ucm_ext.transpose(), icm_ext, topK=500)
 
         # clean urm
-        urm = urm[:, [dataset.get_track_index_from_id(x) for x in target_tracks]]
-        urm = urm[[dataset.get_playlist_index_from_id(x) for x in target_playlist]]
+        urm = urm[:, dataset.track_indices(target_tracks)]
+        urm = urm[dataset.playlist_indices(target_playlist)]
         # put to zero already rated elements
         R_hat[urm.nonzero()] = 0
         R_hat.eliminate_zeros()
@@ -150,18 +146,8 @@ class xSquared(BaseRecommender):
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def getR_hat(self):
         return self.R_hat
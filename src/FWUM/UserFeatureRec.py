@@ -6,7 +6,7 @@ import numpy.linalg as LA
 import scipy.sparse.linalg as sLA
 from sklearn.decomposition import TruncatedSVD
 from sklearn.feature_extraction.text import TfidfTransformer
-from src.utils.matrix_utils import compute_cosine, top_k_filtering, dot_chunked, normalize_by_row
+from src.utils.matrix_utils import compute_cosine, top_k_filtering, dot_chunked, normalize_by_row, csr_topk, top_k_to_recs
 
 
 # 0.08540903264721408 using owners 0.1
@@ -77,7 +77,7 @@ class UserItemFiltering():
 
         # build owner rating matrix
         self.ucm = dataset.build_ucm()
-        orm = dataset.build_owner_item_matrix(self.ucm, urm)[[dataset.get_playlist_index_from_id(x) for x in target_playlist]]
+        orm = dataset.build_owner_item_matrix(self.ucm, urm)[dataset.playlist_indices(target_playlist)]
 
         # build owner feature matrix
         # for each owner the average of the feature of its tracks
@@ -96,8 +96,7 @@ class UserItemFiltering():
 
         # put together the user profile and the owner profile
         # by doing a weighted average
-        ufm = ufm[:, [dataset.get_playlist_index_from_id(
-            x) for x in target_playlist]]
+        ufm = ufm[:, dataset.playlist_indices(target_playlist)]
 
         ufm = ufm.multiply(1) + ofm.multiply(0.1)
 
@@ -114,7 +113,7 @@ class UserItemFiltering():
         # restore original preferences
         # ufm_aug[ufm.nonzero()] = ufm[ufm.nonzero()]
 
-        self.R_hat_fwum = compute_cosine(ufm.transpose(), icm[:, [dataset.get_track_index_from_id(x) for x in target_tracks]], k_filtering=500)
+        self.R_hat_fwum = compute_cosine(ufm.transpose(), icm[:, dataset.track_indices(target_tracks)], k_filtering=500)
 
         # stack the urm
         # ufm = vstack([ufm, urm.transpose().multiply(2)], format='csr')
@@ -132,12 +131,12 @@ class UserItemFiltering():
         # # normalize
         # S_user = normalize_by_row(S_user)
         # self.R_hat_ubf = S_user.dot(urm[:,
-        #     [dataset.get_track_index_from_id(x) for x in target_tracks]])
+        #     dataset.track_indices(target_tracks)])
 
         # # compute content based predictions
         # icm = dataset.add_playlist_to_icm(icm, urm, 0.4)
         # S_cbf = compute_cosine(icm.transpose()[
-        #     [dataset.get_track_index_from_id(x) for x in target_tracks]],
+        #     dataset.track_indices(target_tracks)],
         #     icm, k_filtering=200, shrinkage=50)
 
         # # normalize
@@ -152,10 +151,8 @@ class UserItemFiltering():
         # self.R_hat_cbf = urm[[dataset.get_playlist_index_from_id(
         #     x) for x in target_playlist]].dot(S_cbf.transpose())
 
-        self.urm = self.urm[:, [
-             dataset.get_track_index_from_id(x) for x in target_tracks]]
-        self.urm = self.urm[[dataset.get_playlist_index_from_id(
-             x) for x in target_playlist]]
+        self.urm = self.urm[:, dataset.track_indices(target_tracks)]
+        self.urm = self.urm[dataset.playlist_indices(target_playlist)]
         # self.R_hat_cbf[self.urm.nonzero()] = 0
         # self.R_hat_cbf.eliminate_zeros()
         # self.R_hat_cbf = top_k_filtering(self.R_hat_cbf, 10)
@@ -176,18 +173,8 @@ class UserItemFiltering():
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def predict_cbf(self, at=5):
         return self._predict(self.R_hat_cbf)
@@ -205,18 +192,8 @@ class UserItemFiltering():
         return self._predict(self.R_hat_fwum)
 
     def _predict(self, R_hat, at=5):
-        recs = {}
-        for i in range(0, R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = R_hat.data[R_hat.indptr[i]:
-                                     R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [R_hat.indices[R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def filter_by_topic(self, matrix, dataset):
         # filter ufm
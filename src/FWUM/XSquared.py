@@ -4,6 +4,7 @@ import numpy as np
 import numpy.linalg as LA
 from sklearn.decomposition import TruncatedSVD
 from src.utils.BaseRecommender import BaseRecommender
+from src.utils.matrix_utils import csr_topk, top_k_to_recs
 
 # MAP 0.08440398099977366
 class xSquared(BaseRecommender):
@@ -98,7 +99,7 @@ class xSquared(BaseRecommender):
         print("similarity done")
         np.fill_diagonal(S,np.zeros(S.shape[0]))
         # eliminate non target users
-        S = S[[dataset.get_playlist_index_from_id(x) for x in target_playlist]]
+        S = S[dataset.playlist_indices(target_playlist)]
         # keep only top k similar user for each row
         indices = np.argpartition(S, S.shape[1] - self.k_similar, axis=1)[:, :-self.k_similar] # keep all rows but until k columns
         for i in range(S.shape[0]):
@@ -111,12 +112,11 @@ class xSquared(BaseRecommender):
         # R_hat computation
         self.R_hat = S.dot(urm.tocsc())
         # clean urm
-        urm = urm[[dataset.get_playlist_index_from_id(x) for x in target_playlist]]
+        urm = urm[dataset.playlist_indices(target_playlist)]
         # put to zero already rated elements
         self.R_hat[urm.nonzero()] = 0
         # eliminate non target tracks
-        self.R_hat = self.R_hat[:, [dataset.get_track_index_from_id(
-            x) for x in self.tr_id_list]]
+        self.R_hat = self.R_hat[:, dataset.track_indices(self.tr_id_list)]
         self.R_hat.eliminate_zeros()
         print("R_hat done")
 
@@ -125,18 +125,8 @@ class xSquared(BaseRecommender):
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def predict_one(self, pl_id, at=5, shrinkage=130, k_filtering=95):
         """
@@ -160,7 +150,7 @@ class xSquared(BaseRecommender):
         norm[(norm == 0)] = 1
         # normalize
         icm_w = icm_w.multiply(csr_matrix(1 / norm))
-        icm_t = icm_w.transpose()[[self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        icm_t = icm_w.transpose()[self.dataset.track_indices(self.tr_id_list)]
         # calculate similarity
         print("Calculating similarity")
         sim = icm_t.dot(icm_w)
@@ -177,7 +167,7 @@ class xSquared(BaseRecommender):
         # S_den.data = 1 / S_den.data
         # S_num.data *= S_den.data
         # remove rows from S_num
-        # S_num = S_num[[self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        # S_num = S_num[self.dataset.track_indices(self.tr_id_list)]
         # normalize each row
         s_norm = sim.sum(axis=1)
         s_norm[s_norm == 0] = 1
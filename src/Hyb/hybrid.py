@@ -10,6 +10,7 @@ from src.utils.sim import computeSim
 from src.utils.loader import *
 from scipy.sparse import *
 from src.utils.evaluator import *
+from src.utils.matrix_utils import csr_topk, top_k_to_recs
 
 class SymInj(object):
 
@@ -41,10 +42,8 @@ class SymInj(object):
         print("CBF started")
         # get ICM from dataset, assume it already cleaned
         icm = csr_matrix(dataset.build_icm())
-        S_cb = computeSim(icm.transpose()[[dataset.get_track_index_from_id(x)
-                          for x in self.tr_id_list]], icm, k_filtering=200)
-        S_cf = computeSim(urm.transpose()[[dataset.get_track_index_from_id(x)
-                          for x in self.tr_id_list]], urm, k_filtering=200)
+        S_cb = computeSim(icm.transpose()[dataset.track_indices(self.tr_id_list)], icm, k_filtering=200)
+        S_cf = computeSim(urm.transpose()[dataset.track_indices(self.tr_id_list)], urm, k_filtering=200)
         # Merge Them!
         S = S_cb
         S_lil = lil_matrix(S)
@@ -64,12 +63,9 @@ class SymInj(object):
                 # this is a mess
                 S_lil[row_i, i] = row_cf[np.where(cf_indices == i)]
         S = csr_matrix(S_lil)
-        R_hat = urm[[dataset.get_playlist_index_from_id(x)
-                     for x in self.pl_id_list]].dot(S.transpose())
-        urm_red = urm[[dataset.get_playlist_index_from_id(x)
-                       for x in self.pl_id_list]]
-        urm_red = urm_red[:, [dataset.get_track_index_from_id(x)
-                              for x in self.tr_id_list]]
+        R_hat = urm[dataset.playlist_indices(self.pl_id_list)].dot(S.transpose())
+        urm_red = urm[dataset.playlist_indices(self.pl_id_list)]
+        urm_red = urm_red[:, dataset.track_indices(self.tr_id_list)]
         R_hat[urm_red.nonzero()] = 0
         R_hat.eliminate_zeros()
 
@@ -83,8 +79,7 @@ class SymInj(object):
         S is IxT
         """
         W = lil_matrix((self.S.shape[0], self.S.shape[0]))
-        W[:, [self.dataset.get_track_index_from_id(
-            x) for x in self.tr_id_list]] = self.S
+        W[:, self.dataset.track_indices(self.tr_id_list)] = self.S
         return W
 
     def predict(self, at=5):
@@ -92,18 +87,8 @@ class SymInj(object):
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def get_model(self):
         """
@@ -1,6 +1,7 @@
 from src.utils.loader import *
 from scipy.sparse import *
 import numpy as np
+from src.utils.matrix_utils import csr_topk, top_k_to_recs
 
 
 class ItemBasedFiltering():
@@ -41,7 +42,7 @@ class ItemBasedFiltering():
         S.setdiag(0)
         S.eliminate_zeros()
         # keep only rows of target items
-        S = S[[dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        S = S[dataset.track_indices(self.tr_id_list)]
         print("Similarity matrix done:", S.shape)
         # apply shrinkage factor:
         # Let U_uv be the set of users who rated both by item u and v
@@ -71,13 +72,10 @@ class ItemBasedFiltering():
         # compute ratings
         R_hat = urm.dot(S.transpose()).tocsr()
         # eliminate playlists that are not target
-        R_hat = R_hat[[dataset.get_playlist_index_from_id(x)
-                       for x in self.pl_id_list]]
+        R_hat = R_hat[dataset.playlist_indices(self.pl_id_list)]
         # apply mask for eliminating already rated items
-        urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                           for x in self.pl_id_list]]
-        urm_cleaned = urm_cleaned[:, [dataset.get_track_index_from_id(x)
-                                      for x in self.tr_id_list]]
+        urm_cleaned = urm[dataset.playlist_indices(self.pl_id_list)]
+        urm_cleaned = urm_cleaned[:, dataset.track_indices(self.tr_id_list)]
         print(urm_cleaned.shape, R_hat.shape, S.shape)
         R_hat[urm_cleaned.nonzero()] = 0
         R_hat.eliminate_zeros()
@@ -89,18 +87,8 @@ class ItemBasedFiltering():
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def get_model(self):
         """
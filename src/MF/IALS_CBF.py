@@ -3,6 +3,7 @@ from scipy.sparse import *
 import numpy as np
 from src.utils.loader import *
 from src.utils.evaluator import *
+from src.utils.matrix_utils import ChunkedCSR, cached_similarity, csr_topk, top_k_to_recs
 import numpy.linalg as la
 import scipy.sparse.linalg as sLA
 
@@ -66,14 +67,48 @@ class IALS():
         print("multiplied")
         icm_t = icm.transpose()
         # clean the transposed matrix, we do not need tracks not target
-        icm_t = icm_t[[dataset.get_track_index_from_id(x)
-                       for x in self.tr_id_list]]
+        icm_t = icm_t[dataset.track_indices(self.tr_id_list)]
+        S = cached_similarity(None, ['ials_cbf', shrinkage, k_filtering],
+                              icm_t, icm,
+                              lambda: self._build_similarity(icm_t, icm,
+                                                             shrinkage,
+                                                             k_filtering))
+        print("Similarity matrix ready, let's normalize it!")
+        # zero out diagonal
+        # in the diagonal there is the sim between i and i (1)
+        # maybe it's better to have a lil matrix here
+        # S.setdiag(0)
+        # S.eliminate_zeros()
+        # keep only target rows of URM and target columns
+        urm_cleaned = self.urm[dataset.playlist_indices(self.pl_id_list)]
+        s_norm = S.sum(axis=1)
+        # normalize s
+        S = S.multiply(csr_matrix(np.reciprocal(s_norm)))
+        self.S = S.transpose()
+        # compute ratings
+        R_hat = urm_cleaned.dot(S.transpose().tocsc()).tocsr()
+        print("R_hat done")
+        # apply mask for eliminating already rated items
+        urm_cleaned = urm_cleaned[:, dataset.track_indices(self.tr_id_list)]
+        R_hat[urm_cleaned.nonzero()] = 0
+        R_hat.eliminate_zeros()
+        # eliminate playlist that are not target, already done, to check
+        #R_hat = R_hat[:, [dataset.get_track_index_from_id(
+        #    x) for x in self.tr_id_list]]
+        print("Shape of final matrix: ", R_hat.shape)
+        self.R_hat = R_hat
+
+    def _build_similarity(self, icm_t, icm, shrinkage, k_filtering):
+        """
+        Cosine similarity with shrinkage of the rows of icm_t
+        with the columns of icm, top k_filtering of each row
+        """
         icm_ones = icm.copy()
         print("Copied")
         icm_ones.data = np.ones_like(icm_ones.data)
         chunksize = 1000
         mat_len = icm_t.shape[0]
-        S = None
+        S = ChunkedCSR(icm.shape[1])
         for chunk in range(0, mat_len, chunksize):
             if chunk + chunksize > mat_len:
                 end = mat_len
@@ -104,51 +139,13 @@ class IALS():
 
             print("S_prime filtered")
             S_prime.eliminate_zeros()
-            if S is None:
-                S = S_prime
-            else:
-                # stack matrices vertically
-                S = vstack([S, S_prime], format="csr")
-        print("Similarity matrix ready, let's normalize it!")
-        # zero out diagonal
-        # in the diagonal there is the sim between i and i (1)
-        # maybe it's better to have a lil matrix here
-        # S.setdiag(0)
-        # S.eliminate_zeros()
-        # keep only target rows of URM and target columns
-        urm_cleaned = self.urm[[dataset.get_playlist_index_from_id(x)
-                           for x in self.pl_id_list]]
-        s_norm = S.sum(axis=1)
-        # normalize s
-        S = S.multiply(csr_matrix(np.reciprocal(s_norm)))
-        self.S = S.transpose()
-        # compute ratings
-        R_hat = urm_cleaned.dot(S.transpose().tocsc()).tocsr()
-        print("R_hat done")
-        # apply mask for eliminating already rated items
-        urm_cleaned = urm_cleaned[:, [dataset.get_track_index_from_id(x)
-                                      for x in self.tr_id_list]]
-        R_hat[urm_cleaned.nonzero()] = 0
-        R_hat.eliminate_zeros()
-        # eliminate playlist that are not target, already done, to check
-        #R_hat = R_hat[:, [dataset.get_track_index_from_id(
-        #    x) for x in self.tr_id_list]]
-        print("Shape of final matrix: ", R_hat.shape)
-        self.R_hat = R_hat
+            S.append(S_prime)
+        S = S.tocsr()
+        return S
 
     def predict(self, target_playlist, target_tracks, dataset, at=5):
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
 
 if __name__ == '__main__':
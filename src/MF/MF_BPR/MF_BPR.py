@@ -2,7 +2,7 @@ import numpy as np
 from scipy.sparse import *
 from src.utils.loader import *
 from src.utils.evaluator import *
-from src.utils.matrix_utils import top_k_filtering, dot_chunked
+from src.utils.matrix_utils import top_k_filtering, dot_chunked, dense_top_k_dot, csr_topk, top_k_to_recs
 import subprocess
 import os, sys
 from sklearn.linear_model import SGDRegressor
@@ -66,8 +66,8 @@ class MF_BPR():
             self.eligibleUsers = np.array(self.eligibleUsers, dtype=np.int64)
 
         if self.target_users is None:
-            self.target_users = np.array([dataset.get_playlist_index_from_id(x) for x in tg_playlist], dtype=np.int64)
-            self.target_items = np.array([dataset.get_track_index_from_id(x) for x in tg_tracks], dtype=np.int64)
+            self.target_users = np.array(dataset.playlist_indices(tg_playlist), dtype=np.int64)
+            self.target_items = np.array(dataset.track_indices(tg_tracks), dtype=np.int64)
 
         if self.cythonEpoch is None:
             from src.MF.MF_BPR.MF_BPR_Cython_Epoch import MF_BPR_Cython_Epoch
@@ -106,7 +106,7 @@ class MF_BPR():
         self.H = self.cythonEpoch.get_H()
 
         # build the similarity matrix
-        S = csr_matrix(self.m_dot_chunked(self.H[[self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]], self.H.transpose(), topK=100))
+        S = csr_matrix(self.m_dot_chunked(self.H[self.dataset.track_indices(self.tr_id_list)], self.H.transpose(), topK=100))
         print("S done")
 
         # Normalize S
@@ -118,68 +118,55 @@ class MF_BPR():
 
 
     def _predict(self, R_hat, at=5):
-        recs = {}
-        for i in range(0, R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = R_hat.data[R_hat.indptr[i]:
-                                     R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [R_hat.indices[R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def predict_dot(self, at=5):
-        W = self.W[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]]
-        H = self.H[[self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        W = self.W[self.dataset.playlist_indices(self.pl_id_list)]
+        H = self.H[self.dataset.track_indices(self.tr_id_list)]
         R_hat = np.dot(W, H.transpose())
 
-        urm_cleaned = self.urm[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]]
-        urm_cleaned = urm_cleaned[:, [self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        urm_cleaned = self.urm[self.dataset.playlist_indices(self.pl_id_list)]
+        urm_cleaned = urm_cleaned[:, self.dataset.track_indices(self.tr_id_list)]
 
         R_hat[urm_cleaned.nonzero()] = 0
-        R_hat = csr_matrix(R_hat)
-        R_hat = csr_matrix(top_k_filtering(R_hat, 10))
+        R_hat = top_k_filtering(R_hat, 10)
         return self._predict(R_hat)
 
     def predict_dot_custom(self, urm, at=5):
-        W = self.W[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]]
-        H = self.H[[self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        W = self.W[self.dataset.playlist_indices(self.pl_id_list)]
+        H = self.H[self.dataset.track_indices(self.tr_id_list)]
         R_hat = np.dot(W, H.transpose())
 
-        urm_cleaned = urm[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]]
-        urm_cleaned = urm_cleaned[:, [self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        urm_cleaned = urm[self.dataset.playlist_indices(self.pl_id_list)]
+        urm_cleaned = urm_cleaned[:, self.dataset.track_indices(self.tr_id_list)]
 
         R_hat[urm_cleaned.nonzero()] = 0
-        R_hat = csr_matrix(R_hat)
-        R_hat = csr_matrix(top_k_filtering(R_hat, 10))
+        R_hat = top_k_filtering(R_hat, 10)
         return self._predict(R_hat)
 
     def getR_hat(self, urm):
-        W = self.W[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]]
-        H = self.H[[self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        W = self.W[self.dataset.playlist_indices(self.pl_id_list)]
+        H = self.H[self.dataset.track_indices(self.tr_id_list)]
         R_hat = np.dot(W, H.transpose())
 
-        urm_cleaned = urm[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]]
-        urm_cleaned = urm_cleaned[:, [self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        urm_cleaned = urm[self.dataset.playlist_indices(self.pl_id_list)]
+        urm_cleaned = urm_cleaned[:, self.dataset.track_indices(self.tr_id_list)]
 
         R_hat[urm_cleaned.nonzero()] = 0
-        R_hat = csr_matrix(R_hat)
-        R_hat = csr_matrix(top_k_filtering(R_hat, 50))
+        R_hat = top_k_filtering(R_hat, 50)
         return R_hat
 
     def predict_knn(self, at=5):
-        S = csr_matrix(self.m_dot_chunked(self.H[[self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]], self.H.transpose(), topK=100))
+        S = csr_matrix(self.m_dot_chunked(self.H[self.dataset.track_indices(self.tr_id_list)], self.H.transpose(), topK=100))
         print("S done")
         # Normalize S
         s_norm = S.sum(axis=1)
         S = S.multiply(csr_matrix(np.reciprocal(s_norm)))
         self.S = S.transpose()
-        R_hat = self.urm[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]].dot(S.transpose())
-        urm_cleaned = self.urm[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]]
-        urm_cleaned = urm_cleaned[:, [self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        R_hat = self.urm[self.dataset.playlist_indices(self.pl_id_list)].dot(S.transpose())
+        urm_cleaned = self.urm[self.dataset.playlist_indices(self.pl_id_list)]
+        urm_cleaned = urm_cleaned[:, self.dataset.track_indices(self.tr_id_list)]
 
         R_hat[urm_cleaned.nonzero()] = 0
         R_hat.eliminate_zeros()
@@ -187,14 +174,14 @@ class MF_BPR():
         return self._predict(R_hat)
 
     def getR_hat_knn(self, urm, at=5):
-        S = csr_matrix(self.m_dot_chunked(self.H[[self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]], self.H.transpose(), topK=100))
+        S = csr_matrix(self.m_dot_chunked(self.H[self.dataset.track_indices(self.tr_id_list)], self.H.transpose(), topK=100))
         print("S done")
         # Normalize S
         s_norm = S.sum(axis=1)
         S = S.multiply(csr_matrix(np.reciprocal(s_norm)))
-        R_hat = urm[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]].dot(S.transpose())
-        urm_cleaned = urm[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]]
-        urm_cleaned = urm_cleaned[:, [self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        R_hat = urm[self.dataset.playlist_indices(self.pl_id_list)].dot(S.transpose())
+        urm_cleaned = urm[self.dataset.playlist_indices(self.pl_id_list)]
+        urm_cleaned = urm_cleaned[:, self.dataset.track_indices(self.tr_id_list)]
 
         R_hat[urm_cleaned.nonzero()] = 0
         R_hat.eliminate_zeros()
@@ -202,16 +189,16 @@ class MF_BPR():
         return R_hat
 
     def predict_knn_custom(self, urm, at=5):
-        S = csr_matrix(self.m_dot_chunked(self.H[[self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]], self.H.transpose(), topK=100))
+        S = csr_matrix(self.m_dot_chunked(self.H[self.dataset.track_indices(self.tr_id_list)], self.H.transpose(), topK=100))
         print("S done")
 
         # Normalize S
         s_norm = S.sum(axis=1)
         S = S.multiply(csr_matrix(np.reciprocal(s_norm)))
         self.S = S.transpose()
-        R_hat = urm[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]].dot(S.transpose())
-        urm_cleaned = urm[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]]
-        urm_cleaned = urm_cleaned[:, [self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        R_hat = urm[self.dataset.playlist_indices(self.pl_id_list)].dot(S.transpose())
+        urm_cleaned = urm[self.dataset.playlist_indices(self.pl_id_list)]
+        urm_cleaned = urm_cleaned[:, self.dataset.track_indices(self.tr_id_list)]
 
         R_hat[urm_cleaned.nonzero()] = 0
         R_hat.eliminate_zeros()
@@ -219,24 +206,8 @@ class MF_BPR():
         return self._predict(R_hat)
 
     def m_dot_chunked(self, X, Y, topK, chunksize=1000):
-        result = None
-        start = 0
-        mat_len = X.shape[0]
-        for chunk in range(start, mat_len, chunksize):
-            if chunk + chunksize > mat_len:
-                end = mat_len
-            else:
-                end = chunk + chunksize
-            print('Computing dot product for chunk [{:d}, {:d})...'
-                  .format(chunk, end))
-            X_chunk = X[chunk:end]
-            sub_matrix = np.dot(X_chunk, Y)
-            sub_matrix = csr_matrix(top_k_filtering(sub_matrix, topK))
-            if result is None:
-                result = sub_matrix
-            else:
-                result = vstack([result, sub_matrix], format='csr')
-        return result
+        # blocked products in threads with argpartition top-K
+        return dense_top_k_dot(X, Y, topK, chunksize)
 
     def runCompilationScript(self):
 
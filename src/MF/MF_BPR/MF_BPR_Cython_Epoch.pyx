@@ -25,6 +25,15 @@ import sys
 cimport cython
 from libc.math cimport exp, sqrt, pow
 from libc.stdlib cimport rand, RAND_MAX
+from src.utils.numeric import as_float, compiled_float_dtype
+
+# Floating point type of the factors and of the optimizer caches, float32
+# as the default dtype of the package (src/utils/numeric.py). It is fixed
+# when the module is compiled, RECSYS_FLOAT_DTYPE does not change it: the
+# inputs are converted to it and get_W and get_H return the dtype of the
+# package. Use double and np.float64 here to train in float64
+ctypedef float FLOAT_t
+FLOAT_DTYPE = np.float32
 
 
 cdef struct BPR_sample:
@@ -66,38 +75,38 @@ cdef class MF_BPR_Cython_Epoch:
     cdef int num_target_items
 
     cdef int[:] URM_mask_indices, URM_mask_indptr
-    cdef double [:] URM_data
+    cdef FLOAT_t[:] URM_data
     cdef long [:] row_nnz 
     cdef long [:] row_indices
     cdef long [:] shuffled_idx
 
     # ADAM
-    cdef double[:,:] cache_m_user
-    cdef double[:,:] cache_v_user
+    cdef FLOAT_t[:,:] cache_m_user
+    cdef FLOAT_t[:,:] cache_v_user
 
-    cdef double[:,:] cache_m_item
-    cdef double[:,:] cache_v_item
+    cdef FLOAT_t[:,:] cache_m_item
+    cdef FLOAT_t[:,:] cache_v_item
 
-    cdef double[:] cache_m_user_2
-    cdef double[:] cache_v_user_2
+    cdef FLOAT_t[:] cache_m_user_2
+    cdef FLOAT_t[:] cache_v_user_2
 
-    cdef double[:] cache_m_item_2
-    cdef double[:] cache_v_item_2
+    cdef FLOAT_t[:] cache_m_item_2
+    cdef FLOAT_t[:] cache_v_item_2
 
     # RMSPROP
-    cdef double[:,:] rmsprop_cache_user
-    cdef double[:,:] rmsprop_cache_item
+    cdef FLOAT_t[:,:] rmsprop_cache_user
+    cdef FLOAT_t[:,:] rmsprop_cache_item
 
     # RMSPROP version 2
-    cdef double[:] rmsprop_cache_user_2
-    cdef double[:] rmsprop_cache_item_2
+    cdef FLOAT_t[:] rmsprop_cache_user_2
+    cdef FLOAT_t[:] rmsprop_cache_item_2
 
-    cdef double[:] sgd_cache
-    cdef double[:] sgd_cache_user
+    cdef FLOAT_t[:] sgd_cache
+    cdef FLOAT_t[:] sgd_cache_user
 
     cdef double gamma
 
-    cdef double[:,:] W, H
+    cdef FLOAT_t[:,:] W, H
 
     # refer to Adam Paper
     cdef double beta1
@@ -120,6 +129,8 @@ cdef class MF_BPR_Cython_Epoch:
 
         super(MF_BPR_Cython_Epoch, self).__init__()
 
+        compiled_float_dtype(FLOAT_DTYPE, 'MF_BPR_Cython_Epoch')
+
         self.numPositiveIteractions = int(URM_mask.nnz * epoch_multiplier)
         if num_user_sample is None:
             self.num_user_sample = URM_mask.shape[0]
@@ -131,7 +142,7 @@ cdef class MF_BPR_Cython_Epoch:
 
         self.URM_mask_indices = URM_mask.indices
         self.URM_mask_indptr = URM_mask.indptr
-        self.URM_data = URM_mask.data
+        self.URM_data = as_float(URM_mask.data, FLOAT_DTYPE)
         self.urm_nnz = len(URM_mask.data)
 
         # RMSE part
@@ -141,12 +152,12 @@ cdef class MF_BPR_Cython_Epoch:
         if W is None:
             # W and H cannot be initialized as zero, otherwise the gradient will always be zero
             # self.W = np.multiply(np.random.random((self.n_users, self.num_factors)), 0.1) # it was 0.1
-            self.W = np.random.normal(0, 0.1, (self.n_users, self.num_factors))
-            self.H = np.random.normal(0, 0.1, (self.n_items, self.num_factors))
+            self.W = np.random.normal(0, 0.1, (self.n_users, self.num_factors)).astype(FLOAT_DTYPE)
+            self.H = np.random.normal(0, 0.1, (self.n_items, self.num_factors)).astype(FLOAT_DTYPE)
         
         else:
-            self.W = W
-            self.H = H 
+            self.W = as_float(W, FLOAT_DTYPE)
+            self.H = as_float(H, FLOAT_DTYPE)
 
         # select optimization mode
         if opt_mode=='bpr':
@@ -172,18 +183,18 @@ cdef class MF_BPR_Cython_Epoch:
                     sgd_mode))
 
         if self.useAdaGrad:
-            self.sgd_cache = np.zeros((self.n_items), dtype=float)
-            self.sgd_cache_user = np.zeros((self.n_users), dtype=float)
+            self.sgd_cache = np.zeros((self.n_items), dtype=FLOAT_DTYPE)
+            self.sgd_cache_user = np.zeros((self.n_users), dtype=FLOAT_DTYPE)
         
         # RMSPROP
         elif self.rmsprop:
-            self.rmsprop_cache_item = np.zeros((self.n_items, self.num_factors), dtype=float)
-            self.rmsprop_cache_user = np.zeros((self.n_users, self.num_factors), dtype=float)
+            self.rmsprop_cache_item = np.zeros((self.n_items, self.num_factors), dtype=FLOAT_DTYPE)
+            self.rmsprop_cache_user = np.zeros((self.n_users, self.num_factors), dtype=FLOAT_DTYPE)
             self.gamma = 0.9
 
         elif self.useRmsprop2:
-            self.rmsprop_cache_item_2 = np.zeros((self.n_items), dtype=float)
-            self.rmsprop_cache_user_2 = np.zeros((self.n_users), dtype=float)
+            self.rmsprop_cache_item_2 = np.zeros((self.n_items), dtype=FLOAT_DTYPE)
+            self.rmsprop_cache_user_2 = np.zeros((self.n_users), dtype=FLOAT_DTYPE)
             self.gamma = 0.9
 
         # Adam requirements
@@ -272,12 +283,12 @@ cdef class MF_BPR_Cython_Epoch:
                 self.training_step = 0
 
                 if self.useAdaGrad:
-                    self.sgd_cache = np.zeros((self.n_items), dtype=float)
-                    self.sgd_cache_user = np.zeros((self.n_users), dtype=float)
+                    self.sgd_cache = np.zeros((self.n_items), dtype=FLOAT_DTYPE)
+                    self.sgd_cache_user = np.zeros((self.n_users), dtype=FLOAT_DTYPE)
 
                 elif self.rmsprop:
-                    self.rmsprop_cache_item = np.zeros((self.n_items, self.num_factors), dtype=float)
-                    self.rmsprop_cache_user = np.zeros((self.n_users, self.num_factors), dtype=float)
+                    self.rmsprop_cache_item = np.zeros((self.n_items, self.num_factors), dtype=FLOAT_DTYPE)
+                    self.rmsprop_cache_user = np.zeros((self.n_users, self.num_factors), dtype=FLOAT_DTYPE)
                     self.gamma = 0.9
 
                 # Adam requires
@@ -445,7 +456,6 @@ cdef class MF_BPR_Cython_Epoch:
 
 
 
-<<<<<<< HEAD
                 if((numCurrentBatch%50000==0 and not numCurrentBatch==0) or numCurrentBatch==totalNumberOfBatch-1):
                     print("Processed {} ( {:.2f}% ) in {:.2f} seconds. Sample per second: {:.0f}".format(
                         numCurrentBatch*self.batch_size,
@@ -582,11 +592,11 @@ cdef class MF_BPR_Cython_Epoch:
 
     def get_W(self):
 
-        return np.array(self.W)
+        return as_float(np.array(self.W))
 
 
     def get_H(self):
-        return np.array(self.H)
+        return as_float(np.array(self.H))
 
     @cython.boundscheck(False)
     @cython.wraparound(False)
@@ -737,23 +747,23 @@ cdef class MF_BPR_Cython_Epoch:
         return gradient / (sqrt(new_cache_value) + 1e-8)
 
     cdef void init_Adam(self):
-        self.cache_m_user = np.zeros((self.n_users, self.num_factors), dtype=float)
-        self.cache_v_user = np.zeros((self.n_users, self.num_factors), dtype=float)
-        self.cache_m_item = np.zeros((self.n_items, self.num_factors), dtype=float)
-        self.cache_v_item = np.zeros((self.n_items, self.num_factors), dtype=float)
-        self.training_step_users = np.zeros((self.n_users), dtype=long)
-        self.training_step_items = np.zeros((self.n_items), dtype=long)
+        self.cache_m_user = np.zeros((self.n_users, self.num_factors), dtype=FLOAT_DTYPE)
+        self.cache_v_user = np.zeros((self.n_users, self.num_factors), dtype=FLOAT_DTYPE)
+        self.cache_m_item = np.zeros((self.n_items, self.num_factors), dtype=FLOAT_DTYPE)
+        self.cache_v_item = np.zeros((self.n_items, self.num_factors), dtype=FLOAT_DTYPE)
+        self.training_step_users = np.zeros((self.n_users), dtype=np.int64)
+        self.training_step_items = np.zeros((self.n_items), dtype=np.int64)
         self.beta1 = 0.9
         self.beta2 = 0.999
         self.epsilon = 1e-8
 
     cdef void init_Adam2(self):
-        self.cache_m_user_2 = np.zeros((self.n_users), dtype=float)
-        self.cache_v_user_2 = np.zeros((self.n_users), dtype=float)
-        self.cache_m_item_2 = np.zeros((self.n_items), dtype=float)
-        self.cache_v_item_2 = np.zeros((self.n_items), dtype=float)
-        self.training_step_users = np.zeros((self.n_users), dtype=long)
-        self.training_step_items = np.zeros((self.n_items), dtype=long)
+        self.cache_m_user_2 = np.zeros((self.n_users), dtype=FLOAT_DTYPE)
+        self.cache_v_user_2 = np.zeros((self.n_users), dtype=FLOAT_DTYPE)
+        self.cache_m_item_2 = np.zeros((self.n_items), dtype=FLOAT_DTYPE)
+        self.cache_v_item_2 = np.zeros((self.n_items), dtype=FLOAT_DTYPE)
+        self.training_step_users = np.zeros((self.n_users), dtype=np.int64)
+        self.training_step_items = np.zeros((self.n_items), dtype=np.int64)
         self.beta1 = 0.9
         self.beta2 = 0.999
         self.epsilon = 1e-8
@@ -5,6 +5,7 @@ from src.utils.evaluator import *
 from src.utils.BaseRecommender import BaseRecommender
 from src.CBF.CBF_MF import *
 from src.MF.MF_BPR.MF_BPR import *
+from src.utils.matrix_utils import csr_topk, top_k_to_recs
 
 
 # best params: rmsprop, user_reg 1e-1 item_reg 1e-2 l_rate 5e-2 (or 1e-2) epochMult = 5, n_components = 500
@@ -42,18 +43,8 @@ class MF_BPR_KNN(BaseRecommender):
 
     def predict(self, at=5):
         R_hat = self.R_hat
-        recs = {}
-        for i in range(0, R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = R_hat.data[R_hat.indptr[i]:
-                                R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [R_hat.indices[R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def getR_hat(self):
         return self.R_hat
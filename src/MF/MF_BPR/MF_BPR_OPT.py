@@ -24,7 +24,7 @@ def objective(params):
     ds = Dataset(load_tags=True, filter_tag=True)
     ds.set_track_attr_weights(1, 1, 0.2, 0.2, 0.2)
     ev = Evaluator()
-    ev.cross_validation(5, ds.train_final.copy())
+    ev.shared_cross_validation('cv5', 5, ds)
     mf = MF_BPR()
     urm, tg_tracks, tg_playlist = ev.get_fold(ds)
     best_map = 0.0
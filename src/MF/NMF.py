@@ -58,14 +58,10 @@ class NMF():
                    '] Item factor matrix updated...'))
 
     def predict(self, target_playlist, target_tracks, dataset, at=5):
-        self.U = self.U[[dataset.get_playlist_index_from_id(x)
-                         for x in target_playlist]]
-        self.V = self.V[[dataset.get_track_index_from_id(x)
-                         for x in target_tracks]]
-        self.urm = self.urm[[dataset.get_playlist_index_from_id(x)
-                             for x in target_playlist]]
-        self.urm = self.urm[:, [dataset.get_track_index_from_id(x)
-                                for x in target_tracks]]
+        self.U = self.U[dataset.playlist_indices(target_playlist)]
+        self.V = self.V[dataset.track_indices(target_tracks)]
+        self.urm = self.urm[dataset.playlist_indices(target_playlist)]
+        self.urm = self.urm[:, dataset.track_indices(target_tracks)]
         R_hat = self.U.dot(self.V.transpose())
         R_hat[self.urm.nonzero()] = 0
         R_hat = csr_matrix(R_hat)
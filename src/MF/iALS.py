@@ -3,7 +3,7 @@ from scipy.sparse import *
 import numpy as np
 from src.utils.loader import *
 from src.utils.evaluator import *
-from src.utils.matrix_utils import top_k_filtering
+from src.utils.matrix_utils import top_k_filtering, csr_topk, top_k_to_recs
 from src.utils.BaseRecommender import BaseRecommender
 
 
@@ -55,12 +55,12 @@ class IALS(BaseRecommender):
         print(self.model.user_factors.shape)
 
         # keep only useful user and item factors
-        user_factors = self.model.user_factors[[dataset.get_playlist_index_from_id(x) for x in tg_playlist]]
-        item_factors = self.model.item_factors[[dataset.get_track_index_from_id(x) for x in tg_tracks]]
+        user_factors = self.model.user_factors[dataset.playlist_indices(tg_playlist)]
+        item_factors = self.model.item_factors[dataset.track_indices(tg_tracks)]
 
         # clean urm
-        self.urm = self.urm[[dataset.get_playlist_index_from_id(x) for x in tg_playlist]]
-        self.urm = self.urm[:, [dataset.get_track_index_from_id(x) for x in tg_tracks]]
+        self.urm = self.urm[dataset.playlist_indices(tg_playlist)]
+        self.urm = self.urm[:, dataset.track_indices(tg_tracks)]
 
         self.R_hat = user_factors.dot(item_factors.transpose())
 
@@ -71,18 +71,8 @@ class IALS(BaseRecommender):
         self.R_hat = csr_matrix(self.R_hat)
 
     def predict(self, at=5):
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def getR_hat(self):
         return self.R_hat
@@ -4,7 +4,8 @@ import time
 import sys
 import os
 
-from src.utils.matrix_utils import top_k_filtering, writeSubmission
+from src.utils.matrix_utils import top_k_filtering, writeSubmission, csr_topk, top_k_to_recs
+from src.utils.parallel import get_n_workers
 
 
 class BPRSLIM():
@@ -139,14 +140,11 @@ class BPRSLIM():
 
     def _computeR_hat(self):
         # Compute prediction matrix (n_target_users X n_items)
-        urm_red = self.urm[[self.dataset.get_playlist_index_from_id(x)
-                            for x in self.pl_id_list]]
-        w_red = self.W[:, [self.dataset.get_track_index_from_id(x)
-                           for x in self.tr_id_list]]
+        urm_red = self.urm[self.dataset.playlist_indices(self.pl_id_list)]
+        w_red = self.W[:, self.dataset.track_indices(self.tr_id_list)]
         self.R_hat = urm_red.dot(w_red).tocsr()
         print('R_hat evaluated...')
-        urm_red = urm_red[:, [self.dataset.get_track_index_from_id(x)
-                              for x in self.tr_id_list]]
+        urm_red = urm_red[:, self.dataset.track_indices(self.tr_id_list)]
         # Clean R_hat from already rated entries
         self.R_hat[urm_red.nonzero()] = 0
         self.R_hat.eliminate_zeros()
@@ -154,18 +152,8 @@ class BPRSLIM():
     def _computeRecommendations(self, at=5):
         # returns a dictionary of
         # 'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
 
 class ParallelizedBPRSLIM():
@@ -191,8 +179,8 @@ class ParallelizedBPRSLIM():
         self.evaluator = None
         self.evaluate_every_n_epochs = None
 
-        self.n_tasks = mp.cpu_count()
-        self.max_threads = mp.cpu_count()
+        self.n_tasks = get_n_workers()
+        self.max_threads = get_n_workers()
 
     def fit(self, urm, icm, target_users, target_items, dataset):
         import multiprocessing as mp
@@ -252,14 +240,11 @@ class ParallelizedBPRSLIM():
 
     def _computeR_hat(self):
         # Compute prediction matrix (n_target_users X n_items)
-        urm_red = self.urm[[self.dataset.get_playlist_index_from_id(x)
-                            for x in self.pl_id_list]]
-        w_red = self.W[:, [self.dataset.get_track_index_from_id(x)
-                           for x in self.tr_id_list]]
+        urm_red = self.urm[self.dataset.playlist_indices(self.pl_id_list)]
+        w_red = self.W[:, self.dataset.track_indices(self.tr_id_list)]
         self.R_hat = urm_red.dot(w_red).tocsr()
         print('R_hat evaluated...')
-        urm_red = urm_red[:, [self.dataset.get_track_index_from_id(x)
-                              for x in self.tr_id_list]]
+        urm_red = urm_red[:, self.dataset.track_indices(self.tr_id_list)]
         # Clean R_hat from already rated entries
         self.R_hat[urm_red.nonzero()] = 0
         self.R_hat.eliminate_zeros()
@@ -267,18 +252,8 @@ class ParallelizedBPRSLIM():
     def _computeRecommendations(self, at=5):
         # returns a dictionary of
         # 'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
 
 def _single_run(params):
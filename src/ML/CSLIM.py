@@ -4,6 +4,7 @@ import numpy as np
 
 from src.utils.loader import *
 from src.utils.evaluator import *
+from src.utils.matrix_utils import csr_topk, top_k_to_recs
 
 
 class SLIM():
@@ -31,8 +32,7 @@ class SLIM():
         M = vstack([urm, icm]).tocsc()
         # For each target item train an ElasticNet model
         count = 0
-        for t in [dataset.get_track_index_from_id(x)
-                  for x in target_items]:
+        for t in dataset.track_indices(target_items):
             if count % 100 == 0:
                 print(count, '/', len(target_items), 'ElasticNet trained...')
             # Zero-out the t-th column to meet the w_tt = 0 constraint
@@ -57,8 +57,7 @@ class SLIM():
             # print(self.W[:, t][self.W[:, t].nonzero()][:10])
 
         # clean urm from unwanted users
-        urm = urm[[dataset.get_playlist_index_from_id(x)
-                   for x in self.pl_id_list]]
+        urm = urm[dataset.playlist_indices(self.pl_id_list)]
 
         # Compute prediction matrix (n_target_users X n_items)
         self.R_hat = urm.dot(self.W).tocsr()
@@ -69,26 +68,15 @@ class SLIM():
         self.R_hat.eliminate_zeros()
 
         # Keep only target_item columns
-        self.R_hat = self.R_hat[:, [dataset.get_track_index_from_id(x)
-                                    for x in target_items]]
+        self.R_hat = self.R_hat[:, dataset.track_indices(target_items)]
 
     def predict(self, at=5):
         """
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
 
 if __name__ == '__main__':
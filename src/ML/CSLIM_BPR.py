@@ -8,6 +8,7 @@ from src.utils.loader import *
 from src.utils.evaluator import *
 import random
 from math import exp
+from src.utils.matrix_utils import csr_topk, top_k_to_recs
 
 
 class BPRCSLIM():
@@ -59,10 +60,8 @@ class BPRCSLIM():
         self.tr_id_list = list(target_items)
 
         # List target playlists row indices
-        pl_indices = [dataset.get_playlist_index_from_id(x)
-                      for x in self.pl_id_list]
-        tr_indices = [dataset.get_track_index_from_id(x)
-                      for x in self.tr_id_list]
+        pl_indices = dataset.playlist_indices(self.pl_id_list)
+        tr_indices = dataset.track_indices(self.tr_id_list)
 
         n_workers = 4  # os.cpu_count()
         with Pool(n_workers) as pool:
@@ -95,18 +94,8 @@ class BPRCSLIM():
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
 
 def randomInitTheta(n_items):
@@ -448,11 +437,9 @@ def merge_and_evaluate():
     ds = Dataset(load_tags=True, filter_tag=True)
     urm = ds.build_train_matrix()
     tg_playlist = list(ds.target_playlists.keys())
-    pl_indices = [ds.get_playlist_index_from_id(x)
-                  for x in tg_playlist]
+    pl_indices = ds.playlist_indices(tg_playlist)
     tg_tracks = list(ds.target_tracks.keys())
-    tr_indices = [ds.get_track_index_from_id(x)
-                  for x in tg_tracks]
+    tr_indices = ds.track_indices(tg_tracks)
 
     # Scan for available cslim_bpr_theta backups
     print('Averaging available Thetas...')
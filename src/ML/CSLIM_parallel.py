@@ -8,7 +8,10 @@ from sklearn.feature_extraction.text import TfidfTransformer
 from sklearn.preprocessing import normalize
 from src.utils.loader import *
 from src.utils.evaluator import *
+from src.utils.parallel import get_n_workers, share_matrix, attach_matrix, close_blocks
+from src.utils.parallel import balanced_chunks, run_tasks, TASKS_PER_WORKER
 from src.utils.BaseRecommender import BaseRecommender
+from src.utils.matrix_utils import csr_topk, top_k_to_recs
 
 
 class SLIM(BaseRecommender):
@@ -61,48 +64,51 @@ class SLIM(BaseRecommender):
         # LET's PARALLEL!!!
         # First we get a sorted list of target items column indices.
         #   We want them sorted to improve data locality.
-        target_indeces = sorted([dataset.get_track_index_from_id(x)
-                                 for x in self.tr_id_list])
+        target_indeces = sorted(dataset.track_indices(self.tr_id_list))
 
         # Then we split the target items indices into chunks to ship
-        # to pool workers.
-        chunks = []
-        chunksize = len(target_indeces) // multiprocessing.cpu_count()
-        for i in range(0, len(target_indeces), chunksize):
-            chunks.append(target_indeces[i:i + chunksize])
+        # to pool workers. The cost of an item is the fixed cost of a fit
+        # plus its number of ratings, the chunks have about the same cost
+        # and are more than the workers, so they are balanced dynamically.
+        n_workers = get_n_workers()
+        costs = np.diff(M.indptr)[target_indeces] + M.nnz / M.shape[1]
+        chunks = balanced_chunks(costs, n_workers * TASKS_PER_WORKER)
+
+        # Publish the training matrix once in shared memory, the transpose
+        # of the csc M is a csr with the same arrays
+        shared_M = share_matrix(M.transpose())
 
         # Build a list of parameters to ship to pool workers, containing:
         #   - A chunk of the target items indices
-        #   - The URM
+        #   - The handle of the shared training matrix
         #   - The ElasticNet model
         separated_tasks = []
-        for ti in chunks:
-            separated_tasks.append([ti, M, model])
+        weights = []
+        for c in chunks:
+            separated_tasks.append([target_indeces[c['start']:c['end']],
+                                    shared_M.handle, model])
+            weights.append(costs[c['start']:c['end']].sum())
 
         start = time.time()
 
-        pool = multiprocessing.Pool()
-        result = pool.map(_work, separated_tasks)
-
-        # Merge results from workers and close the pool
-        self.W = None
-        for chunk in result:
-            if self.W is None:
-                self.W = chunk
-            else:
-                self.W = lil_matrix(self.W)
-                self.W = self.W + chunk
+        try:
+            result = run_tasks(_work, separated_tasks, n_workers, weights)
+        finally:
+            shared_M.unlink()
 
-        pool.close()
-        pool.join()
+        # Merge results from workers, each one has its own columns
+        result = [chunk.tocoo() for chunk in result]
+        self.W = coo_matrix((np.concatenate([w.data for w in result]),
+                             (np.concatenate([w.row for w in result]),
+                              np.concatenate([w.col for w in result]))),
+                            shape=(M.shape[1], M.shape[1]))
 
         end = time.time()
 
         print("Time elapsed: ", (end - start) / 60)
 
         # clean urm from unwanted users
-        urm = urm[[dataset.get_playlist_index_from_id(x)
-                   for x in self.pl_id_list]]
+        urm = urm[dataset.playlist_indices(self.pl_id_list)]
 
         self.W = csr_matrix(self.W)
         print(urm.shape, self.W.shape)
@@ -115,26 +121,15 @@ class SLIM(BaseRecommender):
         self.R_hat.eliminate_zeros()
 
         # Keep only target_item columns
-        self.R_hat = self.R_hat[:, [dataset.get_track_index_from_id(x)
-                                    for x in self.tr_id_list]]
+        self.R_hat = self.R_hat[:, dataset.track_indices(self.tr_id_list)]
 
     def predict(self, at=5):
         """
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def getW(self):
         """
@@ -149,7 +144,13 @@ class SLIM(BaseRecommender):
 def _work(params):
     # get params
     target_indeces = params[0]
-    M = csc_matrix(params[1])
+    # The shared csr M_t has the arrays of the csc M: indices and indptr
+    # are used in place, only the data is copied since the fit zeroes
+    # one column at a time
+    M_t, blocks = attach_matrix(params[1])
+    M = csc_matrix((M_t.data.copy(), M_t.indices, M_t.indptr),
+                   shape=M_t.shape[::-1], copy=False)
+    del M_t
     model = params[2]
     count = 0
     pid = os.getpid()
@@ -161,15 +162,18 @@ def _work(params):
                   len(target_indeces), 'ElasticNet trained...')
         # Zero-out the t-th column to meet the w_tt = 0 constraint
         r_t = M.getcol(t).toarray().ravel()
+        column = M.data[M.indptr[t]:M.indptr[t + 1]].copy()
         M.data[M.indptr[t]:M.indptr[t + 1]] = 0
         # Fit
         model.fit(M, r_t)
         # restore matrix
-        M[:, t] = csc_matrix(r_t).transpose()
+        M.data[M.indptr[t]:M.indptr[t + 1]] = column
 
         # Build a W matrix with column indeces from 0 to to_col - from_col
         W[:, t] = model.sparse_coef_.transpose()
         count += 1
+    del M
+    close_blocks(blocks)
     return W
 
 
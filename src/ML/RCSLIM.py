@@ -8,7 +8,9 @@ from sklearn.feature_extraction.text import TfidfTransformer
 from sklearn.preprocessing import normalize
 from src.utils.loader import *
 from src.utils.evaluator import *
+from src.utils.parallel import get_n_workers
 from src.utils.BaseRecommender import BaseRecommender
+from src.utils.matrix_utils import csr_topk, top_k_to_recs
 
 
 class RCSLIM(BaseRecommender):
@@ -60,8 +62,7 @@ class RCSLIM(BaseRecommender):
             self.S = self.solve_alternating(self.urm, self.Q, self.urm, id, self.S, model, 1, self.beta1)
 
         # clean urm from unwanted users
-        urm = urm[[dataset.get_playlist_index_from_id(x)
-                   for x in self.pl_id_list]]
+        urm = urm[dataset.playlist_indices(self.pl_id_list)]
 
         self.Q = csr_matrix(self.Q)
 
@@ -74,26 +75,15 @@ class RCSLIM(BaseRecommender):
         self.R_hat.eliminate_zeros()
 
         # Keep only target_item columns
-        self.R_hat = self.R_hat[:, [dataset.get_track_index_from_id(x)
-                                    for x in self.tr_id_list]]
+        self.R_hat = self.R_hat[:, dataset.track_indices(self.tr_id_list)]
 
     def predict(self, at=5):
         """
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def solve_cslim(self):
         # Build training matrix
@@ -107,13 +97,13 @@ class RCSLIM(BaseRecommender):
         # LET's PARALLEL!!!
         # First we get a sorted list of target items column indices.
         #   We want them sorted to improve data locality.
-        target_indeces = sorted([self.dataset.get_track_index_from_id(x)
-                                 for x in self.tr_id_list])
+        target_indeces = sorted(self.dataset.track_indices(self.tr_id_list))
 
         # Then we split the target items indices into chunks to ship
         # to pool workers.
         chunks = []
-        chunksize = len(target_indeces) // multiprocessing.cpu_count()
+        n_workers = get_n_workers()
+        chunksize = len(target_indeces) // n_workers
         for i in range(0, len(target_indeces), chunksize):
             chunks.append(target_indeces[i:i + chunksize])
 
@@ -127,7 +117,7 @@ class RCSLIM(BaseRecommender):
 
         start = time.time()
 
-        pool = multiprocessing.Pool()
+        pool = multiprocessing.Pool(n_workers)
         result = pool.map(_work, separated_tasks)
 
         # Merge results from workers and close the pool
@@ -160,13 +150,13 @@ class RCSLIM(BaseRecommender):
         # LET's PARALLEL!!!
         # First we get a sorted list of target items column indices.
         #   We want them sorted to improve data locality.
-        target_indeces = sorted([self.dataset.get_track_index_from_id(x)
-                                 for x in self.tr_id_list])
+        target_indeces = sorted(self.dataset.track_indices(self.tr_id_list))
 
         # Then we split the target items indices into chunks to ship
         # to pool workers.
         chunks = []
-        chunksize = len(target_indeces) // multiprocessing.cpu_count()
+        n_workers = get_n_workers()
+        chunksize = len(target_indeces) // n_workers
         for i in range(0, len(target_indeces), chunksize):
             chunks.append(target_indeces[i:i + chunksize])
 
@@ -180,7 +170,7 @@ class RCSLIM(BaseRecommender):
 
         start = time.time()
 
-        pool = multiprocessing.Pool()
+        pool = multiprocessing.Pool(n_workers)
         result = pool.map(_work_alt, separated_tasks)
 
         # Merge results from workers and close the pool
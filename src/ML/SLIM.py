@@ -4,9 +4,10 @@ import numpy as np
 
 from src.utils.loader import *
 from src.utils.evaluator import *
+from src.utils.BaseRecommender import ProductRecommender
 
 
-class SLIM():
+class SLIM(ProductRecommender):
     """docstring for SLIM"""
 
     def __init__(self, l1_reg=0.0000001, l2_reg=0.00000001):
@@ -17,7 +18,12 @@ class SLIM():
         self.pl_id_list = None
         self.tr_id_list = None
 
-    def fit(self, urm, target_items, target_users, dataset):
+    def fit(self, urm, target_items, target_users, dataset, fold=None):
+        """
+        fold: FoldContext of urm, built if not given
+        """
+        fold = FoldContext.ensure(fold, urm, target_users, target_items,
+                                  dataset)
         # Store target playlists and tracks
         self.pl_id_list = list(target_users)
         self.tr_id_list = list(target_items)
@@ -29,8 +35,7 @@ class SLIM():
 
         # For each target item train an ElasticNet model
         count = 0
-        for t in [dataset.get_track_index_from_id(x)
-                  for x in target_items]:
+        for t in fold.tr_indices:
             if count % 100 == 0:
                 print(count, '/', len(target_items), 'ElasticNet trained...')
             # Zero-out the t-th column to meet the w_tt = 0 constraint
@@ -54,39 +59,10 @@ class SLIM():
             # print(repr(self.W[:, t]))
             # print(self.W[:, t][self.W[:, t].nonzero()][:10])
 
-        # clean urm from unwanted users
-        urm = urm[[dataset.get_playlist_index_from_id(x)
-                   for x in self.pl_id_list]]
-
-        # Compute prediction matrix (n_target_users X n_items)
-        self.R_hat = urm.dot(self.W).tocsr()
-        print('R_hat evaluated...')
-
-        # Clean R_hat from already rated entries
-        self.R_hat[urm.nonzero()] = 0
-        self.R_hat.eliminate_zeros()
-
-        # Keep only target_item columns
-        self.R_hat = self.R_hat[:, [dataset.get_track_index_from_id(x)
-                                    for x in target_items]]
-
-    def predict(self, at=5):
-        """
-        returns a dictionary of
-        'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
-        """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        # Prediction matrix (n_target_users X n_target_items) without the
+        # already rated entries, computed by predict
+        self.set_product(fold.urm_target, self.W.tocsc()[:, fold.tr_indices],
+                         fold.urm_target_tracks)
 
 
 if __name__ == '__main__':
@@ -5,7 +5,7 @@ from scipy.sparse import *
 from src.utils.loader import *
 from src.utils.evaluator import *
 from math import sqrt, ceil
-from src.utils.matrix_utils import top_k_filtering
+from src.utils.matrix_utils import top_k_filtering, csr_topk, top_k_to_recs
 
 
 class WARP():
@@ -66,9 +66,8 @@ class WARP():
         print("Training finished")
 
         tg_items = np.array(
-            [dataset.get_track_index_from_id(x) for x in tg_tracks])
-        tg_users = np.array([dataset.get_playlist_index_from_id(x)
-                             for x in tg_playlist])
+            dataset.track_indices(tg_tracks))
+        tg_users = np.array(dataset.playlist_indices(tg_playlist))
 
         n_tg_items = len(tg_items)
         n_tg_users = len(tg_users)
@@ -92,33 +91,13 @@ class WARP():
                                       tg_users)
 
     def predict(self, at=5):
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def predict_custom(self, urm, at=5):
         self.R_hat = self.clean_R_hat(self.R_hat, urm)
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def build_R_hat(self, predictions, user_ids, item_ids, tg_items, tg_users):
         R_hat = coo_matrix((predictions, (user_ids, item_ids)),
@@ -138,8 +117,8 @@ class WARP():
         return R_hat
 
     def clean_R_hat(self, R_hat, urm):
-        urm = urm[:, [self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
-        urm = urm[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]]
+        urm = urm[:, self.dataset.track_indices(self.tr_id_list)]
+        urm = urm[self.dataset.playlist_indices(self.pl_id_list)]
         R_hat[urm.nonzero()] = 0
         R_hat.eliminate_zeros()
         return R_hat
@@ -6,7 +6,7 @@ import numpy.linalg as la
 import scipy.sparse.linalg as sLA
 from sklearn.feature_extraction.text import TfidfTransformer
 from src.utils.feature_weighting import *
-from src.utils.matrix_utils import compute_cosine, top_k_filtering, max_normalize, cluster_per_n_rating
+from src.utils.matrix_utils import compute_cosine, top_k_filtering, max_normalize, cluster_per_n_rating, csr_topk, top_k_to_recs
 from src.utils.BaseRecommender import BaseRecommender
 
 
@@ -39,7 +39,7 @@ class Popularity(BaseRecommender):
         print("Pop started")
 
         # sum all ratings of urm
-        pop = csr_matrix(urm[:, [dataset.get_track_index_from_id(x) for x in self.tr_id_list]].sum(axis=0))
+        pop = csr_matrix(urm[:, dataset.track_indices(self.tr_id_list)].sum(axis=0))
 
         # convert to csr matrix
         pop = csr_matrix(top_k_filtering(pop, topK=self.topK))
@@ -57,8 +57,8 @@ class Popularity(BaseRecommender):
         self.R_hat = self.R_hat.tocsr()
 
         # clean urm
-        urm_cleaned = urm[[dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]]
-        urm_cleaned = urm_cleaned[:, [dataset.get_track_index_from_id(x) for x in self.tr_id_list]]
+        urm_cleaned = urm[dataset.playlist_indices(self.pl_id_list)]
+        urm_cleaned = urm_cleaned[:, dataset.track_indices(self.tr_id_list)]
 
         # clean urm from already rated items
         self.R_hat[urm_cleaned.nonzero()] = 0
@@ -80,18 +80,8 @@ class Popularity(BaseRecommender):
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
 
     def get_model(self):
@@ -134,13 +134,11 @@ class SLIM_BPR_Cython(SLIM_BPR_Python):
   def evaluateRecommendations(self, URM_test, minRatingsPerUser=None, at=5):
     print("Evaluating recommendations")
     # Compute prediction matrix (n_target_users X n_items)
-    urm_red = self.URM_train[[self.dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]]
-    w_red = self.W_sparse[:,[self.dataset.get_track_index_from_id(x)
-                                for x in self.tr_id_list]]
+    urm_red = self.URM_train[self.dataset.playlist_indices(self.pl_id_list)]
+    w_red = self.W_sparse[:,self.dataset.track_indices(self.tr_id_list)]
     self.R_hat = urm_red.dot(w_red).tocsr()
     print('R_hat evaluated...')
-    urm_red = urm_red[:,[self.dataset.get_track_index_from_id(x)
-                                for x in self.tr_id_list]]
+    urm_red = urm_red[:,self.dataset.track_indices(self.tr_id_list)]
     # Clean R_hat from already rated entries
     self.R_hat[urm_red.nonzero()] = 0
     self.R_hat.eliminate_zeros()
@@ -24,6 +24,15 @@ import scipy.sparse as sp
 
 from libc.math cimport exp, sqrt
 from libc.stdlib cimport rand, RAND_MAX
+from src.utils.numeric import as_float, compiled_float_dtype
+
+# Floating point type of the weights, float32 as the default dtype of the
+# package (src/utils/numeric.py). It is fixed when the module is compiled,
+# RECSYS_FLOAT_DTYPE does not change it: the initial S is converted to it
+# and epochIteration_Cython returns the dtype of the package. Use double
+# and np.float64 here to train in float64
+ctypedef float FLOAT_t
+FLOAT_DTYPE = np.float32
 
 
 cdef struct BPR_sample:
@@ -54,7 +63,7 @@ cdef class SLIM_BPR_Cython_Epoch:
 
 
     cdef S_sparse
-    cdef double[:,:] S_dense
+    cdef FLOAT_t[:,:] S_dense
 
 
     def __init__(self, URM_mask, sparse_weights, eligibleUsers, S=None,
@@ -71,6 +80,8 @@ cdef class SLIM_BPR_Cython_Epoch:
 
         super(SLIM_BPR_Cython_Epoch, self).__init__()
 
+        compiled_float_dtype(FLOAT_DTYPE, 'SLIM_BPR_Cython_Epoch')
+
         URM_mask = check_matrix(URM_mask, 'csr')
 
         self.numPositiveIteractions = int(URM_mask.nnz * epochMultiplier)
@@ -90,7 +101,7 @@ cdef class SLIM_BPR_Cython_Epoch:
                 print("Using already init S")
                 self.build_S(S)
         else:
-            self.S_dense = np.zeros((self.n_items, self.n_items), dtype=np.float64)
+            self.S_dense = np.zeros((self.n_items, self.n_items), dtype=FLOAT_DTYPE)
 
 
 
@@ -262,18 +273,18 @@ cdef class SLIM_BPR_Cython_Epoch:
             print("Return S matrix to python caller")
 
             if self.sparse_weights:
-                return self.S_sparse.get_scipy_csr(TopK = False)
+                return as_float(self.S_sparse.get_scipy_csr(TopK = False))
             else:
-                return np.array(self.S_dense)
+                return as_float(np.array(self.S_dense))
 
 
         else :
             print("Return S matrix to python caller")
 
             if self.sparse_weights:
-                return self.S_sparse.get_scipy_csr(TopK=self.topK)
+                return as_float(self.S_sparse.get_scipy_csr(TopK=self.topK))
             else:
-                return similarityMatrixTopK(np.array(self.S_dense.T), k=self.topK, forceSparseOutput=True, inplace=True).T
+                return as_float(similarityMatrixTopK(np.array(self.S_dense.T), k=self.topK, forceSparseOutput=True, inplace=True).T)
 
     def build_S(self,S):
         """
@@ -281,7 +292,7 @@ cdef class SLIM_BPR_Cython_Epoch:
         this method converts the matrix into a Sparse Matrix Tree CSR
         """
         # first transpose the matrix since here we need to handle it by row
-        S = S.transpose()
+        S = as_float(S.transpose(), FLOAT_DTYPE)
         for r in range(S.shape[0]):
             # get all the element
             row = S.data[S.indptr[r]:S.indptr[r+1]]
@@ -387,7 +398,7 @@ cdef matrix_element_tree_s * pointer_new_matrix_element_tree_s(long column, doub
 
 
 # Functions to compare structs to be used in C qsort
-cdef int compare_struct_on_column(const void *a_input, const void *b_input):
+cdef int compare_struct_on_column(const void *a_input, const void *b_input) noexcept nogil:
     """
     The function compares the column contained in the two struct passed.
     If a.column > b.column returns >0  
@@ -403,7 +414,7 @@ cdef int compare_struct_on_column(const void *a_input, const void *b_input):
 
 
 
-cdef int compare_struct_on_data(const void * a_input, const void * b_input):
+cdef int compare_struct_on_data(const void * a_input, const void * b_input) noexcept nogil:
     """
     The function compares the data contained in the two struct passed.
     If a.data > b.data returns >0  
@@ -11,6 +11,7 @@ import time
 import numpy as np
 
 from src.SLIM_BPR.metrics import roc_auc, precision, recall, map, ndcg, rr
+from src.SLIM_BPR.metrics import roc_auc_batch, precision_batch, recall_batch, map_batch, ndcg_batch, rr_batch
 from src.SLIM_BPR.Recommender_utils import check_matrix
 
 
@@ -54,7 +55,7 @@ class Recommender(object):
 
 
     def evaluateRecommendations(self, URM_test_new, at=5, minRatingsPerUser=1, exclude_seen=True,
-                                mode='sequential'):
+                                mode='batch'):
         """
         Speed info:
         - Sparse weighgs: batch mode is 2x faster than sequential
@@ -66,7 +67,7 @@ class Recommender(object):
         :param minRatingsPerUser: 1     Users with less than this number of interactions will not be evaluated
         :param exclude_seen: True       Whether to remove already seen items from the recommended items
 
-        :param mode: 'sequential'
+        :param mode: 'batch'            'batch' scores blocks of users at once, 'sequential' one user at a time
         :return:
         """
 
@@ -92,10 +93,140 @@ class Recommender(object):
 
         if mode=='sequential':
             return self.evaluateRecommendationsSequential(usersToEvaluate)
+        elif mode=='batch':
+            return self.evaluateRecommendationsBatch(usersToEvaluate)
         else:
             raise ValueError("Mode '{}' not available".format(mode))
 
 
+    def recommendBatch(self, user_ids, n=None, exclude_seen=True, filterTopPop=False, filterCustomItems=False):
+        """
+        Returns a (len(user_ids), n) matrix with the ranking of each user,
+        the scores are computed for all the users at once by compute_scores_batch
+        """
+
+        scores = self.compute_scores_batch(user_ids)
+
+        if exclude_seen:
+            seen = self.URM_train[user_ids]
+            scores[seen.nonzero()] = -np.inf
+
+        if filterTopPop:
+            scores[:, self.filterTopPop_ItemsID] = -np.inf
+
+        if filterCustomItems:
+            scores[:, self.filterCustomItems_ItemsID] = -np.inf
+
+        # Same three steps of recommend, on each row
+        relevant_items_partition = (-scores).argpartition(n, axis=1)[:, 0:n]
+        partition_scores = np.take_along_axis(scores, relevant_items_partition, axis=1)
+        relevant_items_partition_sorting = np.argsort(-partition_scores, axis=1)
+        ranking = np.take_along_axis(relevant_items_partition, relevant_items_partition_sorting, axis=1)
+
+        return ranking
+
+
+    def evaluateRecommendationsBatch(self, usersToEvaluate, block_size=1000):
+        """
+        Same metrics of evaluateRecommendationsSequential, computed on
+        blocks of block_size users with the batched metrics
+        """
+
+        start_time = time.time()
+
+        usersToEvaluate = np.asarray(usersToEvaluate, dtype=np.int64)
+        n_eval = len(usersToEvaluate)
+
+        roc_auc_, precision_, recall_, map_, mrr_, ndcg_ = 0.0, 0.0, 0.0, 0.0, 0.0, 0.0
+
+        for start in range(0, n_eval, block_size):
+
+            users = usersToEvaluate[start:start + block_size]
+
+            recommended_items = self.recommendBatch(users, exclude_seen=self.exclude_seen,
+                                                    n=self.at, filterTopPop=self.filterTopPop,
+                                                    filterCustomItems=self.filterCustomItems)
+
+            test = self.URM_test[users]
+            test.sort_indices()
+            n_pos = np.ediff1d(test.indptr)
+
+            rank_scores, is_relevant = self._get_ranked_relevance(recommended_items, test)
+
+            roc_auc_ += roc_auc_batch(is_relevant).sum()
+            precision_ += precision_batch(is_relevant).sum()
+            recall_ += recall_batch(is_relevant, n_pos).sum()
+            map_ += map_batch(is_relevant, n_pos).sum()
+            mrr_ += rr_batch(is_relevant).sum()
+            ndcg_ += ndcg_batch(rank_scores, self._get_ideal_dcg(test)).sum()
+
+            # every 10000 users, as evaluateRecommendationsSequential
+            if (start + len(users)) // 10000 > start // 10000:
+                print("Processed {} ( {:.2f}% ) in {:.2f} seconds. Users per second: {:.0f}".format(
+                                  start + len(users),
+                                  100.0* float(start + len(users))/n_eval,
+                                  time.time()-start_time,
+                                  float(start + len(users))/(time.time()-start_time)))
+
+
+        if (n_eval > 0):
+            roc_auc_ /= n_eval
+            precision_ /= n_eval
+            recall_ /= n_eval
+            map_ /= n_eval
+            mrr_ /= n_eval
+            ndcg_ /= n_eval
+
+        else:
+            print("WARNING: No users had a sufficient number of relevant items")
+
+        results_run = {}
+
+        results_run["AUC"] = roc_auc_
+        results_run["precision"] = precision_
+        results_run["recall"] = recall_
+        results_run["map"] = map_
+        results_run["NDCG"] = ndcg_
+        results_run["MRR"] = mrr_
+
+        return (results_run)
+
+
+    def _get_ranked_relevance(self, recommended_items, test):
+        """
+        Returns the test rating of each recommended item (0 if it is not relevant)
+        and the boolean matrix of the relevant ones
+        """
+        # test is csr with sorted indices, so row * n_items + col is sorted
+        n_items = test.shape[1]
+        test_rows = np.repeat(np.arange(test.shape[0], dtype=np.int64), np.ediff1d(test.indptr))
+        test_keys = test_rows * n_items + test.indices
+        rec_keys = np.arange(recommended_items.shape[0], dtype=np.int64)[:, None] * n_items + recommended_items
+
+        if len(test_keys) == 0:
+            return np.zeros(rec_keys.shape, dtype=np.float32), np.zeros(rec_keys.shape, dtype=bool)
+
+        pos = np.searchsorted(test_keys, rec_keys)
+        pos[pos == len(test_keys)] = 0
+        is_relevant = test_keys[pos] == rec_keys
+
+        rank_scores = np.where(is_relevant, test.data[pos], 0).astype(np.float32)
+        return rank_scores, is_relevant
+
+
+    def _get_ideal_dcg(self, test):
+        """
+        Returns the dcg of the ratings of each user sorted in descending order
+        """
+        n_pos = np.ediff1d(test.indptr)
+        rows = np.repeat(np.arange(test.shape[0]), n_pos)
+        # sort by row and descending rating
+        order = np.lexsort((-test.data, rows))
+        position = np.arange(len(rows)) - test.indptr[rows]
+        gains = (np.power(2, test.data[order]) - 1) / np.log(position + 2, dtype=np.float32)
+        return np.bincount(rows, weights=gains, minlength=test.shape[0]).astype(np.float32)
+
+
     def get_user_relevant_items(self, user_id):
 
         return self.URM_test.indices[self.URM_test.indptr[user_id]:self.URM_test.indptr[user_id+1]]
@@ -8,8 +8,11 @@
 import numpy as np
 import scipy.sparse as sps
 import time
+from src.utils.numeric import get_float_dtype
 
-def check_matrix(X, format='csc', dtype=np.float32):
+def check_matrix(X, format='csc', dtype=None):
+    if dtype is None:
+        dtype = get_float_dtype()
     if format == 'csc' and not isinstance(X, sps.csc_matrix):
         return X.tocsc().astype(dtype)
     elif format == 'csr' and not isinstance(X, sps.csr_matrix):
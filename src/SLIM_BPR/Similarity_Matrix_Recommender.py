@@ -16,6 +16,33 @@ class Similarity_Matrix_Recommender(object):
 
 
 
+    def compute_scores_batch(self, user_ids):
+        """
+        Returns the dense (len(user_ids), n_items) score matrix of the users,
+        with the same normalization of recommend
+        """
+
+        user_profiles = self.URM_train[user_ids]
+
+        if self.sparse_weights:
+            scores = user_profiles.dot(self.W_sparse).toarray()
+        else:
+            scores = np.asarray(user_profiles.dot(self.W))
+
+        if self.normalize:
+            rated = user_profiles.copy()
+            rated.data = np.ones_like(rated.data)
+            if self.sparse_weights:
+                den = rated.dot(self.W_sparse).toarray()
+            else:
+                den = np.asarray(rated.dot(self.W))
+            den[np.abs(den) < 1e-6] = 1.0  # to avoid NaNs
+            scores /= den
+
+        return scores
+
+
+
     def recommend(self, user_id, n=None, exclude_seen=True, filterTopPop = False, filterCustomItems = False):
 
         # compute the scores using the dot product
@@ -74,6 +74,53 @@ def dcg(scores):
                   dtype=np.float32)
 
 
+# Batched versions of the metrics above: is_relevant is a boolean
+# (n_users, at) matrix, one ranked list per row, n_pos the number of
+# relevant items of each user. They return one score per user.
+
+def roc_auc_batch(is_relevant):
+    n_pos = is_relevant.sum(axis=1)
+    n_neg = is_relevant.shape[1] - n_pos
+    # negatives ranked after each relevant item
+    neg_after = n_neg[:, None] - np.cumsum(~is_relevant, axis=1)
+    auc_score = np.sum(neg_after * is_relevant, axis=1, dtype=np.float64)
+    auc_score /= np.maximum(n_pos * n_neg, 1)
+    return np.where(n_neg == 0, 1.0, auc_score)
+
+
+def precision_batch(is_relevant):
+    return np.sum(is_relevant, axis=1, dtype=np.float32) / is_relevant.shape[1]
+
+
+def recall_batch(is_relevant, n_pos):
+    return np.sum(is_relevant, axis=1, dtype=np.float32) / n_pos
+
+
+def rr_batch(is_relevant):
+    first = is_relevant.argmax(axis=1)
+    return np.where(is_relevant.any(axis=1), 1. / (first + 1), 0.0)
+
+
+def map_batch(is_relevant, n_pos):
+    p_at_k = is_relevant * np.cumsum(is_relevant, axis=1, dtype=np.float32) / \
+        (1 + np.arange(is_relevant.shape[1]))
+    return np.sum(p_at_k, axis=1) / np.minimum(n_pos, is_relevant.shape[1])
+
+
+def ndcg_batch(rank_scores, ideal_dcg):
+    """
+    rank_scores: (n_users, at) relevance of the ranked items, 0 if not
+    relevant. ideal_dcg: dcg of the sorted relevances of each user
+    """
+    return dcg_batch(rank_scores) / ideal_dcg
+
+
+def dcg_batch(scores):
+    return np.sum(np.divide(np.power(2, scores) - 1,
+                            np.log(np.arange(scores.shape[1], dtype=np.float32) + 2)),
+                  axis=1, dtype=np.float32)
+
+
 metrics = ['AUC', 'Precision' 'Recall', 'MAP', 'NDCG']
 
 
@@ -6,6 +6,7 @@ from sparsesvd import sparsesvd
 import numpy as np
 import numpy.linalg as LA
 from sklearn.feature_extraction.text import TfidfTransformer
+from src.utils.matrix_utils import csr_topk, top_k_to_recs
 
 
 class ContentBasedFiltering(object):
@@ -58,8 +59,7 @@ class ContentBasedFiltering(object):
         print("Normalization done!")
         icm_t = icm.transpose()
         # clean the transposed matrix, we do not need tracks not target
-        icm_t = icm_t[[dataset.get_track_index_from_id(x)
-                       for x in self.tr_id_list]]
+        icm_t = icm_t[dataset.track_indices(self.tr_id_list)]
         S_prime = icm_t.dot(icm)
         print("S prime computed")
         # compute common features
@@ -87,8 +87,7 @@ class ContentBasedFiltering(object):
         S = S_prime
         # S.setdiag(0)
         # keep only target rows of URM and target columns
-        urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                           for x in self.pl_id_list]]
+        urm_cleaned = urm[dataset.playlist_indices(self.pl_id_list)]
         # get a column vector of the similarities of item i (i is the row)
         s_norm = S.sum(axis=1)
         # normalize s
@@ -97,8 +96,7 @@ class ContentBasedFiltering(object):
         R_hat = urm_cleaned.dot(S.transpose())
         print("R_hat done")
         # apply mask for eliminating already rated items
-        urm_cleaned = urm_cleaned[:, [dataset.get_track_index_from_id(x)
-                                      for x in self.tr_id_list]]
+        urm_cleaned = urm_cleaned[:, dataset.track_indices(self.tr_id_list)]
 
         R_hat[urm_cleaned.nonzero()] = 0
         R_hat.eliminate_zeros()
@@ -109,18 +107,8 @@ class ContentBasedFiltering(object):
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def get_model(self):
         """
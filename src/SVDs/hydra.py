@@ -5,6 +5,7 @@ import numpy.linalg as la
 import scipy.sparse.linalg as sLA
 from src.utils.feature_weighting import *
 import src.utils.matrix_utils as utils
+from src.utils.matrix_utils import csr_topk, top_k_to_recs
 from sparsesvd import sparsesvd
 from src.utils.evaluator import *
 
@@ -52,8 +53,7 @@ class ContentBasedFiltering(object):
         # get only the features of the items
         v = csr_matrix(v[:, 0:icm.shape[1]])
         # get only the item part and compute cosine
-        S = utils.compute_cosine(v.transpose()[[dataset.get_track_index_from_id(x)
-                                      for x in self.tr_id_list]],
+        S = utils.compute_cosine(v.transpose()[dataset.track_indices(self.tr_id_list)],
                                  v,
                                  k_filtering=k_filtering,
                                  shrinkage=shrinkage)
@@ -64,8 +64,7 @@ class ContentBasedFiltering(object):
         # S.setdiag(0)
         # S.eliminate_zeros()
         # keep only target rows of URM and target columns
-        urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                           for x in self.pl_id_list]]
+        urm_cleaned = urm[dataset.playlist_indices(self.pl_id_list)]
         s_norm = S.sum(axis=1)
         # normalize s
         S = S.multiply(csr_matrix(np.reciprocal(s_norm)))
@@ -74,8 +73,7 @@ class ContentBasedFiltering(object):
         R_hat = urm_cleaned.dot(S.transpose().tocsc()).tocsr()
         print("R_hat done")
         # apply mask for eliminating already rated items
-        urm_cleaned = urm_cleaned[:, [dataset.get_track_index_from_id(x)
-                                      for x in self.tr_id_list]]
+        urm_cleaned = urm_cleaned[:, dataset.track_indices(self.tr_id_list)]
         R_hat[urm_cleaned.nonzero()] = 0
         R_hat.eliminate_zeros()
         # eliminate playlist that are not target, already done, to check
@@ -90,7 +88,7 @@ class ContentBasedFiltering(object):
         S is IxT
         """
         W = lil_matrix((self.S.shape[0],self.S.shape[0]))
-        W[:,[self.dataset.get_track_index_from_id(x) for x in self.tr_id_list]] = self.S
+        W[:,self.dataset.track_indices(self.tr_id_list)] = self.S
         return W
 
     def predict(self, at=5):
@@ -98,18 +96,8 @@ class ContentBasedFiltering(object):
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def get_model(self):
         """
@@ -5,6 +5,7 @@ from scipy.sparse import *
 from sparsesvd import sparsesvd
 import numpy as np
 import numpy.linalg as LA
+from src.utils.matrix_utils import csr_topk, top_k_to_recs
 
 
 class CollaborativeSVD(object):
@@ -37,19 +38,15 @@ class CollaborativeSVD(object):
         # Apply SVD on URM and get the item features
         u, s, icm = sparsesvd(urm.tocsc(), features)
         s = np.diag(s)
-        u = u[[dataset.get_playlist_index_from_id(x)
-               for x in self.pl_id_list]]
-        icm = icm[:, [dataset.get_track_index_from_id(x)
-                      for x in self.tr_id_list]]
+        u = u[dataset.playlist_indices(self.pl_id_list)]
+        icm = icm[:, dataset.track_indices(self.tr_id_list)]
         print("SVD Done!")
         R_hat = u.dot(s).dot(icm)
         self.R_hat = R_hat
         print("R_hat done")
-        urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                           for x in self.pl_id_list]]
+        urm_cleaned = urm[dataset.playlist_indices(self.pl_id_list)]
         # apply mask for eliminating already rated items
-        urm_cleaned = urm_cleaned[:, [dataset.get_track_index_from_id(x)
-                                      for x in self.tr_id_list]]
+        urm_cleaned = urm_cleaned[:, dataset.track_indices(self.tr_id_list)]
 
         self.R_hat[urm_cleaned.nonzero()] = 0
         self.R_hat = csr_matrix(self.R_hat)
@@ -63,18 +60,8 @@ class CollaborativeSVD(object):
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def get_model(self):
         """
@@ -7,11 +7,12 @@ import scipy.sparse.linalg as sLA
 from sklearn.feature_extraction.text import TfidfTransformer
 from src.utils.feature_weighting import *
 from src.utils.matrix_utils import compute_cosine, applyTfIdf
-from src.utils.BaseRecommender import BaseRecommender
+from src.utils.BaseRecommender import ProductRecommender
+from src.utils.evaluator import FoldContext
 
 
 
-class UserBasedFiltering(BaseRecommender):
+class UserBasedFiltering(ProductRecommender):
 
     """
     0.06352710548141427
@@ -29,7 +30,7 @@ class UserBasedFiltering(BaseRecommender):
         self.shrinkage = shrinkage
         self.k_filtering = k_filtering
 
-    def fit(self, urm, target_playlist, target_tracks, dataset):
+    def fit(self, urm, target_playlist, target_tracks, dataset, fold=None):
         """
         urm: user rating matrix
         target playlist is a list of playlist id
@@ -38,8 +39,11 @@ class UserBasedFiltering(BaseRecommender):
         S = ICM' ICM
         R = URM S
         In between eliminate useless row of URM and useless cols of S
+        fold: FoldContext of urm, built if not given
         """
         # initialization
+        fold = FoldContext.ensure(fold, urm, target_playlist, target_tracks,
+                                  dataset)
 
         self.pl_id_list = list(target_playlist)
         self.tr_id_list = list(target_tracks)
@@ -74,8 +78,7 @@ class UserBasedFiltering(BaseRecommender):
         ucm = vstack([ucm.multiply(5), urm.transpose().multiply(5), ufm], format='csr')
 
         # compute cosine similarity between users
-        S = compute_cosine(ucm.transpose()[[dataset.get_playlist_index_from_id(x)
-                                            for x in self.pl_id_list]],
+        S = compute_cosine(ucm.transpose()[fold.pl_indices],
                            ucm,
                            k_filtering=self.k_filtering,
                            shrinkage=self.shrinkage)
@@ -85,22 +88,8 @@ class UserBasedFiltering(BaseRecommender):
         S = S.multiply(csr_matrix(np.reciprocal(s_norm)))
         # compute ratings
         print("Similarity matrix ready!")
-        urm_cleaned = urm[:, [dataset.get_track_index_from_id(x)
-                              for x in self.tr_id_list]]
-
-        R_hat = S.dot(urm_cleaned)
-
-        # clean from already rated items
-        print("R_hat done")
-        urm_cleaned = urm_cleaned[[dataset.get_playlist_index_from_id(x)
-                                   for x in self.pl_id_list]]
-        R_hat[urm_cleaned.nonzero()] = 0
-        R_hat.eliminate_zeros()
-        # eliminate playlist that are not target, already done, to check
-        # R_hat = R_hat[:, [dataset.get_track_index_from_id(
-        #    x) for x in self.tr_id_list]]
-        print("Shape of final matrix: ", R_hat.shape)
-        self.R_hat = R_hat
+        # ratings without the already rated items, computed by predict
+        self.set_product(S, fold.urm_tracks, fold.urm_target_tracks)
 
     def getW(self):
         """
@@ -109,33 +98,6 @@ class UserBasedFiltering(BaseRecommender):
         """
         return self.S.tocsr()
 
-    def predict(self, at=5):
-        """
-        returns a dictionary of
-        'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
-        """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
-
-    def getR_hat(self):
-        return self.R_hat
-
-    def get_model(self):
-        """
-        Returns the complete R_hat
-        """
-        return self.R_hat.copy()
-
 
 if __name__ == '__main__':
     ds = Dataset(load_tags=True, filter_tag=False, weight_tag=False)
@@ -6,7 +6,7 @@ import numpy.linalg as la
 import scipy.sparse.linalg as sLA
 from sklearn.feature_extraction.text import TfidfTransformer
 from src.utils.feature_weighting import *
-from src.utils.matrix_utils import compute_cosine, top_k_filtering, max_normalize, normalize_by_row
+from src.utils.matrix_utils import compute_cosine, top_k_filtering, max_normalize, normalize_by_row, csr_topk, top_k_to_recs
 from src.utils.BaseRecommender import BaseRecommender
 from src.CBF.CBF_MF import *
 
@@ -57,8 +57,7 @@ class UBF(BaseRecommender):
 
         # save S
         # compute cosine similarity between users
-        S = compute_cosine(self.r_hat_aug[[dataset.get_playlist_index_from_id(x)
-                                            for x in self.pl_id_list]],
+        S = compute_cosine(self.r_hat_aug[dataset.playlist_indices(self.pl_id_list)],
                            self.r_hat_aug.transpose(),
                            k_filtering=k_filtering,
                            shrinkage=shrinkage)
@@ -69,15 +68,13 @@ class UBF(BaseRecommender):
 
         # compute ratings
         print("Similarity matrix ready!")
-        urm_cleaned = urm[:, [dataset.get_track_index_from_id(x)
-                              for x in self.tr_id_list]]
+        urm_cleaned = urm[:, dataset.track_indices(self.tr_id_list)]
 
         R_hat = S.dot(urm_cleaned)
 
         # clean from already rated items
         print("R_hat done")
-        urm_cleaned = urm_cleaned[[dataset.get_playlist_index_from_id(x)
-                                   for x in self.pl_id_list]]
+        urm_cleaned = urm_cleaned[dataset.playlist_indices(self.pl_id_list)]
         R_hat[urm_cleaned.nonzero()] = 0
         R_hat.eliminate_zeros()
         # eliminate playlist that are not target, already done, to check
@@ -98,18 +95,8 @@ class UBF(BaseRecommender):
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def get_model(self):
         """
@@ -1,6 +1,7 @@
 from src.utils.loader import *
 from scipy.sparse import *
 import numpy as np
+from src.utils.matrix_utils import csr_topk, top_k_to_recs
 
 
 class UserBasedFiltering(object):
@@ -41,9 +42,8 @@ class UserBasedFiltering(object):
         S.setdiag(0)
         S.eliminate_zeros()
         # keep only rows of target playlist
-        S = S[[dataset.get_playlist_index_from_id(x) for x in self.pl_id_list]]
-        urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                           for x in self.pl_id_list]]
+        S = S[dataset.playlist_indices(self.pl_id_list)]
+        urm_cleaned = urm[dataset.playlist_indices(self.pl_id_list)]
         print("Similarity matrix done.")
         # apply shrinkage factor:
         # Let I_uv be the set of items rated both by users u and v
@@ -76,8 +76,7 @@ class UserBasedFiltering(object):
         R_hat[urm_cleaned.nonzero()] = 0
         R_hat.eliminate_zeros()
         # eliminate tracks that are not target
-        R_hat = R_hat[:, [dataset.get_track_index_from_id(
-            x) for x in self.tr_id_list]]
+        R_hat = R_hat[:, dataset.track_indices(self.tr_id_list)]
         print("Shape of final matrix: ", R_hat.shape)
         self.R_hat = R_hat
 
@@ -86,18 +85,8 @@ class UserBasedFiltering(object):
         returns a dictionary of
         'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
         """
-        recs = {}
-        for i in range(0, self.R_hat.shape[0]):
-            pl_id = self.pl_id_list[i]
-            pl_row = self.R_hat.data[self.R_hat.indptr[i]:
-                                     self.R_hat.indptr[i + 1]]
-            # get top 5 indeces. argsort, flip and get first at-1 items
-            sorted_row_idx = np.flip(pl_row.argsort(), axis=0)[0:at]
-            track_cols = [self.R_hat.indices[self.R_hat.indptr[i] + x]
-                          for x in sorted_row_idx]
-            tracks_ids = [self.tr_id_list[x] for x in track_cols]
-            recs[pl_id] = tracks_ids
-        return recs
+        top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
 
     def get_model(self):
         """
@@ -91,13 +91,8 @@ def results_cbf(dataset, ev, urm, icm, tg_tracks, tg_playlist, n_clusters):
             list(tg_playlist),
             list(tg_tracks),
             dataset)
-    recs = cbf.predict()
-    ev.evaluate_fold(recs)
-
-    map_playlists = ev.get_map_playlists()
-    maps = np.array([map_playlists[x] for x in list(tg_playlist)])
-    urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                       for x in list(tg_playlist)]]
+    maps = ev.fold_maps_at(cbf)
+    urm_cleaned = urm[dataset.playlist_indices(list(tg_playlist))]
 
     print("Computing MAP per each clustering...")
     # Compute MAP@5 per cluster of n_features
@@ -148,13 +143,8 @@ def results_ibf(dataset, ev, urm, icm, tg_tracks, tg_playlist, n_clusters):
             list(tg_playlist),
             list(tg_tracks),
             dataset)
-    recs = ibf.predict()
-    ev.evaluate_fold(recs)
-
-    map_playlists = ev.get_map_playlists()
-    maps = np.array([map_playlists[x] for x in list(tg_playlist)])
-    urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                       for x in list(tg_playlist)]]
+    maps = ev.fold_maps_at(ibf)
+    urm_cleaned = urm[dataset.playlist_indices(list(tg_playlist))]
 
     print("Computing MAP per each clustering...")
     # Compute MAP@5 per cluster of n_features
@@ -205,13 +195,8 @@ def results_ubf(dataset, ev, urm, icm, tg_tracks, tg_playlist, n_clusters):
             list(tg_playlist),
             list(tg_tracks),
             dataset)
-    recs = ubf.predict()
-    ev.evaluate_fold(recs)
-
-    map_playlists = ev.get_map_playlists()
-    maps = np.array([map_playlists[x] for x in list(tg_playlist)])
-    urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                       for x in list(tg_playlist)]]
+    maps = ev.fold_maps_at(ubf)
+    urm_cleaned = urm[dataset.playlist_indices(list(tg_playlist))]
 
     print("Computing MAP per each clustering...")
     # Compute MAP@5 per cluster of n_features
@@ -263,13 +248,8 @@ def result_pop_cbf(dataset, ev, urm, icm, tg_tracks, tg_playlist, n_clusters):
             list(tg_playlist),
             list(tg_tracks),
             dataset)
-    recs = cbf.predict()
-    ev.evaluate_fold(recs)
-
-    map_playlists = ev.get_map_playlists()
-    maps = np.array([map_playlists[x] for x in list(tg_playlist)])
-    urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                       for x in list(tg_playlist)]]
+    maps = ev.fold_maps_at(cbf)
+    urm_cleaned = urm[dataset.playlist_indices(list(tg_playlist))]
 
     print("Computing MAP per each clustering...")
     # Compute MAP@5 per cluster of n_features
@@ -322,13 +302,8 @@ def results_xbf(dataset, ev, urm, icm, tg_tracks, tg_playlist, n_clusters):
             list(tg_playlist),
             list(tg_tracks),
             dataset)
-    recs = xbf.predict()
-    ev.evaluate_fold(recs)
-
-    map_playlists = ev.get_map_playlists()
-    maps = np.array([map_playlists[x] for x in list(tg_playlist)])
-    urm_cleaned = urm[[dataset.get_playlist_index_from_id(x)
-                       for x in list(tg_playlist)]]
+    maps = ev.fold_maps_at(xbf)
+    urm_cleaned = urm[dataset.playlist_indices(list(tg_playlist))]
 
     print("Computing MAP per each clustering...")
     # Compute MAP@5 per cluster of n_features
@@ -1,14 +1,18 @@
 from abc import ABC, abstractmethod
+from src.utils.matrix_utils import adapt_r_hat, csr_topk, recommend_top_k
+from src.utils.matrix_utils import remove_seen, top_k_filtering, top_k_to_recs
 
 
 class BaseRecommender(ABC):
 
     @abstractmethod
-    def fit(self, urm, tg_playlist, tg_tracks, dataset):
+    def fit(self, urm, tg_playlist, tg_tracks, dataset, fold=None):
         """
         urm must be an (m, n) csr matrix
         tg_playlist and tg_tracks must be a list of ids
         dataset is the Dataset object
+        fold is the FoldContext of urm, if given its cached
+        projections are used instead of slicing urm again
         """
         pass
 
@@ -16,5 +20,84 @@ class BaseRecommender(ABC):
     def getR_hat(self):
         """
         returns the R_hat as (len(tg_playlist), len(tg_tracks)) csr matrix
+        or dense array (see matrix_utils.adapt_r_hat)
         """
         pass
+
+
+class ProductRecommender(BaseRecommender):
+    """
+    A recommender whose R_hat is X * S without the tracks already in the
+    target playlists. fit passes the factors to set_product, predict
+    takes the top tracks of each playlist from them without building
+    R_hat, which is only built when it is read (e.g. by the ensembles),
+    dense or csr depending on its density
+    """
+
+    def set_product(self, X, S, seen, filter_k=None):
+        """
+        X: target playlists x items, S: items x target tracks
+        seen: urm of the target playlists and tracks
+        filter_k: number of top entries of each row kept in R_hat,
+        all if None
+        """
+        self._product = (X, S, seen, filter_k)
+        self._R_hat = None
+
+    @property
+    def R_hat(self):
+        product = getattr(self, '_product', None)
+        if getattr(self, '_R_hat', None) is None and product is not None:
+            X, S, seen, filter_k = product
+            R_hat = remove_seen(X.dot(S), seen)
+            if filter_k is not None:
+                R_hat = top_k_filtering(R_hat, filter_k)
+            self._R_hat = adapt_r_hat(R_hat)
+        return getattr(self, '_R_hat', None)
+
+    @R_hat.setter
+    def R_hat(self, R_hat):
+        self._R_hat = R_hat
+        self._product = None
+
+    def predict(self, at=5, use_cython=False):
+        """
+        returns a dictionary of
+        'pl_id': ['tr_1', 'tr_at'] for each playlist in target playlist
+        use_cython: see matrix_utils.recommend_top_k
+        """
+        product = getattr(self, '_product', None)
+        if getattr(self, '_R_hat', None) is None and product is not None:
+            X, S, seen, _ = product
+            top_k = recommend_top_k(X, S, at, seen, use_cython=use_cython)
+        else:
+            top_k = csr_topk(self.R_hat, at)
+        return top_k_to_recs(top_k, self.pl_id_list, self.tr_id_list)
+
+    def iter_recommendations(self, block_size=1000, at=5, use_cython=False):
+        """
+        Yields the recommendations of predict by blocks of block_size
+        target playlists, a dictionary 'pl_id': ['tr_1', 'tr_at'] per
+        block. Only the scores of a block are computed at a time, the
+        memory does not grow with the number of target playlists
+        """
+        product = getattr(self, '_product', None)
+        for start in range(0, len(self.pl_id_list), block_size):
+            end = start + block_size
+            if getattr(self, '_R_hat', None) is None and product is not None:
+                X, S, seen, _ = product
+                top_k = recommend_top_k(X[start:end], S, at, seen[start:end],
+                                        use_cython=use_cython)
+            else:
+                top_k = csr_topk(self.R_hat[start:end], at)
+            yield top_k_to_recs(top_k, self.pl_id_list[start:end],
+                                self.tr_id_list)
+
+    def getR_hat(self):
+        return self.R_hat
+
+    def get_model(self):
+        """
+        Returns the complete R_hat
+        """
+        return self.R_hat.copy()
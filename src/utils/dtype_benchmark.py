@@ -0,0 +1,90 @@
+import time
+import tracemalloc
+import numpy as np
+from src.utils.loader import Dataset
+from src.utils.evaluator import Evaluator
+from src.utils.numeric import get_float_dtype, set_float_dtype
+from src.utils.matrix_utils import matrix_nbytes
+from src.IBF.IBF import ItemBasedFiltering
+from src.CBF.CBF import ContentBasedFiltering
+from src.UBF.UBF import UserBasedFiltering
+
+
+def run_models(dataset, evaluator, models, folds):
+    """
+    Fits and evaluates each model {name: factory} on the first folds
+    of evaluator with the current dtype of the package.
+    Returns {name: [{'map', 'recs', 'time', 'peak', 'r_hat'}]}.
+    The peak memory is the one traced in this process, the workers of
+    compute_cosine are not included
+    """
+    results = {name: [] for name in models}
+    evaluator.current_fold_index = -1
+    for fold in range(folds):
+        urm, tg_tracks, tg_playlist = evaluator.get_fold(dataset)
+        for name, factory in models.items():
+            model = factory()
+            tracemalloc.start()
+            start_time = time.time()
+            model.fit(urm.copy(), tg_playlist, tg_tracks, dataset)
+            elapsed = time.time() - start_time
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            R_hat = model.R_hat
+            r_hat_bytes = matrix_nbytes(R_hat)
+            recs = model.predict()
+            results[name].append({'map': evaluator.evaluate_fold(recs),
+                                  'recs': recs,
+                                  'time': elapsed,
+                                  'peak': peak,
+                                  'r_hat': r_hat_bytes,
+                                  'dtype': R_hat.dtype})
+    return results
+
+
+def compare(reference, results):
+    """
+    Prints time, memory and MAP@5 of results against reference
+    (float64) and the share of playlists with the same top 5
+    """
+    for name in reference:
+        for fold, (ref, res) in enumerate(zip(reference[name],
+                                              results[name])):
+            same = np.mean([ref['recs'][k] == res['recs'][k]
+                            for k in ref['recs']])
+            print(('{} fold {:d}: time {:.2f}s -> {:.2f}s, peak {:.1f}MB -> '
+                   '{:.1f}MB, R_hat {:.1f}MB -> {:.1f}MB ({}), '
+                   'MAP@5 {:.6f} -> {:.6f} (diff {:.2e}), '
+                   'same top 5 {:.2%}').format(
+                name, fold, ref['time'], res['time'], ref['peak'] / 2 ** 20,
+                res['peak'] / 2 ** 20, ref['r_hat'] / 2 ** 20,
+                res['r_hat'] / 2 ** 20, res['dtype'], ref['map'],
+                res['map'], abs(ref['map'] - res['map']), same))
+
+
+def main(folds=2):
+    dataset = Dataset(load_tags=True, filter_tag=True)
+    dataset.set_track_attr_weights_2(1, 1, 0, 0, 1, num_rating_weight=0,
+                                     inferred_album=1, inferred_duration=0,
+                                     inferred_playcount=0)
+    dataset.set_playlist_attr_weights(0, 1, 1, 0, 0)
+    evaluator = Evaluator(seed=7)
+    evaluator.cross_validation(5, dataset.train_final.copy())
+    models = {'IBF': ItemBasedFiltering,
+              'CBF': ContentBasedFiltering,
+              'UBF': UserBasedFiltering}
+
+    default = get_float_dtype()
+    results = {}
+    try:
+        for dtype in ['float64', 'float32']:
+            print("Running the models in " + dtype)
+            set_float_dtype(dtype)
+            results[dtype] = run_models(dataset, evaluator, models, folds)
+    finally:
+        set_float_dtype(default)
+    compare(results['float64'], results['float32'])
+
+
+if __name__ == '__main__':
+    main()
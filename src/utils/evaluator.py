@@ -1,7 +1,305 @@
 import random
 import math
-from scipy.sparse import lil_matrix
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+from scipy.sparse import coo_matrix, csr_matrix
 import numpy as np
+from src.utils.parallel import SharedCSR, get_core_budget, set_core_budget
+from src.utils.numeric import as_float
+
+
+def remove_entries(matrix, rows, cols):
+    """
+    Returns a copy of the csr matrix without the entries (rows, cols),
+    built with a single mask over its non zero entries
+    """
+    m = matrix.tocsr()
+    n_cols = m.shape[1]
+    # linear index of every stored entry and of the entries to remove
+    nz_rows = np.repeat(np.arange(m.shape[0], dtype=np.int64),
+                        np.diff(m.indptr))
+    keys = nz_rows * n_cols + m.indices
+    keep = ~np.isin(keys, np.asarray(rows, dtype=np.int64) * n_cols + cols)
+    indptr = np.zeros(m.shape[0] + 1, dtype=m.indptr.dtype)
+    np.cumsum(np.bincount(nz_rows[keep], minlength=m.shape[0]),
+              out=indptr[1:])
+    return csr_matrix((m.data[keep], m.indices[keep], indptr),
+                      shape=m.shape)
+
+
+def evaluate_top_k(top_k, test, at=None, per_user=False):
+    """
+    Evaluates the recommendations of all users in one vectorized pass.
+    top_k: (n_users, K) int array, top_k[u, i] is the column of the
+    i-th recommendation of user u, -1 (or any negative) if missing
+    test: (n_users, n_items) csr matrix, non zero for relevant items
+    at: cutoff, defaults to K
+    Returns a dict with 'map', 'precision', 'recall' and 'ndcg' averaged
+    over users. AP@at is divided by at as in evaluate_fold.
+    With per_user the arrays 'ap', 'precision_u', 'recall_u' and
+    'ndcg_u' are added.
+    """
+    top_k = np.asarray(top_k)
+    if at is None:
+        at = top_k.shape[1]
+    top_k = top_k[:, :at]
+    hits = top_k_hits(top_k, test)
+    n_relevant = np.diff(test.indptr)
+    metrics, per_user_metrics = _metrics_from_hits(hits, n_relevant, at)
+    if per_user:
+        metrics.update(per_user_metrics)
+    return metrics
+
+
+def evaluate_top_k_cutoffs(top_k, test, cutoffs=(1, 5, 10, 20),
+                           per_user=False):
+    """
+    Evaluates the recommendations at several cutoffs in one pass:
+    the hits are computed once on the top max(cutoffs) columns and
+    every cutoff is a slice of them.
+    Returns a dictionary {at: metrics} with the metrics of
+    evaluate_top_k for each cutoff
+    """
+    top_k = np.asarray(top_k)
+    max_at = max(cutoffs)
+    if top_k.shape[1] < max_at:
+        # pad with missing recommendations
+        pad = np.full((top_k.shape[0], max_at - top_k.shape[1]), -1,
+                      dtype=top_k.dtype)
+        top_k = np.hstack([top_k, pad])
+    hits = top_k_hits(top_k[:, :max_at], test)
+    n_relevant = np.diff(test.indptr)
+    results = {}
+    for at in cutoffs:
+        metrics, per_user_metrics = _metrics_from_hits(hits, n_relevant, at)
+        if per_user:
+            metrics.update(per_user_metrics)
+        results[at] = metrics
+    return results
+
+
+def print_cutoffs(results):
+    """
+    Prints the results of evaluate_top_k_cutoffs, a line per cutoff
+    """
+    for at in sorted(results.keys()):
+        print("@{}: ".format(at) + ", ".join(
+            "{}: {:.5f}".format(name, results[at][name])
+            for name in ['map', 'precision', 'recall', 'ndcg', 'mrr']))
+
+
+def top_k_hits(top_k, test):
+    """
+    Returns a boolean array with the shape of top_k,
+    True where top_k[u, i] is a relevant item of user u in test
+    """
+    test = test.tocsr()
+    if not test.has_canonical_format:
+        # tocsr may return test itself, it is not changed in place
+        test = test.copy()
+        test.sum_duplicates()
+    n_items = test.shape[1]
+    # linear index of the relevant items, sorted since test is csr
+    # with sorted indices
+    test_rows = np.repeat(np.arange(test.shape[0], dtype=np.int64),
+                          np.diff(test.indptr))
+    test_keys = test_rows * n_items + test.indices
+    rec_keys = np.arange(top_k.shape[0], dtype=np.int64)[:, None] * n_items + \
+        top_k
+    if test_keys.shape[0] == 0:
+        return np.zeros(top_k.shape, dtype=bool)
+    pos = np.searchsorted(test_keys, rec_keys)
+    pos[pos == test_keys.shape[0]] = 0
+    return (test_keys[pos] == rec_keys) & (top_k >= 0)
+
+
+def _metrics_from_hits(hits, n_relevant, at):
+    """
+    Computes the metrics at cutoff at from the hits matrix
+    """
+    hits = hits[:, :at].astype(np.float64)
+    n_users = hits.shape[0]
+    positions = np.arange(1, hits.shape[1] + 1)
+    # precision at each position, counted only on hits
+    ap = (np.cumsum(hits, axis=1) / positions * hits).sum(axis=1) / at
+    n_hits = hits.sum(axis=1)
+    precision = n_hits / at
+    recall = n_hits / np.maximum(n_relevant, 1)
+    discounts = 1 / np.log2(positions + 1)
+    dcg = (hits * discounts).sum(axis=1)
+    # ideal dcg has all relevant items on top
+    cum_discounts = np.r_[0, np.cumsum(discounts)]
+    idcg = cum_discounts[np.minimum(n_relevant, hits.shape[1])]
+    ndcg = dcg / np.where(idcg == 0, 1, idcg)
+    # reciprocal rank of the first hit, 0 if there is none
+    first = hits.argmax(axis=1)
+    rr = np.where(n_hits > 0, 1 / (first + 1), 0)
+    metrics = {'map': ap.mean() if n_users else 0,
+               'precision': precision.mean() if n_users else 0,
+               'recall': recall.mean() if n_users else 0,
+               'ndcg': ndcg.mean() if n_users else 0,
+               'mrr': rr.mean() if n_users else 0}
+    per_user = {'ap': ap, 'precision_u': precision, 'recall_u': recall,
+                'ndcg_u': ndcg, 'rr_u': rr}
+    return metrics, per_user
+
+
+def recs_to_top_k(recommendation, pl_ids, tr_ids, at):
+    """
+    Converts a dictionary of recommendations {'pl_id': [tr_ids]}, or an
+    iterable of such dictionaries consumed one at a time (as yielded by
+    iter_recommendations), to a (len(pl_ids), at) array of positions in
+    tr_ids. Only the first at tracks of each list are kept, the longer
+    lists are truncated. Lists shorter than at are padded with -1,
+    tracks not in tr_ids are -2. Raises KeyError if playlists of pl_ids
+    have no recommendations
+    """
+    if isinstance(recommendation, dict):
+        recommendation = [recommendation]
+    tr_pos = {tr: j for j, tr in enumerate(tr_ids)}
+    pl_pos = {pl_id: i for i, pl_id in enumerate(pl_ids)}
+    top_k = np.full((len(pl_pos), at), -1, dtype=np.int64)
+    found = np.zeros(len(pl_pos), dtype=bool)
+    for block in recommendation:
+        for pl_id, recs in block.items():
+            i = pl_pos.get(pl_id)
+            if i is None:
+                continue
+            found[i] = True
+            recs = recs[:at]
+            top_k[i, :len(recs)] = [tr_pos.get(tr, -2) for tr in recs]
+    if not found.all():
+        missing = [pl_id for pl_id, i in pl_pos.items() if not found[i]]
+        raise KeyError("{} target playlists have no recommendations, "
+                       "e.g. {!r}".format(len(missing), missing[0]))
+    return top_k
+
+
+# State of the running run_cv, inherited by the forked workers
+_cv_state = {}
+
+
+def _work_run_cv(params):
+    """
+    Fits and evaluates the model of a single fold in a run_cv worker
+    """
+    fold, rows, cols, target_tracks, target_playlist, test, at = params
+    dataset = _cv_state['dataset']
+    set_core_budget(_cv_state['inner_budget'])
+
+    # Attach to the shared URM and hide the ratings of the fold,
+    # remove_entries returns a private copy the model can modify,
+    # with the floating point dtype of the package
+    urm, blocks = SharedCSR.attach(_cv_state['urm_handle'])
+    fold_urm = as_float(remove_entries(urm, rows, cols))
+    del urm
+    for block in blocks:
+        block.close()
+
+    start = time.time()
+    model = _cv_state['model_factory']()
+    model.fit(fold_urm, target_playlist, target_tracks, dataset)
+    fit_time = time.time() - start
+
+    start = time.time()
+    if hasattr(model, 'iter_recommendations'):
+        recommendation = model.iter_recommendations(at=at)
+    else:
+        recommendation = model.predict(at=at)
+    top_k = recs_to_top_k(recommendation, target_playlist, target_tracks, at)
+    predict_time = time.time() - start
+
+    metrics = evaluate_top_k(top_k, test, at=at, per_user=True)
+    return {'fold': fold,
+            'map': metrics['map'],
+            'ap': metrics['ap'],
+            'fit_time': fit_time,
+            'predict_time': predict_time,
+            'pid': os.getpid()}
+
+
+class FoldContext(object):
+    """
+    The urm and the targets of one fold.
+    The projections of the urm on target playlists and target tracks
+    are computed lazily and only once, so models fitted on the same fold
+    share them. Unpacks as (urm, target_tracks, target_playlist).
+    The cached matrices are shared, models must not modify them.
+    """
+
+    def __init__(self, urm, target_tracks, target_playlist, dataset):
+        self.urm = urm.tocsr()
+        self.target_tracks = list(target_tracks)
+        self.target_playlist = list(target_playlist)
+        self.dataset = dataset
+        # projections already computed
+        self._cache = {}
+
+    @staticmethod
+    def ensure(fold, urm, target_playlist, target_tracks, dataset):
+        """
+        Returns fold if given, otherwise a new FoldContext
+        on the arguments of fit
+        """
+        if fold is None:
+            fold = FoldContext(urm, target_tracks, target_playlist, dataset)
+        return fold
+
+    def __iter__(self):
+        return iter((self.urm, self.target_tracks, self.target_playlist))
+
+    def _get(self, key, builder):
+        if key not in self._cache:
+            self._cache[key] = builder()
+        return self._cache[key]
+
+    @property
+    def pl_indices(self):
+        """
+        Row indices of the target playlists
+        """
+        return self._get('pl_indices', lambda: self.dataset.playlist_indices(
+            self.target_playlist))
+
+    @property
+    def tr_indices(self):
+        """
+        Column indices of the target tracks
+        """
+        return self._get('tr_indices', lambda: self.dataset.track_indices(
+            self.target_tracks))
+
+    @property
+    def urm_target(self):
+        """
+        urm restricted to the target playlists
+        """
+        return self._get('urm_target', lambda: self.urm[self.pl_indices])
+
+    @property
+    def urm_tracks(self):
+        """
+        urm restricted to the target tracks
+        """
+        return self._get('urm_tracks', lambda: self.urm[:, self.tr_indices])
+
+    @property
+    def urm_target_tracks(self):
+        """
+        urm restricted to target playlists and target tracks
+        """
+        return self._get('urm_target_tracks',
+                         lambda: self.urm_target[:, self.tr_indices])
+
+    @property
+    def seen(self):
+        """
+        (rows, cols) of the target tracks already in the target playlists,
+        indexed as urm_target_tracks
+        """
+        return self._get('seen', lambda: self.urm_target_tracks.nonzero())
 
 
 class Evaluator(object):
@@ -30,11 +328,41 @@ class Evaluator(object):
 
         self.folds = 0
 
+        # for each fold the (rows, cols) arrays of its hidden ratings
+        self.fold_indices = []
+
+        # for each fold its test matrix in the space of its targets
+        self.local_tests = []
+
+        # seed of the random split, saved with the folds
+        self.seed = seed
+
         # Set the initial seed if specified
         if seed:
             random.seed(seed)
 
-    def cross_validation(self, folds, train_dataset):
+    def _init_folds(self, folds):
+        """
+        Initializes the structures of each fold
+        """
+        self.folds = folds
+        self.test_dictionaries = []
+        self.target_tracks = []
+        self.evaluations = []
+        self.maps_per_fold = []
+        self.fold_indices = []
+        self.local_tests = []
+        self.current_fold_index = -1
+        for i in range(0, folds):
+            self.test_dictionaries.append({})
+            self.target_tracks.append(list())
+            self.evaluations.append(0)
+            self.maps_per_fold.append(0)
+            # (rows, cols) of the hidden ratings of each fold
+            self.fold_indices.append(None)
+            self.local_tests.append(None)
+
+    def cross_validation(self, folds, train_dataset, dataset=None):
         """
         Method for initializing the cross validation
         folds is the number of folds in which the dataset is divided.
@@ -42,14 +370,11 @@ class Evaluator(object):
         This method creates folds dictionaries for testing.
         You have to call get_fold(fold_number, urm)
         to get the urm ready for one iteration of training
+        dataset: if given the index arrays of the hidden ratings of
+        each fold are built here, otherwise on the first get_fold
         """
-        self.folds = folds
         # initialize test dictionary
-        for i in range(0, folds):
-            self.test_dictionaries.append({})
-            self.target_tracks.append(list())
-            self.evaluations.append(0)
-            self.maps_per_fold.append(0)
+        self._init_folds(folds)
 
         # get the size of training set
         training_set_size = sum(
@@ -83,21 +408,126 @@ class Evaluator(object):
             self.target_tracks[fold_index] = list(current_tg_tracks)
             fold_index += 1
 
+        if dataset is not None:
+            for i in range(folds):
+                self.get_fold_indices(i, dataset)
+
+    def save_folds(self, name, dataset, folder='./data/folds/'):
+        """
+        Saves the folds of the cross validation to folder/name.npz
+        as index arrays, together with the seed and the fingerprint
+        of the dataset they were drawn from
+        """
+        os.makedirs(folder, exist_ok=True)
+        arrays = {'folds': self.folds,
+                  'seed': int(self.seed) if self.seed else -1,
+                  'min_playlist_size': self.min_playlist_size,
+                  'fingerprint': dataset.get_sources_fingerprint()}
+        for i in range(self.folds):
+            test_dict = self.test_dictionaries[i]
+            rows, cols = self.get_fold_indices(i, dataset)
+            arrays['rows_{}'.format(i)] = rows.astype(np.int32)
+            arrays['cols_{}'.format(i)] = cols.astype(np.int32)
+            # playlists and lengths keep the order of the test dictionary
+            arrays['playlists_{}'.format(i)] = dataset.playlist_indices(
+                test_dict.keys()).astype(np.int32)
+            arrays['lengths_{}'.format(i)] = np.array(
+                [len(v) for v in test_dict.values()], dtype=np.int32)
+            arrays['targets_{}'.format(i)] = dataset.track_indices(
+                self.target_tracks[i]).astype(np.int32)
+        # write to a temporary file first so that a concurrent
+        # experiment never loads a partial file
+        path = os.path.join(folder, name + '.npz')
+        tmp_path = path + '.{}.tmp.npz'.format(os.getpid())
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    def load_folds(self, name, dataset, folder='./data/folds/'):
+        """
+        Loads the folds saved by save_folds. Raises ValueError
+        if they were drawn from a different dataset
+        """
+        path = os.path.join(folder, name + '.npz')
+        with np.load(path) as store:
+            if str(store['fingerprint']) != dataset.get_sources_fingerprint():
+                raise ValueError("Folds " + path +
+                                 " were drawn from a different dataset")
+            self._init_folds(int(store['folds']))
+            self.min_playlist_size = int(store['min_playlist_size'])
+            seed = int(store['seed'])
+            self.seed = seed if seed != -1 else False
+            for i in range(self.folds):
+                rows = store['rows_{}'.format(i)]
+                cols = store['cols_{}'.format(i)]
+                self.fold_indices[i] = (rows, cols)
+                pl_ids = dataset.playlist_ids(
+                    store['playlists_{}'.format(i)]).tolist()
+                tr_ids = dataset.track_ids(cols).tolist()
+                offsets = np.cumsum(
+                    np.r_[0, store['lengths_{}'.format(i)]]).tolist()
+                self.test_dictionaries[i] = {
+                    pl: tr_ids[offsets[j]:offsets[j + 1]]
+                    for j, pl in enumerate(pl_ids)}
+                self.target_tracks[i] = dataset.track_ids(
+                    store['targets_{}'.format(i)]).tolist()
+
+    def shared_cross_validation(self, name, folds, dataset,
+                                folder='./data/folds/'):
+        """
+        Loads the folds saved with this name if they exist and match the
+        dataset, otherwise draws them with cross_validation and saves them.
+        Experiments using the same name share identical splits.
+        """
+        path = os.path.join(folder, name + '.npz')
+        if os.path.isfile(path):
+            try:
+                self.load_folds(name, dataset, folder)
+            except ValueError as e:
+                # the dataset changed, draw new folds
+                print(e)
+            else:
+                if self.folds != folds:
+                    raise ValueError("Folds " + path + " has {} folds".format(
+                        self.folds))
+                print("Folds loaded from " + path)
+                return
+        self.cross_validation(folds, dataset.train_final.copy(), dataset)
+        self.save_folds(name, dataset, folder)
+        print("Folds saved to " + path)
+
+    def get_fold_indices(self, fold, dataset):
+        """
+        Returns (rows, cols), the urm indices of the ratings
+        hidden in the fold
+        """
+        if self.fold_indices[fold] is None:
+            test_dict = self.test_dictionaries[fold]
+            lengths = [len(v) for v in test_dict.values()]
+            rows = np.repeat(dataset.playlist_indices(test_dict.keys()),
+                             lengths)
+            cols = dataset.track_indices(
+                [tr for v in test_dict.values() for tr in v])
+            self.fold_indices[fold] = (rows, cols)
+        return self.fold_indices[fold]
+
     def get_fold(self, dataset):
         """
         dataset is Dataset object
         Returns:
-        the user rating matrix of the current fold, the target tracks
-        and target playlist
+        a FoldContext with the user rating matrix of the current fold,
+        the target tracks and target playlist. It can be unpacked as
+        urm, target_tracks, target_playlist
         """
         self.current_fold_index = self.current_fold_index + 1
-        current_fold = dataset.build_train_matrix()
-        for k in self.test_dictionaries[self.current_fold_index].keys():
-            playlist_index = dataset.get_playlist_index_from_id(k)
-            for track in self.test_dictionaries[self.current_fold_index][k]:
-                track_index = dataset.get_track_index_from_id(track)
-                current_fold[playlist_index, track_index] = 0
-        return current_fold, self.target_tracks[self.current_fold_index], self.test_dictionaries[self.current_fold_index].keys()
+        rows, cols = self.get_fold_indices(self.current_fold_index, dataset)
+        # the shared urm is stored as URM_DTYPE, the fold has the
+        # floating point dtype of the package
+        current_fold = as_float(remove_entries(
+            dataset.build_train_matrix(copy=False), rows, cols))
+        return FoldContext(current_fold,
+                           self.target_tracks[self.current_fold_index],
+                           self.test_dictionaries[self.current_fold_index].keys(),
+                           dataset)
 
     def get_test_dict(self, fold_index):
         """
@@ -107,58 +537,112 @@ class Evaluator(object):
 
     def get_test_matrix(self, fold, dataset):
         """
-        Returns a lil matrix with ones when the item is in the test set
+        Returns a csr matrix with ones when the item is in the test set
         """
-        pl_list = list(self.test_dictionaries[fold].keys())
-        tr_list = list(self.target_tracks[fold])
-        n_playlist = len(pl_list)
-        n_tracks = len(tr_list)
-        test_M = lil_matrix((dataset.playlists_number, dataset.tracks_number))
-        for pl_index in range(0, n_playlist):
-            pl_id = pl_list[pl_index]
-            pl_index_m = dataset.get_playlist_index_from_id(pl_id)
-            for tr in self.test_dictionaries[fold][pl_id]:
-                tr_index = dataset.get_track_index_from_id(tr)
-                test_M[pl_index_m, tr_index] = 1
-
+        rows, cols = self.get_fold_indices(fold, dataset)
+        test_M = coo_matrix((np.ones(rows.shape[0], dtype=np.float32),
+                             (rows, cols)),
+                            shape=(dataset.playlists_number,
+                                   dataset.tracks_number)).tocsr()
+        test_M.data[:] = 1
         return test_M
 
-    def evaluate_fold(self, recommendation, at=5):
+    def get_local_test_matrix(self, fold):
         """
-        recommendation is the dictionary of recommendation {'playlist ': list}
-        For each playlist in test_dictionary[current_fold] evaluate MAP
+        Returns the test matrix of the fold in the index space of the
+        fold targets: row i is the i-th playlist of the test dictionary
+        (the order of target_playlist in get_fold), column j is the j-th
+        of target_tracks[fold] (the columns of the R_hat of the models)
+        """
+        if self.local_tests[fold] is None:
+            test_dict = self.test_dictionaries[fold]
+            tr_pos = {tr: j for j, tr in enumerate(self.target_tracks[fold])}
+            lengths = [len(v) for v in test_dict.values()]
+            rows = np.repeat(np.arange(len(lengths), dtype=np.int32), lengths)
+            cols = np.array([tr_pos[tr] for v in test_dict.values()
+                             for tr in v], dtype=np.int32)
+            test = coo_matrix((np.ones(rows.shape[0], dtype=np.float32),
+                               (rows, cols)),
+                              shape=(len(lengths),
+                                     len(self.target_tracks[fold]))).tocsr()
+            test.data[:] = 1
+            self.local_tests[fold] = test
+        return self.local_tests[fold]
+
+    def evaluate_fold_top_k(self, top_k, at=5):
+        """
+        top_k is an (n_playlists, K) array of column indices of the
+        target tracks, rows ordered as the target playlists of the
+        current fold, -1 where there is no recommendation.
+        Evaluates MAP@at of the current fold in a single vectorized pass
         """
         if self.current_fold_index < self.folds:
+            fold_index = self.current_fold_index
+            metrics = evaluate_top_k(top_k, self.get_local_test_matrix(
+                fold_index), at=at, per_user=True)
+            map_at_five = metrics['map']
+
+            # save the map@5 of each playlist
             self.map_playlists.clear()
-            cumulated_ap = 0
-            for pl_id in self.test_dictionaries[self.current_fold_index].keys():
-                # avg precision
-                ap = 0
-                item_number = 1
-                relevant_items = 0
-                for tr_id in recommendation[pl_id]:
-                    if tr_id in self.test_dictionaries[self.current_fold_index][pl_id]:
-                        relevant_items += 1
-                        precision = relevant_items / item_number
-                        ap = ap + precision
-                    else:
-                        if tr_id not in self.target_tracks[self.current_fold_index]:
-                            print("WARNING: Track not in target tracks!")
-                    item_number += 1
-                # save the map@5 into the dictionary
-                self.map_playlists[pl_id] = ap / at
-                cumulated_ap = cumulated_ap + (ap / at)
-
-            map_at_five = cumulated_ap / \
-                len(self.test_dictionaries[self.current_fold_index].keys())
-
-            print("MAP@5: " + str(map_at_five), flush=True)
+            self.map_playlists.update(zip(
+                self.test_dictionaries[fold_index].keys(),
+                metrics['ap'].tolist()))
+
+            print("MAP@{:d}: {}".format(at, map_at_five), flush=True)
 
-            fold_index = self.current_fold_index
             self.evaluations[fold_index] = map_at_five
             self.maps_per_fold[fold_index] = self.map_playlists.copy()
             return map_at_five
 
+    def evaluate_fold_cutoffs(self, recommendation, cutoffs=(1, 5, 10, 20),
+                              per_user=True):
+        """
+        Evaluates the current fold at all the cutoffs at once.
+        recommendation is either the dictionary {'pl_id': [tr_ids]}, an
+        iterable of them, or the (n_playlists, K) array accepted by
+        evaluate_fold_top_k,
+        with at least max(cutoffs) recommendations per playlist.
+        Does not change the maps stored for the fold, the per user
+        vectors follow the order of the target playlists
+        """
+        fold_index = self.current_fold_index
+        if not isinstance(recommendation, np.ndarray):
+            recommendation = recs_to_top_k(
+                recommendation, self.test_dictionaries[fold_index].keys(),
+                self.target_tracks[fold_index], max(cutoffs))
+        return evaluate_top_k_cutoffs(recommendation,
+                                      self.get_local_test_matrix(fold_index),
+                                      cutoffs=cutoffs, per_user=per_user)
+
+    def fold_maps_at(self, model, at=5, cutoffs=(1, 5, 10, 20)):
+        """
+        Evaluates the model on the current fold at all the cutoffs with
+        a single predict, prints them and returns the MAP@at of each
+        target playlist
+        """
+        results = self.evaluate_fold_cutoffs(model.predict(at=max(cutoffs)),
+                                             cutoffs=cutoffs)
+        print_cutoffs(results)
+        return results[at]['ap']
+
+    def evaluate_fold(self, recommendation, at=5):
+        """
+        recommendation is the dictionary of recommendation {'playlist ': list}
+        or an iterable of them, e.g. model.iter_recommendations()
+        For each playlist in test_dictionary[current_fold] evaluate MAP@at
+        on its first at recommendations, the rest of a longer list is
+        ignored. Raises KeyError if a playlist has no recommendations
+        """
+        if self.current_fold_index < self.folds:
+            top_k = recs_to_top_k(recommendation,
+                                  self.test_dictionaries[self.current_fold_index].keys(),
+                                  self.target_tracks[self.current_fold_index],
+                                  at)
+            if (top_k == -2).any():
+                print("WARNING: {} tracks not in target tracks!".format(
+                    (top_k == -2).sum()))
+            return self.evaluate_fold_top_k(top_k, at=at)
+
     def map_per_cluster(self, tg_playlist, clusters, n_clusters):
         """
         tg_playlist is a list with the ids of target playlists
@@ -199,6 +683,61 @@ class Evaluator(object):
                     print("Features:", dataset.tracks_final[tr_id])
             print("---------------------------------")
 
+    def run_cv(self, model_factory, dataset, n_jobs=0, at=5):
+        """
+        Fits and evaluates a model on every fold concurrently.
+        model_factory is a function returning a new unfitted model,
+        fitted as fit(urm, target_playlist, target_tracks, dataset)
+        n_jobs is the number of folds run at once, by default as many
+        as the core budget allows. The cores are split among the
+        workers, so the pools of the models (compute_cosine, SLIM)
+        started inside a worker only use its share.
+        The workers are forked: they inherit the dataset without
+        pickling it and attach to the URM published in shared memory.
+        Returns a list with the map, fit_time and predict_time of
+        each fold, the maps are also stored as in evaluate_fold
+        """
+        budget = get_core_budget()
+        if n_jobs == 0:
+            n_jobs = min(self.folds, budget)
+        n_jobs = max(1, min(n_jobs, self.folds))
+
+        tasks = []
+        for fold in range(self.folds):
+            rows, cols = self.get_fold_indices(fold, dataset)
+            tasks.append((fold, rows, cols, self.target_tracks[fold],
+                          list(self.test_dictionaries[fold].keys()),
+                          self.get_local_test_matrix(fold), at))
+
+        shared_urm = SharedCSR(dataset.build_train_matrix(copy=False))
+        _cv_state.update({'dataset': dataset,
+                          'urm_handle': shared_urm.handle,
+                          'model_factory': model_factory,
+                          'inner_budget': max(1, budget // n_jobs)})
+        start = time.time()
+        try:
+            print("Running {} folds on {} workers...".format(self.folds,
+                                                             n_jobs))
+            with ProcessPoolExecutor(n_jobs,
+                                     mp_context=mp.get_context('fork')) \
+                    as executor:
+                results = list(executor.map(_work_run_cv, tasks))
+        finally:
+            _cv_state.clear()
+            shared_urm.unlink()
+
+        for result in results:
+            fold = result['fold']
+            self.evaluations[fold] = result['map']
+            self.maps_per_fold[fold] = dict(zip(
+                self.test_dictionaries[fold].keys(), result['ap'].tolist()))
+            print("Fold {}: MAP@{}: {} fit {:.2f}s predict {:.2f}s".format(
+                fold, at, result['map'], result['fit_time'],
+                result['predict_time']))
+        print("Mean MAP@{}: {} in {:.2f}s".format(
+            at, self.get_mean_map(), time.time() - start))
+        return results
+
     def get_mean_map(self):
         """
         Returns the mean map computed over each fold
@@ -1,4 +1,5 @@
 import csv
+import hashlib
 from scipy.sparse import *
 import numpy as np
 import os.path
@@ -9,6 +10,20 @@ from sklearn.cluster import KMeans
 from sklearn.preprocessing import normalize
 from sklearn.feature_extraction.text import TfidfTransformer
 from operator import indexOf
+from src.utils.numeric import get_float_dtype
+
+
+# kinds of the entries of the icm, used to weight them
+ICM_ARTIST, ICM_ALBUM, ICM_INFERRED_ALBUM, ICM_TAG, ICM_DURATION, \
+    ICM_PLAYCOUNT = range(6)
+ICM_KINDS = 6
+
+# kinds of the entries of the ucm
+UCM_CREATED_AT, UCM_DURATION, UCM_NUMTRACKS, UCM_OWNER, UCM_TITLE = range(5)
+UCM_KINDS = 5
+
+# data type of the user rating matrix
+URM_DTYPE = np.float32
 
 
 class Dataset():
@@ -17,9 +32,42 @@ class Dataset():
     """
 
     def __init__(self, load_tags=False, filter_tag=False, weight_tag=False):
+        self._init_settings(load_tags, weight_tag)
+        self._load_from_csv(filter_tag)
+
+    @classmethod
+    def from_cache(cls, load_tags=False, filter_tag=False, weight_tag=False,
+                   cache_dir='./data/cache/'):
+        """
+        Returns a Dataset loaded from the compiled binary store.
+        The store is keyed by a fingerprint of the source csv files and
+        of the loading options, if it is missing or stale the csv files
+        are parsed once and the store is rebuilt.
+        """
+        ds = cls.__new__(cls)
+        ds._init_settings(load_tags, weight_tag)
+        path = cache_dir + 'dataset_' + \
+            dataset_fingerprint(ds, filter_tag) + '.npz'
+        start_time = time.time()
+        if os.path.isfile(path):
+            load_dataset_cache(path, ds)
+            print("Dataset loaded from cache in {:.2f} seconds".format(
+                  time.time() - start_time))
+        else:
+            print("Dataset cache not found, compiling it to " + path)
+            ds._load_from_csv(filter_tag)
+            ds.urm = ds._build_urm()
+            save_dataset_cache(path, ds)
+            print("Dataset compiled in {:.2f} seconds".format(
+                  time.time() - start_time))
+        return ds
+
+    def _init_settings(self, load_tags, weight_tag):
         # Load_tags is true if need to load tags
         # prefix of data folder
         self.prefix = './data/'
+        # fingerprint of the csv files, computed when needed
+        self.sources_fingerprint = None
         self.load_tags = load_tags
         # if weight tag it's true weight each tag by its frequency
         # and normalize between 0.5 and 1
@@ -39,6 +87,30 @@ class Dataset():
         # for numbers of cluster of ratings
         self.playlist_num_rating_cluster_size = 25
         self.tracks_num_rating_cluster_size = 25
+
+        # weights of attributes of tracks
+        self.artist_weight = 1
+        self.album_weight = 1
+        self.duration_weight = 1
+        self.playcount_weight = 1
+        self.tags_weight = 1
+        self.track_num_rating_weight = 1
+        self.inferred_playcount_weight = 1
+        self.inferred_duration_weight = 1
+        self.inferred_album_weight = 1
+
+        # weights of attributes of playlist
+        self.created_at_weight = 1
+        self.owner_weight = 1
+        self.title_weight = 1
+        self.playlist_duration_weight = 1
+        self.playlist_numtracks_weight = 1
+        self.playlist_num_rating_weight = 1
+
+    def _load_from_csv(self, filter_tag):
+        """
+        Parses the csv files of the dataset and builds mappers and clusters
+        """
         # build tracks mappers
         # track_id_mapper maps tracks id to columns of icm
         # format: {'item_id': column_index}
@@ -48,10 +120,10 @@ class Dataset():
         # format: {'artist_id': {'artist_key': row_index}}
         # tag counter maps tags to its frequency normalized
         self.track_id_mapper, self.track_index_mapper, self.track_attr_mapper, self.attrs_number, self.tag_counter = build_tracks_mappers_clusters(
-          self.prefix + 'tracks_final.csv', self, load_tags, filter_tag)
+          self.prefix + 'tracks_final.csv', self, self.load_tags, filter_tag)
         # extended version
         # self.track_id_mapper, self.track_index_mapper, self.track_attr_mapper, self.attrs_number, self.tag_counter, self.album_artist_counter, self.album_artist = build_tracks_mappers_clusters_ext(
-        #     self.prefix + 'tracks_final.csv', self, load_tags, filter_tag)
+        #     self.prefix + 'tracks_final.csv', self, self.load_tags, filter_tag)
         # build playlist mappers
         # playlist_id_mapper maps playlist id to columns of ucm
         # format: {'item_id': column_index}
@@ -76,24 +148,13 @@ class Dataset():
         # Train final is a dict with pl_key tracks
         self.train_final = load_train_final(self.prefix + 'train_final.csv')
 
-        # weights of attributes of tracks
-        self.artist_weight = 1
-        self.album_weight = 1
-        self.duration_weight = 1
-        self.playcount_weight = 1
-        self.tags_weight = 1
-        self.track_num_rating_weight = 1
-        self.inferred_playcount_weight = 1
-        self.inferred_duration_weight = 1
-        self.inferred_album_weight = 1
-
-        # weights of attributes of playlist
-        self.created_at_weight = 1
-        self.owner_weight = 1
-        self.title_weight = 1
-        self.playlist_duration_weight = 1
-        self.playlist_numtracks_weight = 1
-        self.playlist_num_rating_weight = 1
+    def get_sources_fingerprint(self):
+        """
+        Returns the fingerprint of the csv files the dataset is built from
+        """
+        if self.sources_fingerprint is None:
+            self.sources_fingerprint = sources_fingerprint(self.prefix)
+        return self.sources_fingerprint
 
     def set_track_attr_weights(self, art_w, alb_w, dur_w, playcount_w, tags_w, num_rating_weight=1, artist_album_weight=0.9):
         self.artist_weight = art_w
@@ -127,68 +188,19 @@ class Dataset():
         returns the item content matrix using mappers defined in dataset class
         icm matrix encoded as follows:
         AxI (A is the number of attributes and I is the number of items)
+        The matrix is built from the precomputed triplets, changing the
+        weights only rescales their values
         """
-        icm = lil_matrix((self.attrs_number, self.tracks_number))
-        duration_index = 0
-        playcount_index = 0
-        with open(path, newline='') as csv_file:
-            reader = csv.DictReader(csv_file, delimiter='\t')
-            for row in reader:
-                # get index of this track
-                track_index = self.track_id_mapper[row['track_id']]
-                # set attributes in icm
-                artist_id = row['artist_id']
-                artist_index = self.track_attr_mapper['artist_id'][row['artist_id']]
-                icm[artist_index, track_index] = self.artist_weight
-                # albums
-                albums = parse_csv_array(row['album'])
-                if len(albums) == 0:
-                    # add the None album of that artist
-                    album_index = self.track_attr_mapper['album'][artist_id + 'NONE']
-                    icm[album_index, track_index] = self.inferred_album_weight
-                for album in albums:
-                    album_index = self.track_attr_mapper['album'][album]
-                    icm[album_index, track_index] = self.album_weight
-                # load tags only if specified
-                if self.load_tags:
-                    # tags
-                    tags = parse_csv_array(row['tags'])
-                    for tag in tags:
-                        if tag in self.track_attr_mapper['tags']:
-                            tag_index = self.track_attr_mapper['tags'][tag]
-                            tag_weight = self.tag_counter[tag] * \
-                                self.tags_weight
-                            icm[tag_index, track_index] = tag_weight
-                # duration
-                duration = row['duration']
-                if duration is not None and duration != '' and float(duration) != -1:
-                    # duration = float(duration) - self.min_duration
-                    # duration_offset = min(
-                    #     int(duration / self.duration_int), self.duration_intervals - 1)
-                    duration = float(duration)
-                    # duration_offset = np.digitize(duration, self.duration_bins) - 1
-                    # get the cluster
-                    duration_offset = self.duration_cluster[duration_index]
-                    duration_index_icm = self.track_attr_mapper['duration'] + \
-                        duration_offset
-                    icm[duration_index_icm, track_index] = self.duration_weight
-                    # go ahead with duration index
-                    duration_index += 1
-                # playcount
-                playcount = row['playcount']
-                if playcount is not None and playcount != '' and float(playcount) != -1:
-                    # playcount = float(playcount) - self.min_playcount
-                    # playcount_offset = min(
-                    #     int(playcount / self.playcount_int), self.playcount_intervals - 1)
-                    playcount = float(playcount)
-                    # playcount_offset = np.digitize(playcount, self.playcount_bins) - 1
-                    # get the cluster
-                    playcount_offset = self.playcount_cluster[playcount_index]
-                    playcount_index_icm = self.track_attr_mapper['playcount'] + \
-                        playcount_offset
-                    icm[playcount_index_icm, track_index] = self.playcount_weight
-                    playcount_index += 1
-        return csr_matrix(icm)
+        triplets = self.get_icm_triplets()
+        weights = np.zeros(ICM_KINDS)
+        weights[ICM_ARTIST] = self.artist_weight
+        weights[ICM_ALBUM] = self.album_weight
+        weights[ICM_INFERRED_ALBUM] = self.inferred_album_weight
+        weights[ICM_TAG] = self.tags_weight
+        weights[ICM_DURATION] = self.duration_weight
+        weights[ICM_PLAYCOUNT] = self.playcount_weight
+        return build_from_triplets(triplets, weights,
+                                   (self.attrs_number, self.tracks_number))
 
     def build_icm_2(self, path='./data/tracks_final.csv'):
         """
@@ -197,69 +209,72 @@ class Dataset():
         AxI (A is the number of attributes and I is the number of items)
         """
         return self.build_icm()
-        icm = lil_matrix((self.attrs_number, self.tracks_number))
+
+    def get_icm_triplets(self):
+        """
+        Returns the (rows, cols, values, kinds) arrays of the icm.
+        kinds tells to which attribute each entry belongs, the final
+        value of an entry is its value times the weight of its kind.
+        Computed only once for each dataset.
+        """
+        if getattr(self, 'icm_triplets', None) is not None:
+            return self.icm_triplets
+        rows = []
+        cols = []
+        values = []
+        kinds = []
         duration_index = 0
         playcount_index = 0
-        with open(path, newline='') as csv_file:
-            reader = csv.DictReader(csv_file, delimiter='\t')
-            for row in reader:
-                # get index of this track
-                track_index = self.track_id_mapper[row['track_id']]
-                # set attributes in icm
-                artist_id = row['artist_id']
-                artist_index = self.track_attr_mapper['artist_id'][row['artist_id']]
-                icm[artist_index, track_index] = self.artist_weight
-                # albums
-                albums = parse_csv_array(row['album'])
-                if len(albums) == 0:
-                    # add the None album of that artist
-                    album_index = self.track_attr_mapper['album'][artist_id + 'NONE']
-                    icm[album_index, track_index] = self.inferred_album_weight
-                for album in albums:
-                    album_index = self.track_attr_mapper['album'][album]
-                    icm[album_index, track_index] = self.album_weight
-                # load tags only if specified
-                if self.load_tags:
-                    # tags
-                    tags = parse_csv_array(row['tags'])
-                    for tag in tags:
-                        if tag in self.track_attr_mapper['tags']:
-                            tag_index = self.track_attr_mapper['tags'][tag]
-                            if self.weight_tag:
-                                tag_weight = self.tag_counter[tag] * \
-                                    self.tags_weight
-                            else:
-                                tag_weight = self.tags_weight
-                            icm[tag_index, track_index] = tag_weight
-
-                # duration
-                # get the clusters
+        for tr_id, row in self.tracks_final.items():
+            # get index of this track
+            track_index = self.track_id_mapper[tr_id]
+            # attributes of this track, {row_index: (value, kind)}
+            # an attribute set twice keeps the last value
+            entries = {}
+            artist_id = row['artist_id']
+            artist_index = self.track_attr_mapper['artist_id'][artist_id]
+            entries[artist_index] = (1, ICM_ARTIST)
+            # albums
+            albums = parse_csv_array(row['album'])
+            if len(albums) == 0:
+                # add the None album of that artist
+                album_index = self.track_attr_mapper['album'][artist_id + 'NONE']
+                entries[album_index] = (1, ICM_INFERRED_ALBUM)
+            for album in albums:
+                album_index = self.track_attr_mapper['album'][album]
+                entries[album_index] = (1, ICM_ALBUM)
+            # load tags only if specified
+            if self.load_tags:
+                for tag in parse_csv_array(row['tags']):
+                    if tag in self.track_attr_mapper['tags']:
+                        tag_index = self.track_attr_mapper['tags'][tag]
+                        entries[tag_index] = (self.tag_counter[tag], ICM_TAG)
+            # duration, clusters are indexed over the valid durations
+            duration = row['duration']
+            if duration is not None and duration != '' and float(duration) != -1:
                 duration_offset = self.duration_cluster[duration_index]
                 duration_index_icm = self.track_attr_mapper['duration'] + \
                     duration_offset
-
-                # select what weight to use
-                duration = row['duration']
-                if duration is not None and duration != '' and float(duration) != -1:
-                    icm[duration_index_icm, track_index] = self.duration_weight
-                else:
-                    icm[duration_index_icm, track_index] = self.inferred_duration_weight
-                # go ahead with duration index
+                entries[duration_index_icm] = (1, ICM_DURATION)
                 duration_index += 1
-                # playcount
-                # get the cluster
+            # playcount
+            playcount = row['playcount']
+            if playcount is not None and playcount != '' and float(playcount) != -1:
                 playcount_offset = self.playcount_cluster[playcount_index]
                 playcount_index_icm = self.track_attr_mapper['playcount'] + \
                     playcount_offset
-
-                # playcount
-                playcount = row['playcount']
-                if playcount is not None and playcount != '' and float(playcount) != -1:
-                    icm[playcount_index_icm, track_index] = self.playcount_weight
-                else:
-                    icm[playcount_index_icm, track_index] = self.inferred_playcount_weight
+                entries[playcount_index_icm] = (1, ICM_PLAYCOUNT)
                 playcount_index += 1
-        return csr_matrix(icm)
+            for attr_index, (value, kind) in entries.items():
+                rows.append(attr_index)
+                cols.append(track_index)
+                values.append(value)
+                kinds.append(kind)
+        self.icm_triplets = (np.array(rows, dtype=np.int32),
+                             np.array(cols, dtype=np.int32),
+                             np.array(values, dtype=np.float64),
+                             np.array(kinds, dtype=np.int8))
+        return self.icm_triplets
 
     def build_icm_simple(self, path='./data/tracks_final_processed.csv'):
         """
@@ -381,59 +396,76 @@ class Dataset():
         return iucm
 
     def build_ucm(self, path='./data/playlists_final'):
-        ucm = lil_matrix((self.playlist_attrs_number, self.playlists_number))
-        # for each playlist get its tracks and add its attributes
-        # tracks of a playlist are the indices of urm
-        # keep track of the index for cluster of created at
+        """
+        returns the user content matrix, AxU (A is the number of
+        attributes of playlists and U is the number of playlists)
+        """
+        triplets = self.get_ucm_triplets()
+        weights = np.zeros(UCM_KINDS)
+        weights[UCM_CREATED_AT] = self.created_at_weight
+        weights[UCM_DURATION] = self.playlist_duration_weight
+        weights[UCM_NUMTRACKS] = self.playlist_numtracks_weight
+        weights[UCM_OWNER] = self.owner_weight
+        weights[UCM_TITLE] = self.title_weight
+        return build_from_triplets(
+            triplets, weights,
+            (self.playlist_attrs_number, self.playlists_number))
+
+    def get_ucm_triplets(self):
+        """
+        Returns the (rows, cols, values, kinds) arrays of the ucm,
+        see get_icm_triplets. Computed only once for each dataset.
+        """
+        if getattr(self, 'ucm_triplets', None) is not None:
+            return self.ucm_triplets
+        rows = []
+        cols = []
+        kinds = []
+        # keep track of the index for clusters
         index = 0
         for pl_id in self.playlists_final.keys():
             # check, some playlists are not in the training set
-            if pl_id in self.train_final.keys():
-                # get attributes of the playlist
-                # get created at
+            if pl_id in self.train_final:
+                pl_index = self.get_playlist_index_from_id(pl_id)
+                # {row_index: kind}
+                entries = {}
                 created_at_offset = self.created_at_cluster[index]
-                created_at_index = self.playlist_attr_mapper['created_at'] + \
-                    created_at_offset
+                entries[self.playlist_attr_mapper['created_at'] +
+                        created_at_offset] = UCM_CREATED_AT
                 duration_offset = self.playlist_duration_cluster[index]
-                duration_index = self.playlist_attr_mapper['duration'] + duration_offset
+                entries[self.playlist_attr_mapper['duration'] +
+                        duration_offset] = UCM_DURATION
                 numtracks_offset = self.playlist_numtracks_cluster[index]
-                numtracks_index = self.playlist_attr_mapper['numtracks'] + numtracks_offset
-                # get owner
+                entries[self.playlist_attr_mapper['numtracks'] +
+                        numtracks_offset] = UCM_NUMTRACKS
                 owner = self.playlists_final[pl_id]['owner']
-                owner_index = self.playlist_attr_mapper['owner'][owner]
-                # get title
-                title = self.playlists_final[pl_id]['title']
+                entries[self.playlist_attr_mapper['owner'][owner]] = UCM_OWNER
                 # array of word of the title
-                title_array = parse_csv_array(title)
-                title_index_array = [
-                    self.playlist_attr_mapper['title'][x] for x in title_array]
-                pl_index = self.get_playlist_index_from_id(pl_id)
-                ucm[created_at_index, pl_index] = self.created_at_weight
-                ucm[duration_index, pl_index] = self.playlist_duration_weight
-                ucm[numtracks_index, pl_index] = self.playlist_numtracks_weight
-                ucm[owner_index, pl_index] = self.owner_weight
-                for title_index in title_index_array:
-                    ucm[title_index, pl_index] = self.title_weight
+                title = self.playlists_final[pl_id]['title']
+                for x in parse_csv_array(title):
+                    entries[self.playlist_attr_mapper['title'][x]] = UCM_TITLE
+                for attr_index, kind in entries.items():
+                    rows.append(attr_index)
+                    cols.append(pl_index)
+                    kinds.append(kind)
             index += 1
-        return csr_matrix(ucm)
+        self.ucm_triplets = (np.array(rows, dtype=np.int32),
+                             np.array(cols, dtype=np.int32),
+                             np.ones(len(rows)),
+                             np.array(kinds, dtype=np.int8))
+        return self.ucm_triplets
 
     def build_tags_matrix(self, path='./data/tracks_final.csv'):
         """
         Builds a (n_tags, n_tracks) sparse matrix out of the
         tags from the dataset
         """
-        tags_matrix = lil_matrix((self.attrs_number, self.tracks_number))
-        with open(path, newline='') as csv_file:
-            reader = csv.DictReader(csv_file, delimiter='\t')
-            for row in reader:
-                tags = parse_csv_array(row['tags'])
-                # get index of this track
-                track_index = self.track_id_mapper[row['track_id']]
-                for tag in tags:
-                    if tag in self.track_attr_mapper['tags']:
-                        tag_index = self.track_attr_mapper['tags'][tag]
-                        tags_matrix[tag_index, track_index] = 1
-        return tags_matrix
+        weights = np.zeros(ICM_KINDS)
+        weights[ICM_TAG] = 1
+        rows, cols, _, kinds = self.get_icm_triplets()
+        return build_from_triplets((rows, cols, np.ones(rows.shape[0]), kinds),
+                                   weights,
+                                   (self.attrs_number, self.tracks_number))
 
     def build_artist_matrix(self, icm):
         """
@@ -529,36 +561,63 @@ class Dataset():
         end = start + self.playlist_duration_intervals
         return icm[start:end, :]
 
-    def build_train_matrix(self, filename='csr_urm.npz'):
+    def build_train_matrix(self, filename='csr_urm.npz', mmap_mode=None,
+                           copy=True):
         """
-        Builds the user rating matrix from the dataset.
+        Builds the user rating matrix from the dataset as csr matrix.
         Before loading check if it is already saved in dataset.data + filename
+        mmap_mode: if set (e.g. 'r') the urm is saved as raw arrays in the
+        folder named as filename without extension and memory mapped on load
+        copy: if False returns the matrix held by the dataset, which
+        must not be modified, it is stored as URM_DTYPE while the copies
+        have the floating point dtype of the package
         """
         if self.urm is None:
-            path = self.prefix + filename
+            if mmap_mode is None:
+                path = self.prefix + filename
+            else:
+                path = self.prefix + os.path.splitext(filename)[0] + '/'
             # if the matrix is already serialized load it
             # timing
             start_time = time.time()
-            if os.path.isfile(path):
+            if os.path.exists(path):
                 print("File found, retrieving urm from it.")
-                self.urm = load_sparse_matrix(path)
+                self.urm = load_sparse_matrix(path, mmap_mode=mmap_mode)
+                if self.urm.dtype != URM_DTYPE:
+                    self.urm = self.urm.astype(URM_DTYPE)
                 # print time
                 print("Load from file takes {:.2f} seconds".format(
                       time.time() - start_time))
-                return self.urm
-            self.urm = lil_matrix((self.playlists_number, self.tracks_number))
-            for k, v in self.train_final.items():
-                for track in v:
-                    row = self.playlist_id_mapper[k]
-                    column = self.track_id_mapper[track]
-                    self.urm[row, column] = 1
-            print("Build urm takes {:.2f} seconds".format(
-                time.time() - start_time))
-            print("Serializing urm matrix to " + path)
-            print(self.urm.shape)
-            # serialize it to path
-            save_sparse_matrix(path, self.urm)
-        return self.urm.copy()
+            else:
+                self.urm = self._build_urm()
+                print("Build urm takes {:.2f} seconds".format(
+                    time.time() - start_time))
+                print("Serializing urm matrix to " + path)
+                print(self.urm.shape)
+                # serialize it to path
+                save_sparse_matrix(path, self.urm)
+        if copy:
+            return self.urm.astype(get_float_dtype())
+        return self.urm
+
+    def _build_urm(self):
+        """
+        Builds the user rating matrix from train_final in one shot
+        """
+        lengths = [len(v) for v in self.train_final.values()]
+        rows = np.repeat(
+            np.array([self.playlist_id_mapper[k] for k in self.train_final],
+                     dtype=np.int32), lengths)
+        cols = np.array([self.track_id_mapper[track]
+                         for v in self.train_final.values() for track in v],
+                        dtype=np.int32)
+        urm = coo_matrix((np.ones(rows.shape[0], dtype=URM_DTYPE),
+                          (rows, cols)),
+                         shape=(self.playlists_number, self.tracks_number))
+        urm = urm.tocsr()
+        # a track listed twice in a playlist is still a single rating
+        urm.data[:] = 1
+        return urm
 
     def get_track_id_from_index(self, index):
         return self.track_index_mapper[index]
@@ -572,6 +631,59 @@ class Dataset():
     def get_playlist_index_from_id(self, pl_id):
         return self.playlist_id_mapper[pl_id]
 
+    def _build_id_arrays(self):
+        """
+        Builds the array-backed mappers used by the bulk lookups.
+        Ids are integer encoded, the index of an id is found with a
+        searchsorted on the sorted ids.
+        """
+        self.track_id_array = np.array(
+            [self.track_index_mapper[i] for i in range(self.tracks_number)])
+        self.playlist_id_array = np.array(
+            [self.playlist_index_mapper[i]
+             for i in range(self.playlists_number)])
+        tr_int = self.track_id_array.astype(np.int64)
+        self._track_id_order = np.argsort(tr_int, kind='stable')
+        self._track_id_sorted = tr_int[self._track_id_order]
+        pl_int = self.playlist_id_array.astype(np.int64)
+        self._playlist_id_order = np.argsort(pl_int, kind='stable')
+        self._playlist_id_sorted = pl_int[self._playlist_id_order]
+
+    def track_indices(self, ids):
+        """
+        Returns the array of column indices of the track ids in ids.
+        ids can be any iterable of ids, as strings or integers
+        """
+        if getattr(self, 'track_id_array', None) is None:
+            self._build_id_arrays()
+        return lookup_indices(self._track_id_sorted, self._track_id_order,
+                              ids)
+
+    def playlist_indices(self, ids):
+        """
+        Returns the array of row indices of the playlist ids in ids
+        """
+        if getattr(self, 'playlist_id_array', None) is None:
+            self._build_id_arrays()
+        return lookup_indices(self._playlist_id_sorted,
+                              self._playlist_id_order, ids)
+
+    def track_ids(self, indices):
+        """
+        Returns the array of track ids (as strings) of the column indices
+        """
+        if getattr(self, 'track_id_array', None) is None:
+            self._build_id_arrays()
+        return self.track_id_array[indices]
+
+    def playlist_ids(self, indices):
+        """
+        Returns the array of playlist ids (as strings) of the row indices
+        """
+        if getattr(self, 'playlist_id_array', None) is None:
+            self._build_id_arrays()
+        return self.playlist_id_array[indices]
+
     def build_target_tracks_mask(self, start, end):
         """
         Returns a (end-start) X #items lil_matrix whose non-zero
@@ -696,6 +808,39 @@ class Dataset():
         pass
 
 
+def build_from_triplets(triplets, weights, shape):
+    """
+    Builds a csr matrix from (rows, cols, values, kinds) triplets.
+    The value of each entry is multiplied by weights[kind],
+    entries with weight 0 are not stored.
+    The matrix has the floating point dtype of the package
+    """
+    rows, cols, values, kinds = triplets
+    data = (values * weights[kinds]).astype(get_float_dtype())
+    nz = data != 0
+    return coo_matrix((data[nz], (rows[nz], cols[nz])), shape=shape).tocsr()
+
+
+def lookup_indices(sorted_ids, order, ids):
+    """
+    Vectorized lookup of integer encoded ids.
+    sorted_ids are the known ids sorted, order[i] is the index
+    of sorted_ids[i]. Raises KeyError if an id is unknown.
+    """
+    if not isinstance(ids, np.ndarray):
+        ids = np.array(list(ids))
+    if ids.dtype.kind != 'i':
+        ids = ids.astype(np.int64)
+    if ids.shape[0] == 0:
+        return np.zeros(0, dtype=order.dtype)
+    pos = np.searchsorted(sorted_ids, ids)
+    pos[pos == sorted_ids.shape[0]] = 0
+    missing = sorted_ids[pos] != ids
+    if missing.any():
+        raise KeyError(str(ids[missing][0]))
+    return order[pos]
+
+
 def load_train_final(path):
     res = {}
     with open(path, newline='') as csv_file:
@@ -1157,25 +1302,240 @@ def parse_csv_array(arr_str):
 
 def save_sparse_matrix(filename, matrix):
     """
-    Saves the matrix to the filename, matrix must be a lil matrix
+    Saves the matrix to the filename as csr matrix.
+    If filename ends with .npz all arrays are saved in it,
+    otherwise filename is a folder and each array is saved as .npy file
+    so that it can be memory mapped by load_sparse_matrix
     """
     # convert to a csr matrix since savez needs arrays
     m = matrix.tocsr()
-    np.savez(filename, data=m.data, indices=m.indices,
-             indptr=m.indptr, shape=m.shape)
+    if filename.endswith('.npz'):
+        np.savez(filename, data=m.data, indices=m.indices,
+                 indptr=m.indptr, shape=m.shape)
+    else:
+        os.makedirs(filename, exist_ok=True)
+        for name, array in [('data', m.data), ('indices', m.indices),
+                            ('indptr', m.indptr), ('shape', m.shape)]:
+            np.save(os.path.join(filename, name + '.npy'), array)
 
 
-def load_sparse_matrix(filename):
+def load_sparse_matrix(filename, mmap_mode=None):
     """
-    Load the matrix contained in the file as csr matrix and convert it to lil
-    type str of sparse matrix type
+    Load the matrix contained in the file as csr matrix
+    mmap_mode is passed to np.load when filename is a folder
+    written by save_sparse_matrix, arrays in .npz files can't be mapped
     """
-    loader = np.load(filename)
+    if os.path.isdir(filename):
+        loader = {name: np.load(os.path.join(filename, name + '.npy'),
+                                mmap_mode=mmap_mode)
+                  for name in ['data', 'indices', 'indptr', 'shape']}
+    else:
+        loader = np.load(filename)
     m = csr_matrix((loader['data'], loader['indices'], loader['indptr']),
-                   shape=loader['shape']).tolil()
+                   shape=tuple(loader['shape']), copy=False)
     return m
 
 
+# version of the compiled dataset store, bump it when its layout changes
+DATASET_CACHE_VERSION = 2
+
+# csv files the compiled store depends on
+DATASET_SOURCES = ['tracks_final.csv', 'playlists_final.csv',
+                   'target_playlists.csv', 'target_tracks.csv',
+                   'train_final.csv']
+
+
+def sources_fingerprint(prefix='./data/'):
+    """
+    Returns an hex digest of the content of the source csv files in prefix
+    """
+    h = hashlib.sha1()
+    for name in DATASET_SOURCES:
+        h.update(name.encode())
+        with open(prefix + name, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()[:16]
+
+
+def dataset_fingerprint(dataset, filter_tag=False):
+    """
+    Returns an hex digest of the content of the source csv files,
+    of the loading options and of the number of clusters.
+    It changes whenever one of the csv files changes.
+    """
+    h = hashlib.sha1()
+    h.update(str(DATASET_CACHE_VERSION).encode())
+    options = [dataset.load_tags, filter_tag, dataset.pop_threshold,
+               dataset.duration_intervals, dataset.playcount_intervals,
+               dataset.created_at_intervals,
+               dataset.playlist_duration_intervals,
+               dataset.playlist_numtracks_intervals]
+    h.update(repr(options).encode())
+    h.update(dataset.get_sources_fingerprint().encode())
+    return h.hexdigest()[:16]
+
+
+def _mapper_to_arrays(arrays, name, mapper):
+    """
+    Flattens a mapper {'attr': {'key': index}, 'attr_2': offset}
+    into arrays stored in the arrays dict with name as prefix
+    """
+    nested = [k for k, v in mapper.items() if isinstance(v, dict)]
+    scalars = [k for k, v in mapper.items() if not isinstance(v, dict)]
+    arrays[name + '__nested'] = np.array(nested, dtype=str)
+    arrays[name + '__scalars'] = np.array(scalars, dtype=str)
+    arrays[name + '__scalar_values'] = np.array(
+        [mapper[k] for k in scalars], dtype=np.int64)
+    for k in nested:
+        arrays[name + '__' + k + '__keys'] = np.array(
+            list(mapper[k].keys()), dtype=str)
+        arrays[name + '__' + k + '__values'] = np.array(
+            list(mapper[k].values()), dtype=np.int64)
+
+
+def _arrays_to_mapper(store, name):
+    """
+    Inverse of _mapper_to_arrays
+    """
+    mapper = {}
+    for k in store[name + '__nested'].tolist():
+        mapper[k] = dict(zip(store[name + '__' + k + '__keys'].tolist(),
+                             store[name + '__' + k + '__values'].tolist()))
+    for k, v in zip(store[name + '__scalars'].tolist(),
+                    store[name + '__scalar_values'].tolist()):
+        mapper[k] = v
+    return mapper
+
+
+def _table_to_arrays(arrays, name, table):
+    """
+    Stores a dict of rows {'id': {'field': value}} as one array per field
+    """
+    fields = list(next(iter(table.values())).keys()) if table else []
+    arrays[name + '__fields'] = np.array(fields, dtype=str)
+    for field in fields:
+        arrays[name + '__' + field] = np.array(
+            [row[field] for row in table.values()], dtype=str)
+
+
+def _arrays_to_table(store, name, dict_id):
+    """
+    Inverse of _table_to_arrays, dict_id is the field used as key
+    """
+    fields = store[name + '__fields'].tolist()
+    columns = [store[name + '__' + field].tolist() for field in fields]
+    key_column = columns[fields.index(dict_id)]
+    return {key: dict(zip(fields, values))
+            for key, values in zip(key_column, zip(*columns))}
+
+
+def save_dataset_cache(path, dataset):
+    """
+    Writes mappers, clusters, csv tables and urm of the dataset
+    to the npz store in path
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    arrays = {'version': DATASET_CACHE_VERSION,
+              'attrs_number': dataset.attrs_number,
+              'playlist_attrs_number': dataset.playlist_attrs_number}
+    # id mappers, the index of an id is its position in the array
+    arrays['track_ids'] = np.array(
+        [dataset.track_index_mapper[i]
+         for i in range(len(dataset.track_index_mapper))], dtype=str)
+    arrays['playlist_ids'] = np.array(
+        [dataset.playlist_index_mapper[i]
+         for i in range(len(dataset.playlist_index_mapper))], dtype=str)
+    _mapper_to_arrays(arrays, 'track_attr_mapper', dataset.track_attr_mapper)
+    _mapper_to_arrays(arrays, 'playlist_attr_mapper',
+                      dataset.playlist_attr_mapper)
+    arrays['tag_counter__keys'] = np.array(
+        list(dataset.tag_counter.keys()), dtype=str)
+    arrays['tag_counter__values'] = np.array(
+        list(dataset.tag_counter.values()), dtype=np.float64)
+    # clusters
+    for name in ['duration_cluster', 'playcount_cluster',
+                 'created_at_cluster', 'playlist_numtracks_cluster',
+                 'playlist_duration_cluster']:
+        arrays[name] = getattr(dataset, name)
+    # csv tables
+    _table_to_arrays(arrays, 'tracks_final', dataset.tracks_final)
+    _table_to_arrays(arrays, 'playlists_final', dataset.playlists_final)
+    _table_to_arrays(arrays, 'target_playlists', dataset.target_playlists)
+    _table_to_arrays(arrays, 'target_tracks', dataset.target_tracks)
+    # train final as playlist ids with offsets in the flat list of tracks
+    arrays['train_final__playlists'] = np.array(
+        list(dataset.train_final.keys()), dtype=str)
+    arrays['train_final__offsets'] = np.cumsum(
+        [0] + [len(v) for v in dataset.train_final.values()])
+    arrays['train_final__tracks'] = np.array(
+        [t for v in dataset.train_final.values() for t in v], dtype=str)
+    # urm
+    urm = dataset.urm.tocsr()
+    arrays['urm__data'] = urm.data.astype(URM_DTYPE)
+    arrays['urm__indices'] = urm.indices.astype(np.int32)
+    arrays['urm__indptr'] = urm.indptr.astype(np.int32)
+    arrays['urm__shape'] = urm.shape
+    # write to a temporary file first so that a concurrent reader
+    # never sees a partial store
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_dataset_cache(path, dataset):
+    """
+    Fills dataset with the content of the npz store in path
+    """
+    with np.load(path) as store:
+        if int(store['version']) != DATASET_CACHE_VERSION:
+            raise ValueError("Dataset cache version mismatch: " + path)
+        dataset.attrs_number = int(store['attrs_number'])
+        dataset.playlist_attrs_number = int(store['playlist_attrs_number'])
+        track_ids = store['track_ids'].tolist()
+        dataset.track_index_mapper = dict(enumerate(track_ids))
+        dataset.track_id_mapper = {v: i for i, v in enumerate(track_ids)}
+        playlist_ids = store['playlist_ids'].tolist()
+        dataset.playlist_index_mapper = dict(enumerate(playlist_ids))
+        dataset.playlist_id_mapper = {v: i for i, v in enumerate(playlist_ids)}
+        dataset.track_attr_mapper = _arrays_to_mapper(
+            store, 'track_attr_mapper')
+        dataset.playlist_attr_mapper = _arrays_to_mapper(
+            store, 'playlist_attr_mapper')
+        dataset.tag_counter = dict(zip(store['tag_counter__keys'].tolist(),
+                                       store['tag_counter__values'].tolist()))
+        for name in ['duration_cluster', 'playcount_cluster',
+                     'created_at_cluster', 'playlist_numtracks_cluster',
+                     'playlist_duration_cluster']:
+            setattr(dataset, name, store[name])
+        dataset.playlists_number = len(playlist_ids)
+        dataset.tracks_number = len(track_ids)
+        dataset.tracks_final = _arrays_to_table(
+            store, 'tracks_final', 'track_id')
+        dataset.playlists_final = _arrays_to_table(
+            store, 'playlists_final', 'playlist_id')
+        dataset.target_playlists = _arrays_to_table(
+            store, 'target_playlists', 'playlist_id')
+        dataset.target_tracks = _arrays_to_table(
+            store, 'target_tracks', 'track_id')
+        offsets = store['train_final__offsets'].tolist()
+        tracks = store['train_final__tracks'].tolist()
+        dataset.train_final = {
+            pl: tracks[offsets[i]:offsets[i + 1]]
+            for i, pl in enumerate(store['train_final__playlists'].tolist())}
+        dataset.urm = csr_matrix((store['urm__data'], store['urm__indices'],
+                                  store['urm__indptr']),
+                                 shape=tuple(store['urm__shape']))
+
+
+def compile_dataset(load_tags=True, filter_tag=True):
+    """
+    One-time compile step, builds the binary store used by
+    Dataset.from_cache for the given options
+    """
+    return Dataset.from_cache(load_tags=load_tags, filter_tag=filter_tag)
+
+
 def most_popular_features(icm, topK):
     """
     Returns the row indices of the most topK most popular features.
@@ -1275,3 +1635,10 @@ def user_augmented_icm(urm, ucm):
 
     ua_icm = csr_matrix(ua_icm.multiply(np.reciprocal(norm)))
     return ua_icm
+
+
+if __name__ == '__main__':
+    # compile the stores for the options used by the experiments
+    compile_dataset(load_tags=False, filter_tag=False)
+    compile_dataset(load_tags=True, filter_tag=False)
+    compile_dataset(load_tags=True, filter_tag=True)
@@ -3,29 +3,474 @@ import numpy as np
 from sklearn.cluster import KMeans
 from sklearn.feature_extraction.text import TfidfTransformer
 from src.utils.loader import *
+from src.utils.parallel import get_n_workers, share_matrix, attach_matrix, close_blocks
+from src.utils.parallel import balanced_chunks, product_row_costs, run_tasks, TASKS_PER_WORKER
+from src.utils.sim_cache import resolve_cache
+from src.utils.numeric import get_float_dtype, as_float
 
 
-def top_k_filtering(matrix, topK):
-    # Check if matrix is sparse
+class ChunkedCSR(object):
+    """
+    Builds a csr matrix out of consecutive blocks of rows.
+    The (indptr, indices, data) of each chunk are collected and
+    concatenated once by tocsr, so the cost is linear in the size
+    of the result instead of copying it at every vstack
+    """
+
+    def __init__(self, n_cols=None):
+        self.n_cols = n_cols
+        self.chunks = []
+
+    def append(self, chunk):
+        """
+        Appends the rows of chunk (sparse or dense) below the others
+        """
+        chunk = sps.csr_matrix(chunk)
+        if self.n_cols is None:
+            self.n_cols = chunk.shape[1]
+        self.chunks.append(chunk)
+
+    def tocsr(self):
+        """
+        Returns the assembled csr matrix, None if there are no chunks
+        and the number of columns is unknown
+        """
+        if not self.chunks:
+            if self.n_cols is None:
+                return None
+            return sps.csr_matrix((0, self.n_cols))
+        n_rows = sum(c.shape[0] for c in self.chunks)
+        nnz = sum(c.nnz for c in self.chunks)
+        index_dtype = np.int32 if nnz < np.iinfo(np.int32).max else np.int64
+        dtype = np.result_type(*[c.dtype for c in self.chunks])
+
+        indptr = np.empty(n_rows + 1, dtype=index_dtype)
+        indices = np.empty(nnz, dtype=index_dtype)
+        data = np.empty(nnz, dtype=dtype)
+        indptr[0] = 0
+        row = 0
+        pos = 0
+        for c in self.chunks:
+            c_rows = c.shape[0]
+            indptr[row + 1:row + c_rows + 1] = c.indptr[1:] - c.indptr[0] + pos
+            indices[pos:pos + c.nnz] = c.indices[c.indptr[0]:c.indptr[-1]]
+            data[pos:pos + c.nnz] = c.data[c.indptr[0]:c.indptr[-1]]
+            row += c_rows
+            pos += c.nnz
+        return sps.csr_matrix((data, indices, indptr),
+                              shape=(n_rows, self.n_cols))
+
+
+def stack_chunks(chunks):
+    """
+    Stacks vertically a list of matrices with ChunkedCSR
+    """
+    assembler = ChunkedCSR()
+    for chunk in chunks:
+        assembler.append(chunk)
+    return assembler.tocsr()
+
+
+# Number of entries of the padded rows handled at a time by
+# top_k_filtering and csr_topk
+TOPK_BLOCK_ENTRIES = 1 << 22
+# Mean length of the rows over which top_k_filtering selects the
+# entries of a block row by row instead of padding it
+TOPK_LOOP_MIN_WIDTH = 512
+
+
+def top_k_filtering(matrix, topK, n_threads=0):
+    """
+    Keeps the topK largest entries of each row of matrix (sparse or
+    dense) and returns them as a csr matrix, zero entries are dropped.
+    The pruned matrix is built from the selected entries, the rows are
+    selected with argpartition in blocks running in a pool of threads
+    """
     if sps.issparse(matrix):
-        matrix = matrix.tocsr()
-        for row_i in range(0, matrix.shape[0]):
-            row = matrix.data[matrix.indptr[row_i]:matrix.indptr[row_i + 1]]
-            # delete some items
-            if row.shape[0] >= topK:
-                sorted_idx = np.argpartition(
-                    row, row.shape[0] - topK)[:-topK]
-                row[sorted_idx] = 0
-        matrix.eliminate_zeros()
+        return _sparse_top_k(sps.csr_matrix(matrix), topK, n_threads)
+    return _dense_top_k(np.asarray(matrix), topK, n_threads)
+
+
+def _dense_top_k(matrix, topK, n_threads=0):
+    """
+    top_k_filtering of a dense matrix
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    n_rows, n_cols = matrix.shape
+    rows_per_block = max(1, TOPK_BLOCK_ENTRIES // max(1, n_cols))
+    bounds = [(start, min(start + rows_per_block, n_rows))
+              for start in range(0, n_rows, rows_per_block)]
+    with ThreadPoolExecutor(get_n_workers(n_threads)) as pool:
+        blocks = list(pool.map(
+            lambda b: _dense_top_k_rows(matrix[b[0]:b[1]], topK), bounds))
+    result = stack_chunks(blocks)
+    if result is None:
+        return sps.csr_matrix(matrix.shape, dtype=matrix.dtype)
+    return result
+
+
+def _dense_top_k_rows(block, topK):
+    """
+    The topK largest entries of each row of the dense block as csr
+    """
+    n_rows, n_cols = block.shape
+    if topK >= n_cols:
+        return sps.csr_matrix(block)
+    cols = np.argpartition(block, n_cols - topK, axis=1)[:, -topK:]
+    # sorted columns in each row, as in a csr built from a dense block
+    cols.sort(axis=1)
+    data = np.take_along_axis(block, cols, axis=1)
+    result = sps.csr_matrix((data.ravel(), cols.ravel(),
+                             np.arange(0, n_rows * topK + 1, topK)),
+                            shape=(n_rows, n_cols))
+    result.eliminate_zeros()
+    return result
+
+
+def _sparse_top_k(matrix, topK, n_threads=0):
+    """
+    top_k_filtering of a csr matrix
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    keep = np.ones(matrix.nnz, dtype=bool)
+
+    def work(bound):
+        start, end = bound
+        lo, hi = matrix.indptr[start], matrix.indptr[end]
+        keep[lo:hi] = _sparse_top_k_block(matrix, start, end, topK)
+
+    with ThreadPoolExecutor(get_n_workers(n_threads)) as pool:
+        list(pool.map(work, _padded_row_blocks(np.diff(matrix.indptr))))
+    keep &= matrix.data != 0
+
+    positions = np.flatnonzero(keep)
+    indptr = np.searchsorted(positions, matrix.indptr).astype(
+        matrix.indptr.dtype)
+    return sps.csr_matrix((matrix.data[positions], matrix.indices[positions],
+                           indptr), shape=matrix.shape)
+
+
+def _sparse_top_k_block(matrix, start, end, topK):
+    """
+    Returns the mask of the entries of rows [start, end) of matrix among
+    the topK largest of their row. The rows longer than topK are padded
+    and the k-th score of each one is found with a partial selection, of
+    the entries equal to it the first ones are kept. Long rows are
+    selected one at a time with argpartition
+    """
+    indptr = matrix.indptr[start:end + 1]
+    counts = np.diff(indptr)
+    data = matrix.data[indptr[0]:indptr[-1]]
+    keep = np.ones(data.shape[0], dtype=bool)
+    long_rows = counts > topK
+    if not long_rows.any():
+        return keep
+    if counts[long_rows].mean() >= TOPK_LOOP_MIN_WIDTH:
+        # long enough for the selection to dominate, row by row
+        keep[:] = False
+        for lo, hi in zip(indptr[:-1] - indptr[0], indptr[1:] - indptr[0]):
+            n_drop = hi - lo - topK
+            if n_drop > 0:
+                best = np.argpartition(data[lo:hi], n_drop)[n_drop:]
+                keep[lo + best] = True
+            else:
+                keep[lo:hi] = True
+        return keep
+
+    in_long = np.repeat(long_rows, counts)
+    counts = counts[long_rows]
+    width = counts.max()
+
+    # the rows padded to width with -inf, in_row keeps them in row order
+    in_row = np.arange(width) < counts[:, None]
+    scores = np.full(in_row.shape, -np.inf, dtype=data.dtype)
+    scores[in_row] = data[in_long]
+    kth = np.partition(scores, width - topK, axis=1)[:, width - topK:
+                                                     width - topK + 1]
+    above = scores > kth
+    missing = topK - np.count_nonzero(above, axis=1)
+    # of the entries equal to the k-th score the first missing are kept
+    ties = scores == kth
+    crowded = np.flatnonzero(np.count_nonzero(ties, axis=1) > missing)
+    above |= ties
+    if crowded.shape[0] > 0:
+        tie_rows, tie_cols = np.nonzero(ties[crowded])
+        rank = np.arange(tie_rows.shape[0]) - np.searchsorted(tie_rows,
+                                                              tie_rows)
+        extra = rank >= missing[crowded][tie_rows]
+        above[crowded[tie_rows[extra]], tie_cols[extra]] = False
+    keep[in_long] = above[in_row]
+    return keep
+
+
+def _padded_row_blocks(counts, max_entries=TOPK_BLOCK_ENTRIES):
+    """
+    Splits the rows with counts entries in contiguous blocks [start, end)
+    whose rows padded to the longest one have at most max_entries
+    entries (a block has at least one row)
+    """
+    bounds = []
+    start = 0
+    n_rows = counts.shape[0]
+    while start < n_rows:
+        window = counts[start:start + max_entries]
+        sizes = np.arange(1, window.shape[0] + 1) * \
+            np.maximum(np.maximum.accumulate(window), 1)
+        end = start + max(1, np.searchsorted(sizes, max_entries, side='right'))
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def csr_topk(R_hat, k, n_threads=0):
+    """
+    Returns an (n_rows, k) array with the columns of the k largest
+    entries of each row of R_hat, by decreasing score (ties by the
+    larger column), -1 where a row has less than k nonzero entries.
+    R_hat is sparse or a dense array (see adapt_r_hat), a sparse one
+    is padded to the width of its longest row in blocks, the k-th
+    score of each row is found with a partial selection and only the
+    entries above it are sorted. Blocks run in threads
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    dense = not sps.issparse(R_hat)
+    R_hat = np.asarray(R_hat) if dense else sps.csr_matrix(R_hat)
+    n_rows = R_hat.shape[0]
+    result = np.full((n_rows, k), -1, dtype=np.int64)
+    if n_rows == 0 or k == 0:
+        return result
+    if dense:
+        step = max(1, TOPK_BLOCK_ENTRIES // max(1, R_hat.shape[1]))
+        bounds = [(start, min(start + step, n_rows))
+                  for start in range(0, n_rows, step)]
+        block_topk = _dense_topk_block
+    else:
+        # blocks of rows whose padded size is bounded
+        bounds = _padded_row_blocks(np.diff(R_hat.indptr))
+        block_topk = _csr_topk_block
+
+    def work(bound):
+        block_topk(R_hat, bound[0], bound[1], k, result)
+
+    with ThreadPoolExecutor(get_n_workers(n_threads)) as pool:
+        list(pool.map(work, bounds))
+    return result
+
+
+def _csr_topk_block(R_hat, start, end, k, result):
+    """
+    Fills result[start:end] with the top k columns of those rows
+    """
+    indptr = R_hat.indptr[start:end + 1]
+    lo, hi = indptr[0], indptr[-1]
+    counts = np.diff(indptr)
+    width = counts.max() if counts.shape[0] else 0
+    if width == 0:
+        return
+    n_rows = end - start
+    rows = np.repeat(np.arange(n_rows), counts)
+    data = R_hat.data[lo:hi]
+    cols = R_hat.indices[lo:hi]
+
+    if width > k:
+        # k-th largest score of each row, the entries below it are out
+        in_row = np.arange(width) < counts[:, None]
+        scores = np.full(in_row.shape, -np.inf, dtype=data.dtype)
+        scores[in_row] = data
+        kth = np.partition(scores, width - k, axis=1)[:, width - k]
+        keep = data >= kth[rows]
+        rows, data, cols = rows[keep], data[keep], cols[keep]
+    _rank_topk(rows, cols, data, k, result[start:end])
+
+
+def _dense_topk_block(R_hat, start, end, k, result):
+    """
+    Fills result[start:end] with the top k columns of those rows of the
+    dense R_hat, its zeros are left out like the ones of a csr matrix
+    """
+    block = R_hat[start:end]
+    width = block.shape[1]
+    if width > k:
+        kth = np.partition(block, width - k, axis=1)[:, width - k]
+        # where the k-th score is not positive the zeros may hide
+        # negative entries, those rows are selected without them
+        crowded = np.flatnonzero(kth <= 0)
+        if crowded.shape[0]:
+            scores = block[crowded]
+            scores = np.where(scores != 0, scores, -np.inf)
+            kth[crowded] = np.partition(scores, width - k,
+                                        axis=1)[:, width - k]
+        keep = block >= kth[:, None]
+        if crowded.shape[0]:
+            keep &= block != 0
     else:
-        for row_i in range(0, matrix.shape[0]):
-            row = matrix[row_i]
-            # delete some items
-            if row.shape[0] >= topK:
-                sorted_idx = np.argpartition(
-                    row, row.shape[0] - topK)[:-topK]
-                matrix[row_i][sorted_idx] = 0
-    return matrix
+        keep = block != 0
+    # flat positions are much faster to find than (row, column) pairs
+    rows, cols = np.divmod(np.flatnonzero(keep), width)
+    _rank_topk(rows, cols, block[rows, cols], k, result[start:end])
+
+
+def _rank_topk(rows, cols, data, k, result):
+    """
+    Writes in result the columns of the k best (rows, cols, data)
+    entries of each row, by decreasing score then decreasing column
+    """
+    # by row, then decreasing score, then decreasing column
+    order = np.lexsort((-cols, -data, rows))
+    rows, cols = rows[order], cols[order]
+    first = np.searchsorted(rows, rows, side='left')
+    rank = np.arange(rows.shape[0]) - first
+    keep = rank < k
+    result[rows[keep], rank[keep]] = cols[keep]
+
+
+# Share of nonzero cells over which adapt_r_hat keeps R_hat as a dense
+# array: a csr entry costs its value and its column (8 bytes in
+# float32), a dense cell only its value, and over it the selection of
+# the top tracks is faster on the dense array
+DENSE_R_HAT_DENSITY = 0.5
+
+
+def density(matrix):
+    """
+    Returns the share of nonzero cells of matrix (sparse or dense)
+    """
+    size = matrix.shape[0] * matrix.shape[1]
+    if size == 0:
+        return 0.0
+    if sps.issparse(matrix):
+        return matrix.nnz / size
+    return np.count_nonzero(matrix) / size
+
+
+def adapt_r_hat(R_hat, max_density=DENSE_R_HAT_DENSITY):
+    """
+    Returns R_hat (sparse or dense) with the float dtype of the package,
+    as a dense array if more than max_density of its cells are nonzero,
+    as a csr matrix otherwise. csr_topk, remove_seen, max_normalize and
+    weighted_sum accept both
+    """
+    if sps.issparse(R_hat):
+        R_hat = R_hat.tocsr()
+        if density(R_hat) > max_density:
+            return as_float(R_hat.toarray())
+        return as_float(R_hat)
+    R_hat = as_float(np.asarray(R_hat))
+    if density(R_hat) > max_density:
+        return R_hat
+    return sps.csr_matrix(R_hat)
+
+
+def matrix_nbytes(matrix):
+    """
+    Returns the bytes held by matrix, a csr matrix or a dense array
+    """
+    if sps.issparse(matrix):
+        matrix = matrix.tocsr()
+        return matrix.data.nbytes + matrix.indices.nbytes + \
+            matrix.indptr.nbytes
+    return np.asarray(matrix).nbytes
+
+
+def weighted_sum(matrices, weights):
+    """
+    Returns the sum of matrices[i] * weights[i] through adapt_r_hat.
+    The matrices are sparse or dense with the same shape, a weight is a
+    scalar or a column vector (one weight per row). The sum is built in
+    a dense array if one of the matrices is dense, in csr otherwise
+    """
+    shape = matrices[0].shape
+    if all(sps.issparse(matrix) for matrix in matrices):
+        mixed = sps.csr_matrix(shape, dtype=get_float_dtype())
+        for matrix, weight in zip(matrices, weights):
+            mixed = mixed + sps.csr_matrix(matrix.multiply(weight))
+        return adapt_r_hat(mixed)
+
+    mixed = np.zeros(shape, dtype=get_float_dtype())
+    for matrix, weight in zip(matrices, weights):
+        weight = np.asarray(weight, dtype=mixed.dtype)
+        if sps.issparse(matrix):
+            matrix = sps.csr_matrix(matrix.multiply(weight))
+            matrix.sum_duplicates()
+            rows = np.repeat(np.arange(shape[0]), np.diff(matrix.indptr))
+            mixed[rows, matrix.indices] += matrix.data
+        else:
+            mixed += np.asarray(matrix) * weight
+    return adapt_r_hat(mixed)
+
+
+def remove_seen(R_hat, seen):
+    """
+    Returns R_hat without the entries where seen, a matrix of the same
+    shape (the urm of the target playlists and tracks), is nonzero.
+    For a csr R_hat, unlike R_hat[seen.nonzero()] = 0, the structure of
+    R_hat is not changed in place. A dense R_hat is zeroed in place,
+    it is not copied
+    """
+    if not sps.issparse(R_hat):
+        R_hat = np.asarray(R_hat)
+        R_hat[(sps.csr_matrix(seen) != 0).nonzero()] = 0
+        return R_hat
+    R_hat = sps.csr_matrix(R_hat)
+    mask = (sps.csr_matrix(seen) != 0).astype(R_hat.dtype)
+    return R_hat - R_hat.multiply(mask).tocsr()
+
+
+def recommend_top_k(X, S, k, seen=None, n_threads=0, use_cython=False):
+    """
+    Returns the (n_rows, k) columns of csr_topk of X * S without the
+    entries where seen is nonzero, without building X * S.
+    With use_cython the compiled kernel of src/CBF/cosineSim.pyx
+    accumulates each row in a dense buffer of its thread (build it with
+    compileCython.py), otherwise X * S is computed by blocks of rows of
+    bounded size running in a pool of threads
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if use_cython:
+        from src.CBF.cosineSim import score_top_k
+        return score_top_k(X, S, k, seen=seen, n_threads=n_threads)
+
+    X = sps.csr_matrix(X)
+    S = sps.csr_matrix(S)
+    if seen is not None:
+        seen = sps.csr_matrix(seen)
+    n_rows = X.shape[0]
+    result = np.full((n_rows, k), -1, dtype=np.int64)
+    if n_rows == 0 or k == 0:
+        return result
+    n_threads = get_n_workers(n_threads)
+    costs = product_row_costs(X, S)
+    n_blocks = max(n_threads, int(costs.sum() // TOPK_BLOCK_ENTRIES) + 1)
+
+    def work(chunk):
+        start, end = chunk['start'], chunk['end']
+        block = X[start:end].dot(S).tocsr()
+        if seen is not None:
+            block = remove_seen(block, seen[start:end])
+        for lo, hi in _padded_row_blocks(np.diff(block.indptr)):
+            _csr_topk_block(block, lo, hi, k, result[start:end])
+
+    with ThreadPoolExecutor(n_threads) as pool:
+        list(pool.map(work, balanced_chunks(costs, n_blocks)))
+    return result
+
+
+def top_k_to_recs(top_k, pl_id_list, tr_id_list):
+    """
+    Maps the (n_playlists, k) columns of csr_topk to the dictionary
+    'pl_id': ['tr_1', 'tr_k'] of the predict methods
+    """
+    # the -1 of the missing entries pick the last, empty, id
+    tr_ids = np.empty(len(tr_id_list) + 1, dtype=object)
+    tr_ids[:-1] = list(tr_id_list)
+    ids = tr_ids[top_k].tolist()
+    counts = (top_k >= 0).sum(axis=1).tolist()
+    return {pl_id: row[:count]
+            for pl_id, row, count in zip(pl_id_list, ids, counts)}
 
 
 def cluster_per_n_rating(urm, tg_playlist, ds, n_cluster):
@@ -33,7 +478,7 @@ def cluster_per_n_rating(urm, tg_playlist, ds, n_cluster):
     rating_cluster = KMeans(n_clusters=n_cluster).fit_predict(n_rating)
 
     # keep only tg users
-    rating_cluster = rating_cluster[[ds.get_playlist_index_from_id(x) for x in tg_playlist]]
+    rating_cluster = rating_cluster[ds.playlist_indices(tg_playlist)]
 
     return rating_cluster
 
@@ -57,7 +502,7 @@ def cluster_per_ucm(urm, tg_playlist, ds, n_cluster):
     ucm_cluster = KMeans(n_clusters=n_cluster).fit_predict(ucm)
 
     # keep only tg users
-    ucm_cluster = ucm_cluster[[ds.get_playlist_index_from_id(x) for x in tg_playlist]]
+    ucm_cluster = ucm_cluster[ds.playlist_indices(tg_playlist)]
 
     return ucm_cluster
 
@@ -78,63 +523,80 @@ def cluster_per_uicm(urm, tg_playlist, ds, n_cluster):
     ucm_cluster = KMeans(n_clusters=n_cluster).fit_predict(uicm)
 
     # keep only tg users
-    ucm_cluster = ucm_cluster[[ds.get_playlist_index_from_id(x) for x in tg_playlist]]
+    ucm_cluster = ucm_cluster[ds.playlist_indices(tg_playlist)]
 
     return ucm_cluster
 
 
-def compute_cosine(X, Y, k_filtering, shrinkage=False, n_threads=0, chunksize=100, normalize=True):
+def compute_cosine(X, Y, k_filtering, shrinkage=False, n_threads=0, chunksize=100, normalize=True,
+                   use_cython=False, symmetric=False, cache=None):
     """
     Returns X_shape[0]xY_shape[1]
+    symmetric: X is Y.transpose() (full item-item or user-user
+    similarity), each pair is multiplied about once and the top-K of
+    each row is merged from its upper part and its mirrored entries.
+    It is only used when the product is dominated by the
+    multiplications (shrinkage, dense rows), see _symmetric_pays_off,
+    otherwise the normal path runs. Sparse inputs only
+    cache: SimilarityCache where the result is looked up and stored,
+    True for the default one, None for the one of the RECSYS_SIM_CACHE
+    environment variable (if set), False to disable it
+    """
+    params = ['cosine', k_filtering, shrinkage or 0, normalize, symmetric]
+    return cached_similarity(
+        cache, params, X, Y,
+        lambda: _cosine(X, Y, k_filtering, shrinkage, n_threads, chunksize,
+                        normalize, use_cython, symmetric))
+
+
+def cached_similarity(cache, params, X, Y, compute):
     """
+    Returns the similarity of X and Y described by params from cache,
+    calls compute and stores its result if it is not there
+    """
+    cache = resolve_cache(cache)
+    if cache is None:
+        return compute()
+    # float32 and float64 results are different entries
+    key = cache.key([X, Y], list(params) + [get_float_dtype().name])
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        cache.put(key, result)
+    return result
+
+
+def _cosine(X, Y, k_filtering, shrinkage, n_threads, chunksize, normalize,
+            use_cython, symmetric):
+    dtype = get_float_dtype()
+    X = as_float(X)
+    Y = as_float(Y)
     if sps.issparse(X):
         from scipy.sparse.linalg import norm
-        import multiprocessing as mp
+
+        if symmetric and X.shape[0] != Y.shape[1]:
+            raise ValueError("symmetric similarity needs X = "
+                             "Y.transpose(), got shapes {} and {}".format(
+                                 X.shape, Y.shape))
+        symmetric = symmetric and _symmetric_pays_off(X, Y, shrinkage)
+        if not (symmetric or use_cython):
+            return _single_similarity(X, Y, 'cosine' if normalize else 'dot',
+                                      k_filtering, shrinkage, n_threads,
+                                      chunksize)
 
         if normalize:
             x_norm = norm(X, axis=1)
             x_norm[x_norm == 0] = 1
-            X = X.multiply(sps.csr_matrix(np.reciprocal(x_norm)).transpose())
+            x_norm = np.reciprocal(x_norm).astype(dtype)
+            X = X.multiply(sps.csr_matrix(x_norm).transpose())
             y_norm = norm(Y, axis=0)
             y_norm[y_norm == 0] = 1
-            Y = Y.multiply(np.reciprocal(y_norm))
-        Y_ones = Y.copy()
-        Y_ones.data = np.ones_like(Y_ones.data)
-
-        if n_threads == 0:
-            n_threads = mp.cpu_count()
-
-        worker_matrix_chunks = []
-        worker_chunksize = X.shape[0] // n_threads
-        for i in range(0, X.shape[0], worker_chunksize):
-            if i + worker_chunksize > X.shape[0]:
-                end = X.shape[0]
-            else:
-                end = i + worker_chunksize
-            worker_matrix_chunks.append({'start': i, 'end': end})
-
-        # Build a list of parameters to ship to pool workers
-        separated_tasks = []
-        for chunk in worker_matrix_chunks:
-            separated_tasks.append([chunk,
-                                    X,
-                                    Y,
-                                    Y_ones,
-                                    k_filtering,
-                                    shrinkage,
-                                    chunksize])
-
-        result = None
-        with mp.Pool(n_threads) as pool:
-            print('Running {:d} workers...'.format(n_threads))
-            submatrices = pool.map(_work_compute_cosine, separated_tasks)
-            submatrices.sort(key=lambda x: x['start'])
-
-            for submatrix in submatrices:
-                if result is None:
-                    result = submatrix['result']
-                else:
-                    result = sps.vstack([result, submatrix['result']])
+            Y = Y.multiply(np.reciprocal(y_norm).astype(dtype))
+        if symmetric:
+            result = _symmetric_cosine(X, Y, k_filtering, shrinkage,
+                                       n_threads, chunksize)
+        else:
+            result = _cython_cosine(X, Y, k_filtering, shrinkage, n_threads)
     else:
         # if not sparse the cosine is only the chunked dot product
         from scipy.linalg import norm
@@ -146,119 +608,466 @@ def compute_cosine(X, Y, k_filtering, shrinkage=False, n_threads=0, chunksize=10
         y_norm = norm(Y, axis=0)
         y_norm[y_norm == 0] = 1
         Y = np.multiply(Y, np.reciprocal(y_norm))
-        result = sps.csr_matrix(dot_chunked(X, Y, k_filtering))
-    return result
+        result = dense_top_k_dot(X, Y, k_filtering, n_threads=n_threads)
+    return as_float(result)
 
 
-def yadistance(X, Y, k_filtering, shrinkage=False, n_threads=0, chunksize=100, normalize=True):
+def yadistance(X, Y, k_filtering, shrinkage=False, n_threads=0, chunksize=100, normalize=True,
+               use_cython=False, cache=None):
     # Yet another distance 
     # <X,Y>/||X|| Where the norm is done on the common elements
     """
     Returns X_shape[0]xY_shape[1]
+    cache: see compute_cosine
     """
+    params = ['yadistance', k_filtering, shrinkage or 0, normalize]
+    return cached_similarity(
+        cache, params, X, Y,
+        lambda: _yadistance(X, Y, k_filtering, shrinkage, n_threads,
+                            chunksize, normalize, use_cython))
+
+
+def _yadistance(X, Y, k_filtering, shrinkage, n_threads, chunksize, normalize,
+                use_cython):
+    X = as_float(X)
+    Y = as_float(Y)
     if sps.issparse(X):
         from scipy.sparse.linalg import norm
-        import multiprocessing as mp
 
+        if not use_cython:
+            return _single_similarity(X, Y,
+                                      'yadistance' if normalize else 'dot',
+                                      k_filtering, shrinkage, n_threads,
+                                      chunksize)
         if normalize:
             y_norm = norm(Y, axis=0)
             y_norm[y_norm == 0] = 1
-            Y = Y.multiply(np.reciprocal(y_norm))
-        Y_ones = Y.copy()
-        Y_ones.data = np.ones_like(Y_ones.data)
-
-        if n_threads == 0:
-            n_threads = mp.cpu_count()
-
-        worker_matrix_chunks = []
-        worker_chunksize = X.shape[0] // n_threads
-        for i in range(0, X.shape[0], worker_chunksize):
-            if i + worker_chunksize > X.shape[0]:
-                end = X.shape[0]
-            else:
-                end = i + worker_chunksize
-            worker_matrix_chunks.append({'start': i, 'end': end})
-
-        # Build a list of parameters to ship to pool workers
-        separated_tasks = []
-        for chunk in worker_matrix_chunks:
-            separated_tasks.append([chunk,
-                                    X,
-                                    Y,
-                                    Y_ones,
-                                    k_filtering,
-                                    shrinkage,
-                                    chunksize])
-
-        result = None
-        with mp.Pool(n_threads) as pool:
-            print('Running {:d} workers...'.format(n_threads))
-            submatrices = pool.map(_work_compute_cosine, separated_tasks)
-            submatrices.sort(key=lambda x: x['start'])
-
-            for submatrix in submatrices:
-                if result is None:
-                    result = submatrix['result']
-                else:
-                    result = sps.vstack([result, submatrix['result']])
+            Y = Y.multiply(np.reciprocal(y_norm).astype(Y.dtype))
+        result = _cython_cosine(X, Y, k_filtering, shrinkage, n_threads)
     else:
         from scipy.linalg import norm
         y_norm = norm(Y, axis=0)
         y_norm[y_norm == 0] = 1
         Y = np.multiply(Y, np.reciprocal(y_norm))
-        result = sps.csr_matrix(dot_chunked(X, Y, k_filtering))
-    return result
-    pass
+        result = dense_top_k_dot(X, Y, k_filtering, n_threads=n_threads)
+    return as_float(result)
+
+
+def _single_similarity(X, Y, kind, k_filtering, shrinkage, n_threads,
+                       chunksize):
+    """
+    The similarity kind of compute_similarities with shrinkage and top-K
+    filtering of each row, the sparse path of compute_cosine and
+    yadistance
+    """
+    variants = {kind: {'kind': kind, 'k': k_filtering,
+                       'shrinkage': shrinkage or 0}}
+    return compute_similarities(X, Y, variants, n_threads, chunksize)[kind]
+
 
-def _work_compute_cosine(params):
+def _cython_cosine(X, Y, k_filtering, shrinkage, n_threads):
+    """
+    X * Y with shrinkage and top-K filtering of each row, computed by the
+    compiled kernel of src/CBF/cosineSim.pyx (build it with
+    compileCython.py)
+    """
+    from src.CBF.cosineSim import cosine_top_k
+    return cosine_top_k(X, Y, k_filtering,
+                        shrinkage=shrinkage if shrinkage else 0,
+                        n_threads=n_threads)
+
+
+# compute_cosine(symmetric=True) only takes the symmetric path when the
+# product makes at least this many multiplications per entry of the
+# result: it saves about half of the multiplications but handles every
+# entry twice. Measured with python -m src.utils.symmetric_benchmark,
+# the shrinkage doubles the multiplications and lowers the threshold
+SYMMETRIC_MIN_PRODUCTS = 24
+SYMMETRIC_MIN_PRODUCTS_SHRINKAGE = 2
+
+
+def _symmetric_pays_off(X, Y, shrinkage):
+    """
+    True if X * Y makes enough multiplications per entry of the result
+    (estimated as at most one per multiplication and n_cols per row)
+    for the symmetric path to be faster than the normal one
+    """
+    costs = product_row_costs(X, Y)
+    entries = np.minimum(costs, Y.shape[1]).sum()
+    threshold = SYMMETRIC_MIN_PRODUCTS_SHRINKAGE if shrinkage \
+        else SYMMETRIC_MIN_PRODUCTS
+    return costs.sum() >= threshold * max(entries, 1)
+
+
+def _symmetric_cosine(X, Y, k_filtering, shrinkage, n_threads, chunksize):
+    """
+    X * Y for X = Y.transpose(), computing each pair about once.
+    A block of rows starting at c only multiplies the columns from c on,
+    the workers return the top-K of the upper part of their rows and,
+    for every row j, the top-K of the entries (j, i) mirrored from their
+    rows i < j. The top-K of each row is then taken from those
+    candidates
+    """
+    n = X.shape[0]
+    n_threads = get_n_workers(n_threads)
+    # row i only computes the columns from i on
+    costs = product_row_costs(X, Y) * (1 - np.arange(n) / n)
+
+    shared = {'X': share_matrix(X), 'Y': share_matrix(Y)}
+    if shrinkage:
+        Y_ones = Y.tocsr(copy=True)
+        Y_ones.data = np.ones_like(Y_ones.data)
+        shared['Y_ones'] = share_matrix(Y_ones)
+        del Y_ones
+    handles = {k: v.handle for k, v in shared.items()}
+
+    separated_tasks = []
+    weights = []
+    for chunk in balanced_chunks(costs, n_threads * TASKS_PER_WORKER):
+        separated_tasks.append([chunk, handles, k_filtering, shrinkage,
+                                chunksize])
+        weights.append(costs[chunk['start']:chunk['end']].sum())
+
+    try:
+        results = run_tasks(_work_symmetric_cosine, separated_tasks,
+                            n_threads, weights)
+    finally:
+        for matrix in shared.values():
+            matrix.unlink()
+    # the tasks cover consecutive rows, their mirrored entries are in
+    # consecutive columns
+    upper = stack_chunks([x['result'] for x in results])
+    mirrored = sps.hstack([x['mirrored'] for x in results], format='csr')
+    S = top_k_filtering(upper + mirrored, k_filtering)
+    S.eliminate_zeros()
+    return S
+
+
+def _work_symmetric_cosine(params):
+    bounds, handles = params[0], params[1]
+    matrices = {}
+    blocks = []
+    for name, handle in handles.items():
+        matrices[name], matrix_blocks = attach_matrix(handle)
+        blocks.extend(matrix_blocks)
+    upper, mirrored = _symmetric_cosine_rows(
+        bounds, matrices['X'], matrices['Y'], matrices.get('Y_ones'),
+        *params[2:])
+    del matrices
+    close_blocks(blocks)
+    return {'result': upper, 'mirrored': mirrored, 'start': bounds['start']}
+
+
+# symmetric_cosine slices the columns of Y again when the multiplications
+# spent since the last slice on the columns the rows have passed (the
+# lower triangle) exceed this many times the entries of the slice, about
+# the cost of copying it
+SYMMETRIC_SLICE_RATIO = 2
+
+
+def _symmetric_cosine_rows(bounds, X, Y, Y_ones, k_filtering, shrinkage,
+                           chunksize):
+    """
+    For the rows [start, end) of X * Y, returns the top-K of
+    their upper part (diagonal included) and the (n, end - start) csr
+    matrix with, for every row j, the top-K of the entries (j, i)
+    mirrored from them. The blocks of rows multiply the columns of Y
+    from the start of the current slice on
+    """
     import os
-    # Unpack parameters
-    bounds = params[0]
-    X = params[1]
-    Y = params[2]
-    Y_ones = params[3]
-    k_filtering = params[4]
-    shrinkage = params[5]
-    chunksize = params[6]
 
     start = bounds['start']
     mat_len = bounds['end']
+    n = Y.shape[1]
 
-    S = None
+    upper = ChunkedCSR(n)
+    mirrored = []
+    n_pending = 0
+    Y_slice = None
     for chunk in range(start, mat_len, chunksize):
-        if chunk + chunksize > mat_len:
-            end = mat_len
-        else:
-            end = chunk + chunksize
-        print(('[ {:d} ] Building cosine similarity matrix '
+        end = min(chunk + chunksize, mat_len)
+        print(('[ {:d} ] Building symmetric cosine similarity matrix '
                'for [{:d}, {:d})...').format(os.getpid(), chunk, end))
 
-        # First compute similarity
-        S_prime = X[chunk:end].tocsr().dot(Y)
-
+        X_chunk = X[chunk:end]
+        if Y_slice is None or wasted > SYMMETRIC_SLICE_RATIO * Y_slice.nnz:
+            slice_start = chunk
+            Y_slice = Y[:, chunk:]
+            if shrinkage:
+                Y_ones_slice = Y_ones[:, chunk:]
+            wasted = 0
+        # multiplications of the chunk on the columns [slice_start, chunk)
+        wasted += X_chunk.nnz * Y_slice.nnz / max(1, Y_slice.shape[0]) * \
+            (chunk - slice_start) / max(1, Y_slice.shape[1])
+
+        S_prime = X_chunk.dot(Y_slice)
         if shrinkage:
-            # Apply shrinkage
-            X_ones = X[chunk:end]
-            X_ones.data = np.ones_like(X_ones.data)
-            S_num = X_ones.dot(Y_ones)
+            X_chunk.data = np.ones_like(X_chunk.data)
+            S_num = X_chunk.dot(Y_ones_slice)
             S_den = S_num.copy()
             S_den.data += shrinkage
             S_den.data = np.reciprocal(S_den.data)
             S_prime = S_prime.multiply(S_num).multiply(S_den)
+        S_prime = S_prime.tocsr()
+
+        upper.append(top_k_filtering(_shift_triangle(
+            S_prime, chunk, slice_start, n, lower=False), k_filtering))
+        # as the rows j of the mirrored matrix
+        S_prime = S_prime.tocsc()
+        S_prime = sps.csr_matrix((S_prime.data, S_prime.indices,
+                                  S_prime.indptr),
+                                 shape=S_prime.shape[::-1])
+        mirrored.append(_shift_triangle(S_prime, slice_start, chunk, n,
+                                        lower=True))
+        n_pending += mirrored[-1].nnz
+        if n_pending > TOPK_BLOCK_ENTRIES:
+            mirrored = [top_k_filtering(sps.hstack(mirrored, format='csr'),
+                                        k_filtering)]
+            n_pending = mirrored[0].nnz
+    mirrored = sps.hstack(mirrored, format='csr')
+    return upper.tocsr(), top_k_filtering(mirrored, k_filtering)
+
+
+def _shift_triangle(block, row_offset, col_offset, n_cols, lower):
+    """
+    The entries of the csr block, the submatrix of a square matrix
+    starting at (row_offset, col_offset), in its upper triangle
+    (diagonal included) or strictly lower one. The columns are shifted
+    by col_offset in n_cols, with lower the rows are shifted by
+    row_offset in n_cols instead
+    """
+    rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+    cols = block.indices + col_offset
+    keep = cols < rows + row_offset if lower else cols >= rows + row_offset
+    counts = np.bincount(rows[keep], minlength=block.shape[0])
+    if lower:
+        counts = np.r_[np.zeros(row_offset, dtype=counts.dtype), counts]
+        cols = block.indices
+    indptr = np.r_[0, np.cumsum(counts)]
+    return sps.csr_matrix((block.data[keep], cols[keep], indptr),
+                          shape=(indptr.shape[0] - 1,
+                                 block.shape[1] if lower else n_cols))
+
+
+# Similarities computed by compute_similarities, all of them out of the
+# dot product <x, y> of a row of X and a column of Y, their squared
+# norms and the number of common elements c (for the shrinkage c / (c + h))
+SIMILARITY_KINDS = ['cosine', 'asymmetric_cosine', 'jaccard', 'tversky',
+                    'yadistance', 'dot']
+
+
+def compute_similarities(X, Y, variants, n_threads=0, chunksize=100):
+    """
+    Computes several similarities of the rows of X with the columns of Y
+    walking X * Y only once.
+    variants: {name: params} where params is a dict with
+        'kind': one of SIMILARITY_KINDS
+        'k': number of neighbors kept for each row
+        'shrinkage': significance weighting c / (c + shrinkage), optional
+        'alpha': exponent of the norm of x for asymmetric_cosine (0.5 is
+                 the cosine), weight of x for tversky
+        'beta': weight of y for tversky
+    yadistance is <x, y> / ||y|| as in yadistance, dot is <x, y> (the
+    similarities with normalize=False), jaccard is computed on the
+    weights (tanimoto), on binary matrices it is the usual one.
+    Returns {name: X_shape[0]xY_shape[1] csr matrix}, sparse inputs only
+    """
+    for name, params in variants.items():
+        if params.get('kind') not in SIMILARITY_KINDS:
+            raise ValueError("unknown similarity {!r} for {!r}, expected one "
+                             "of {}".format(params.get('kind'), name,
+                                            SIMILARITY_KINDS))
+    X = as_float(sps.csr_matrix(X))
+    Y = as_float(sps.csr_matrix(Y))
+    n_threads = get_n_workers(n_threads)
+    costs = product_row_costs(X, Y)
+
+    x_sq = np.asarray(X.multiply(X).sum(axis=1)).ravel()
+    y_sq = np.asarray(Y.multiply(Y).sum(axis=0)).ravel()
+    if len(variants) == 1:
+        # a single <x, y> * x_scale * y_scale similarity is the dot
+        # product of the scaled rows of X and columns of Y
+        (name, params), = variants.items()
+        scales = _similarity_scales(x_sq, y_sq, params)
+        if scales is not None:
+            X = X.multiply(sps.csr_matrix(scales[0]).transpose()).tocsr()
+            Y = Y.multiply(scales[1]).tocsr()
+            variants = {name: dict(params, kind='dot')}
+    shared = {'X': share_matrix(X), 'Y': share_matrix(Y),
+              'x_sq': share_matrix(x_sq), 'y_sq': share_matrix(y_sq)}
+    if any(params.get('shrinkage') for params in variants.values()):
+        Y_ones = Y.copy()
+        Y_ones.data = np.ones_like(Y_ones.data)
+        shared['Y_ones'] = share_matrix(Y_ones)
+        del Y_ones
+    handles = {k: v.handle for k, v in shared.items()}
 
-        # Top-K filtering.
-        # We only keep the top K similarity weights to avoid considering many
-        # barely-relevant neighbors
-        S_prime = top_k_filtering(S_prime, k_filtering)
-        S_prime.eliminate_zeros()
+    separated_tasks = []
+    weights = []
+    for chunk in balanced_chunks(costs, n_threads * TASKS_PER_WORKER):
+        separated_tasks.append([chunk, handles, variants, chunksize])
+        weights.append(costs[chunk['start']:chunk['end']].sum())
+
+    try:
+        submatrices = run_tasks(_work_compute_similarities, separated_tasks,
+                                n_threads, weights)
+    finally:
+        for matrix in shared.values():
+            matrix.unlink()
+    return {name: stack_chunks([x['result'][name] for x in submatrices])
+            for name in variants}
+
+
+def _work_compute_similarities(params):
+    bounds, handles, variants, chunksize = params
+    matrices = {}
+    blocks = []
+    for name, handle in handles.items():
+        matrices[name], matrix_blocks = attach_matrix(handle)
+        blocks.extend(matrix_blocks)
+    result = _compute_similarity_rows(bounds, matrices['X'], matrices['Y'],
+                                      matrices.get('Y_ones'),
+                                      matrices['x_sq'], matrices['y_sq'],
+                                      variants, chunksize)
+    del matrices
+    close_blocks(blocks)
+    return {'result': result, 'start': bounds['start']}
+
+
+def _compute_similarity_rows(bounds, X, Y, Y_ones, x_sq, y_sq, variants,
+                             chunksize):
+    """
+    Rows [start, end) of every variant of compute_similarities
+    """
+    import os
 
-        # Combine result
-        if S is None:
-            S = S_prime
-        else:
-            # stack matrices vertically
-            S = sps.vstack([S, S_prime], format="csr")
-    return {'result': S, 'start': start}
+    start = bounds['start']
+    mat_len = bounds['end']
+    results = {name: ChunkedCSR(Y.shape[1]) for name in variants}
+    scales = {name: _similarity_scales(x_sq, y_sq, params)
+              for name, params in variants.items()}
+    for chunk in range(start, mat_len, chunksize):
+        end = min(chunk + chunksize, mat_len)
+        print(('[ {:d} ] Building {:d} similarity matrices '
+               'for [{:d}, {:d})...').format(os.getpid(), len(variants),
+                                             chunk, end))
+
+        # the dot products, shared by all the variants
+        dot = X[chunk:end].dot(Y).tocsr()
+        common = None
+        if Y_ones is not None:
+            X_ones = X[chunk:end]
+            X_ones.data = np.ones_like(X_ones.data)
+            # same structure as the dot products, in the same order,
+            # unless some of them cancel out
+            common = X_ones.dot(Y_ones).tocsr()
+            if not (np.array_equal(common.indptr, dot.indptr) and
+                    np.array_equal(common.indices, dot.indices)):
+                # keep the counts on the structure of the dot products
+                dot.sort_indices()
+                common = dot.astype(bool).multiply(common).tocsr()
+                common.sort_indices()
+            common = common.data
+
+        counts = np.diff(dot.indptr)
+        x_sq_e = None
+        for name, params in variants.items():
+            if params['kind'] == 'dot':
+                data = dot.data
+            elif scales[name] is not None:
+                x_scale, y_scale = scales[name]
+                data = dot.data * np.repeat(x_scale[chunk:end], counts) * \
+                    y_scale[dot.indices]
+            else:
+                if x_sq_e is None:
+                    x_sq_e = np.repeat(x_sq[chunk:end], counts)
+                    y_sq_e = y_sq[dot.indices]
+                data = _similarity_values(dot.data, x_sq_e, y_sq_e, params)
+            if params.get('shrinkage'):
+                data = data * common * np.reciprocal(
+                    common + params['shrinkage'])
+            data = data.astype(dot.dtype, copy=False)
+            S_prime = sps.csr_matrix((data, dot.indices.copy(),
+                                      dot.indptr.copy()), shape=dot.shape)
+            S_prime = top_k_filtering(S_prime, params['k'])
+            S_prime.eliminate_zeros()
+            results[name].append(S_prime)
+    return {name: S.tocsr() for name, S in results.items()}
+
+
+def _similarity_scales(x_sq, y_sq, params):
+    """
+    (x_scale, y_scale) of the similarities described by params that are
+    <x, y> * x_scale[x] * y_scale[y] (cosine, asymmetric_cosine,
+    yadistance), out of the squared norms x_sq of the rows of X and y_sq
+    of the columns of Y. None for the other kinds
+    """
+    kind = params['kind']
+    if kind == 'asymmetric_cosine':
+        alpha = params.get('alpha', 0.5)
+        powers = (alpha, 1 - alpha)
+    else:
+        powers = {'cosine': (0.5, 0.5), 'yadistance': (0, 0.5)}.get(kind)
+    if powers is None:
+        return None
+    scales = []
+    for sq, power in zip([x_sq, y_sq], powers):
+        scale = np.ones_like(sq)
+        # a zero norm has no dot products, it is left at 1
+        nonzero = sq != 0
+        norm = np.sqrt(sq[nonzero]) if power == 0.5 \
+            else np.power(sq[nonzero], power)
+        scale[nonzero] = np.reciprocal(norm)
+        scales.append(scale)
+    return scales
+
+
+def _similarity_values(dot, x_sq, y_sq, params):
+    """
+    Values of the jaccard or tversky similarity described by params for
+    the dot products dot and the squared norms x_sq and y_sq of the two
+    vectors
+    """
+    if params['kind'] == 'jaccard':
+        den = x_sq + y_sq - dot
+    else:
+        alpha = params.get('alpha', 1.0)
+        beta = params.get('beta', 1.0)
+        den = dot + alpha * (x_sq - dot) + beta * (y_sq - dot)
+    den = np.where(den == 0, 1, den)
+    return dot / den
+
+
+def dense_top_k_dot(X, Y, topK, chunksize=1000, n_threads=0):
+    """
+    Computes X * Y for dense X and Y in blocks of chunksize rows and
+    keeps the topK largest entries of each row, selected with
+    argpartition on each block. The blocks run in a pool of threads,
+    the products release the GIL inside BLAS.
+
+    Returns a CSR matrix
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    X = np.asarray(X)
+    Y = np.asarray(Y)
+    n_threads = get_n_workers(n_threads)
+    bounds = [(start, min(start + chunksize, X.shape[0]))
+              for start in range(0, X.shape[0], chunksize)]
+    with ThreadPoolExecutor(n_threads) as pool:
+        blocks = list(pool.map(
+            lambda b: _dense_top_k_block(X[b[0]:b[1]], Y, topK), bounds))
+    result = stack_chunks(blocks)
+    if result is None:
+        return sps.csr_matrix((0, Y.shape[1]), dtype=np.result_type(X, Y))
+    return result
+
+
+def _dense_top_k_block(X_chunk, Y, topK):
+    """
+    The topK largest entries of each row of X_chunk * Y as csr
+    """
+    return _dense_top_k_rows(np.dot(X_chunk, Y), topK)
 
 
 def dot_chunked(X, Y, topK, chunksize=1000, n_threads=0):
@@ -268,47 +1077,49 @@ def dot_chunked(X, Y, topK, chunksize=1000, n_threads=0):
 
     Returns a CSR matrix
     """
-    import multiprocessing as mp
-    if n_threads == 0:
-        n_threads = mp.cpu_count()
+    if not sps.issparse(X) and not sps.issparse(Y):
+        return dense_top_k_dot(X, Y, topK, chunksize, n_threads)
+    n_threads = get_n_workers(n_threads)
+    costs = product_row_costs(X, Y)
 
-    worker_matrix_chunks = []
-    worker_chunksize = X.shape[0] // n_threads
-    for i in range(0, X.shape[0], worker_chunksize):
-        if i + worker_chunksize > X.shape[0]:
-            end = X.shape[0]
-        else:
-            end = i + worker_chunksize
-        worker_matrix_chunks.append({'start': i, 'end': end})
+    # Publish X and Y once, the tasks only carry their handles
+    shared_X = share_matrix(X)
+    shared_Y = share_matrix(Y)
 
-    # Build a list of parameters to ship to pool workers
+    # Build a list of parameters to ship to pool workers,
+    # balanced on the cost of the rows
     separated_tasks = []
-    for chunk in worker_matrix_chunks:
-        separated_tasks.append([chunk, X, Y, topK, chunksize])
-
-    result = None
-    with mp.Pool(n_threads) as pool:
-        print('Running {:d} workers...'.format(n_threads))
-        submatrices = pool.map(_worker_dot_chunked, separated_tasks)
-        submatrices.sort(key=lambda x: x['start'])
-
-        for submatrix in submatrices:
-            if result is None:
-                result = submatrix['result']
-            else:
-                result = sps.vstack([result, submatrix['result']])
-    return result
+    weights = []
+    for chunk in balanced_chunks(costs, n_threads * TASKS_PER_WORKER):
+        separated_tasks.append([chunk, shared_X.handle, shared_Y.handle,
+                                topK, chunksize])
+        weights.append(costs[chunk['start']:chunk['end']].sum())
+
+    try:
+        submatrices = run_tasks(_worker_dot_chunked, separated_tasks,
+                                n_threads, weights)
+    finally:
+        shared_X.unlink()
+        shared_Y.unlink()
+    return stack_chunks([x['result'] for x in submatrices])
 
 
 def _worker_dot_chunked(params):
     # Unpack parameters
     bounds = params[0]
-    X = params[1]
-    Y = params[2]
+    X, X_blocks = attach_matrix(params[1])
+    Y, Y_blocks = attach_matrix(params[2])
     topK = params[3]
     chunksize = params[4]
 
-    result = None
+    result = _dot_chunked_rows(bounds, X, Y, topK, chunksize)
+    del X, Y
+    close_blocks(X_blocks + Y_blocks)
+    return {'result': result, 'start': bounds['start']}
+
+
+def _dot_chunked_rows(bounds, X, Y, topK, chunksize):
+    result = ChunkedCSR(Y.shape[1])
     start = bounds['start']
     mat_len = bounds['end']
     for chunk in range(start, mat_len, chunksize):
@@ -320,15 +1131,13 @@ def _worker_dot_chunked(params):
               .format(chunk, end))
         X_chunk = X[chunk:end]
         sub_matrix = X_chunk.dot(Y)
-        sub_matrix = sps.csr_matrix(top_k_filtering(sub_matrix, topK))
-        if result is None:
-            result = sub_matrix
-        else:
-            result = sps.vstack([result, sub_matrix], format='csr')
-    return {'result': result, 'start': start}
+        result.append(top_k_filtering(sub_matrix, topK))
+    return result.tocsr()
 
 def dot_chunked_single(X, Y, topK, chunksize=1000):
-        result = None
+        if not sps.issparse(X) and not sps.issparse(Y):
+            return dense_top_k_dot(X, Y, topK, chunksize, n_threads=1)
+        result = ChunkedCSR(Y.shape[1])
         start = 0
         mat_len = X.shape[0]
         for chunk in range(start, mat_len, chunksize):
@@ -340,18 +1149,17 @@ def dot_chunked_single(X, Y, topK, chunksize=1000):
                   .format(chunk, end))
             X_chunk = X[chunk:end]
             sub_matrix = np.dot(X_chunk, Y)
-            sub_matrix = csr_matrix(top_k_filtering(sub_matrix, topK))
-            if result is None:
-                result = sub_matrix
-            else:
-                result = vstack([result, sub_matrix], format='csr')
-        return result
+            result.append(top_k_filtering(sub_matrix, topK))
+        return result.tocsr()
 
 
 def max_normalize(X):
         """
-        Normalizes X by rows dividing each row by its max
+        Normalizes X (sparse or dense) by rows dividing each row by its max
         """
+        if not sps.issparse(X):
+            max_r = np.max(X, axis=1, keepdims=True)
+            return X / np.where(max_r == 0, 1, max_r).astype(X.dtype)
         max_r = X.max(axis=1)
         max_r.data = np.reciprocal(max_r.data)
         return X.multiply(max_r)
@@ -370,17 +1178,25 @@ def normalize_by_row(X):
 
 
 def writeSubmission(fileName, recs, tg_playlist):
+    """
+    recs is the dictionary of predict or an iterable of dictionaries
+    (model.iter_recommendations()), written as they are produced in the
+    order of the blocks; only the playlists in tg_playlist are written
+    """
     import csv
+    if isinstance(recs, dict):
+        recs = [{k: recs[k] for k in tg_playlist}]
+    tg_playlist = set(tg_playlist)
     with open(fileName, mode='w', newline='') as out:
         fieldnames = ['playlist_id', 'track_ids']
         writer = csv.DictWriter(out, fieldnames=fieldnames, delimiter=',')
         writer.writeheader()
-        for k in tg_playlist:
-            track_ids = ''
-            for r in recs[k]:
-                track_ids = track_ids + r + ' '
-            writer.writerow({'playlist_id': k,
-                             'track_ids': track_ids[:-1]})
+        for block in recs:
+            for k, block_recs in block.items():
+                if k not in tg_playlist:
+                    continue
+                writer.writerow({'playlist_id': k,
+                                 'track_ids': ' '.join(block_recs)})
 
 
 def write_icm_to_file():
@@ -0,0 +1,61 @@
+import os
+import numpy as np
+import scipy.sparse as sps
+
+# Environment variable holding the floating point type used for the
+# matrices of the package (urm copies, icm, ucm, similarities, factors,
+# R_hat). Like the core budget it is inherited by the child processes.
+# The compiled BPR epochs are the exception: their floating point type is
+# fixed when they are built, see compiled_float_dtype.
+FLOAT_DTYPE_ENV = 'RECSYS_FLOAT_DTYPE'
+DEFAULT_FLOAT_DTYPE = 'float32'
+FLOAT_DTYPES = ['float32', 'float64']
+
+
+def get_float_dtype():
+    """
+    Returns the numpy floating point dtype of the package,
+    float32 if it has not been set
+    """
+    name = os.environ.get(FLOAT_DTYPE_ENV) or DEFAULT_FLOAT_DTYPE
+    if name not in FLOAT_DTYPES:
+        raise ValueError("{}={!r} is not one of {}".format(
+            FLOAT_DTYPE_ENV, name, FLOAT_DTYPES))
+    return np.dtype(name)
+
+
+def set_float_dtype(dtype):
+    """
+    Sets the floating point dtype of this process and its children
+    """
+    name = np.dtype(dtype).name
+    if name not in FLOAT_DTYPES:
+        raise ValueError("dtype {!r} is not one of {}".format(name,
+                                                             FLOAT_DTYPES))
+    os.environ[FLOAT_DTYPE_ENV] = name
+
+
+def as_float(matrix, dtype=None):
+    """
+    Returns matrix (sparse or dense) with the floating point dtype of
+    the package, or dtype if given. It is not copied if it already
+    has it
+    """
+    dtype = np.dtype(dtype) if dtype is not None else get_float_dtype()
+    if sps.issparse(matrix):
+        return matrix.astype(dtype, copy=False)
+    return np.asanyarray(matrix).astype(dtype, copy=False)
+
+
+def compiled_float_dtype(compiled_dtype, module):
+    """
+    Returns compiled_dtype, the floating point type module was built with,
+    printing a note if it is not the dtype of the package. The module
+    converts its inputs to compiled_dtype and its outputs back with as_float
+    """
+    compiled_dtype = np.dtype(compiled_dtype)
+    if compiled_dtype != get_float_dtype():
+        print("{} is compiled for {}, it trains in {} and returns {}".format(
+            module, compiled_dtype.name, compiled_dtype.name,
+            get_float_dtype().name))
+    return compiled_dtype
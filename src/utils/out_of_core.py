@@ -0,0 +1,355 @@
+import os
+import json
+import numpy as np
+import scipy.sparse as sps
+from src.utils.loader import load_sparse_matrix
+from src.utils.matrix_utils import top_k_filtering
+from src.utils.numeric import get_float_dtype
+from src.utils.sim_cache import fingerprint
+
+# Bump it when the layout of the work directory changes,
+# a run with another version starts from scratch
+OUT_OF_CORE_VERSION = 1
+
+
+def compute_cosine_out_of_core(X, Y, k_filtering, work_dir, shrinkage=False,
+                               normalize=True, memory_mb=1024):
+    """
+    Cosine similarity with shrinkage and top-K filtering of the rows of X
+    with the columns of Y, like compute_cosine, computed out of core.
+    X and Y are csr matrices or folders written by save_sparse_matrix,
+    which are memory mapped. The columns of Y are written to work_dir as
+    rows, then blocks of rows of X are multiplied by tiles of columns of
+    Y, sized so that a block product, its running top-K and a tile stay
+    within memory_mb.
+    The top-K of each row block is written to memory mapped arrays in
+    work_dir as soon as it is finished, if the run is interrupted calling
+    it again with the same arguments only computes the missing blocks.
+    Returns the X_shape[0]xY_shape[1] csr matrix memory mapped from
+    work_dir/S
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    budget = memory_mb * 1024 ** 2
+    dtype = get_float_dtype()
+    X = load_input(X)
+    Y = load_input(Y)
+    if X.shape[1] != Y.shape[0]:
+        raise ValueError("X and Y are not aligned: {} and {}".format(
+            X.shape, Y.shape))
+
+    settings = {'version': OUT_OF_CORE_VERSION,
+                'inputs': fingerprint([X, Y], []),
+                'k_filtering': int(k_filtering),
+                'shrinkage': float(shrinkage or 0),
+                'normalize': bool(normalize),
+                'memory_mb': memory_mb,
+                'dtype': dtype.name}
+    manifest = _load_manifest(work_dir)
+    if manifest is not None and manifest['settings'] == settings:
+        if manifest.get('complete'):
+            print("Similarity already computed in " + work_dir)
+            return load_sparse_matrix(os.path.join(work_dir, 'S'),
+                                      mmap_mode='r')
+        print("Resuming the similarity in " + work_dir)
+        Y_t = load_sparse_matrix(os.path.join(work_dir, 'Y_t'),
+                                 mmap_mode='r')
+    else:
+        # columns of Y as rows, so that the tiles are contiguous
+        Y_t = transpose_to_disk(Y, os.path.join(work_dir, 'Y_t'),
+                                budget // 4)
+        manifest = {'settings': settings,
+                    'tiles': _tiles(Y_t, budget // 4, dtype)}
+        manifest['blocks'] = _row_blocks(X, Y, manifest['tiles'],
+                                         k_filtering, budget // 2, dtype)
+        _create_output(work_dir, X.shape[0], k_filtering, dtype,
+                       len(manifest['blocks']))
+        _save_manifest(work_dir, manifest)
+
+    x_inv = _inverse_row_norms(X, manifest['blocks'], normalize, dtype)
+    y_inv = _inverse_row_norms(Y_t, manifest['tiles'], normalize, dtype)
+
+    out = _open_output(work_dir)
+    done = out['done']
+    for b, (start, end) in enumerate(manifest['blocks']):
+        if done[b]:
+            continue
+        print('Building cosine similarity block {:d}/{:d} [{:d}, {:d})...'
+              .format(b + 1, len(manifest['blocks']), start, end))
+        best = _block_top_k(X[start:end], Y_t, manifest['tiles'],
+                            x_inv[start:end], y_inv, k_filtering, shrinkage,
+                            Y.shape[1], dtype)
+        _write_block(out, start, best)
+        done[b] = 1
+        done.flush()
+    del out, done
+
+    S = _compact_output(work_dir, X.shape[0], Y.shape[1], dtype)
+    manifest['complete'] = True
+    _save_manifest(work_dir, manifest)
+    return S
+
+
+def load_input(matrix):
+    """
+    Returns matrix as csr, memory mapped if it is a folder written
+    by save_sparse_matrix
+    """
+    if isinstance(matrix, str):
+        return load_sparse_matrix(matrix, mmap_mode='r')
+    return sps.csr_matrix(matrix)
+
+
+def transpose_to_disk(matrix, folder, memory_bytes):
+    """
+    Writes the transpose of the csr matrix to folder as csr, reading
+    blocks of rows of about memory_bytes, and returns it memory mapped.
+    The entries are counted per column in a first pass and scattered
+    to their position in a second one
+    """
+    matrix = sps.csr_matrix(matrix) if not sps.isspmatrix_csr(matrix) \
+        else matrix
+    n_rows, n_cols = matrix.shape
+    bounds = _even_blocks(matrix.indptr, memory_bytes,
+                          matrix.data.itemsize + 8)
+
+    counts = np.zeros(n_cols, dtype=np.int64)
+    for start, end in bounds:
+        block = matrix.indices[matrix.indptr[start]:matrix.indptr[end]]
+        counts += np.bincount(block, minlength=n_cols)
+
+    os.makedirs(folder, exist_ok=True)
+    index_dtype = np.int32 if matrix.nnz < np.iinfo(np.int32).max \
+        else np.int64
+    indptr = np.zeros(n_cols + 1, dtype=index_dtype)
+    np.cumsum(counts, out=indptr[1:])
+    indices = np.lib.format.open_memmap(
+        os.path.join(folder, 'indices.npy'), mode='w+', dtype=index_dtype,
+        shape=(matrix.nnz,))
+    data = np.lib.format.open_memmap(
+        os.path.join(folder, 'data.npy'), mode='w+', dtype=matrix.dtype,
+        shape=(matrix.nnz,))
+    cursor = indptr[:-1].astype(np.int64)
+    for start, end in bounds:
+        lo, hi = matrix.indptr[start], matrix.indptr[end]
+        cols = np.asarray(matrix.indices[lo:hi])
+        rows = np.repeat(np.arange(start, end),
+                         np.diff(matrix.indptr[start:end + 1]))
+        # rows are increasing, a stable sort keeps them sorted per column
+        order = np.argsort(cols, kind='stable')
+        cols = cols[order]
+        first = np.searchsorted(cols, cols, side='left')
+        positions = cursor[cols] + np.arange(cols.shape[0]) - first
+        indices[positions] = rows[order]
+        data[positions] = matrix.data[lo:hi][order]
+        cursor += np.bincount(cols, minlength=n_cols)
+    indices.flush()
+    data.flush()
+    del indices, data
+    np.save(os.path.join(folder, 'indptr.npy'), indptr)
+    np.save(os.path.join(folder, 'shape.npy'), np.array([n_cols, n_rows]))
+    return load_sparse_matrix(folder, mmap_mode='r')
+
+
+def _even_blocks(indptr, memory_bytes, entry_bytes):
+    """
+    Splits the rows of a csr matrix with indptr in consecutive
+    (start, end) blocks of at most memory_bytes (at least one row)
+    """
+    n_rows = indptr.shape[0] - 1
+    limit = max(1, memory_bytes // entry_bytes)
+    bounds = []
+    start = 0
+    while start < n_rows:
+        end = int(np.searchsorted(indptr, indptr[start] + limit,
+                                  side='right')) - 1
+        end = min(max(end, start + 1), n_rows)
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def _tiles(Y_t, memory_bytes, dtype):
+    """
+    Tiles of columns of Y (rows of Y_t): the tile and its copy of ones
+    for the shrinkage stay within memory_bytes
+    """
+    entry_bytes = 2 * (dtype.itemsize + 4)
+    return [list(t) for t in _even_blocks(Y_t.indptr, memory_bytes,
+                                          entry_bytes)]
+
+
+def _row_blocks(X, Y, tiles, k_filtering, memory_bytes, dtype):
+    """
+    Blocks of rows of X whose estimated product with a tile of Y,
+    plus the running top-K, stay within memory_bytes
+    """
+    n_tiles = max(1, len(tiles))
+    y_row_nnz = np.diff(Y.indptr).astype(np.float64)
+    entry_bytes = dtype.itemsize + 4
+    costs = np.empty(X.shape[0])
+    for start, end in _even_blocks(X.indptr, memory_bytes, entry_bytes):
+        block = X[start:end]
+        ones = sps.csr_matrix((np.ones(block.nnz), block.indices,
+                               block.indptr), shape=block.shape)
+        # number of multiplications of each row, spread on the tiles,
+        # and never more than the columns of a tile
+        product = np.minimum(ones.dot(y_row_nnz) / n_tiles,
+                             Y.shape[1] / n_tiles)
+        # product, counts for the shrinkage and a temporary of each
+        costs[start:end] = 3 * product * entry_bytes + \
+            2 * k_filtering * entry_bytes + 1
+    cumulative = np.cumsum(costs)
+    blocks = []
+    start = 0
+    offset = 0.0
+    while start < X.shape[0]:
+        end = int(np.searchsorted(cumulative, offset + memory_bytes,
+                                  side='right'))
+        end = min(max(end, start + 1), X.shape[0])
+        blocks.append([start, end])
+        offset = cumulative[end - 1]
+        start = end
+    return blocks
+
+
+def _inverse_row_norms(matrix, blocks, normalize, dtype):
+    """
+    Reciprocal of the norm of each row of matrix (1 for empty rows,
+    all ones if not normalize), computed a block of rows at a time
+    """
+    inv = np.ones(matrix.shape[0], dtype=dtype)
+    if not normalize:
+        return inv
+    for start, end in blocks:
+        block = matrix[start:end]
+        norm = np.sqrt(np.asarray(block.multiply(block).sum(axis=1))).ravel()
+        norm[norm == 0] = 1
+        inv[start:end] = np.reciprocal(norm)
+    return inv
+
+
+def _block_top_k(X_block, Y_t, tiles, x_inv, y_inv, k_filtering, shrinkage,
+                 n_cols, dtype):
+    """
+    Top-K of the rows of X_block * Y, merging the top-K of each tile
+    of columns with the one of the previous tiles
+    """
+    X_block = sps.csr_matrix(X_block, dtype=dtype)
+    if shrinkage:
+        X_ones = X_block.copy()
+        X_ones.data = np.ones_like(X_ones.data)
+    best = sps.csr_matrix((X_block.shape[0], n_cols), dtype=dtype)
+    for tile_start, tile_end in tiles:
+        tile = sps.csr_matrix(Y_t[tile_start:tile_end], dtype=dtype)
+        S_prime = X_block.dot(tile.transpose()).tocsr()
+        rows = np.repeat(np.arange(S_prime.shape[0]), np.diff(S_prime.indptr))
+        S_prime.data *= x_inv[rows] * y_inv[tile_start + S_prime.indices]
+        if shrinkage:
+            tile.data = np.ones_like(tile.data)
+            S_num = X_ones.dot(tile.transpose())
+            S_den = S_num.copy()
+            S_den.data += shrinkage
+            S_den.data = np.reciprocal(S_den.data)
+            S_prime = S_prime.multiply(S_num).multiply(S_den).tocsr()
+        S_prime = top_k_filtering(S_prime, k_filtering)
+        S_prime.eliminate_zeros()
+        # move the tile to its columns, it does not overlap the others
+        S_prime = sps.csr_matrix((S_prime.data,
+                                  S_prime.indices + tile_start,
+                                  S_prime.indptr),
+                                 shape=(S_prime.shape[0], n_cols))
+        best = top_k_filtering((best + S_prime).tocsr(), k_filtering)
+        best.eliminate_zeros()
+    return best
+
+
+def _create_output(work_dir, n_rows, k_filtering, dtype, n_blocks):
+    """
+    Creates the memory mapped arrays holding the top-K of each row
+    (padded to k_filtering) and the flags of the finished blocks
+    """
+    arrays = {'out_data': (dtype, (n_rows, k_filtering)),
+              'out_indices': (np.int32, (n_rows, k_filtering)),
+              'out_count': (np.int32, (n_rows,)),
+              'done': (np.int8, (n_blocks,))}
+    for name, (array_dtype, shape) in arrays.items():
+        array = np.lib.format.open_memmap(
+            os.path.join(work_dir, name + '.npy'), mode='w+',
+            dtype=array_dtype, shape=shape)
+        array[:] = 0
+        array.flush()
+        del array
+
+
+def _open_output(work_dir):
+    return {name: np.load(os.path.join(work_dir, name + '.npy'),
+                          mmap_mode='r+')
+            for name in ['out_data', 'out_indices', 'out_count', 'done']}
+
+
+def _write_block(out, start, best):
+    """
+    Writes the rows of best from row start of the output
+    """
+    counts = np.diff(best.indptr)
+    end = start + best.shape[0]
+    rows = np.repeat(np.arange(best.shape[0]), counts)
+    slots = np.arange(best.nnz) - np.repeat(best.indptr[:-1], counts)
+    data = np.zeros((best.shape[0], out['out_data'].shape[1]),
+                    dtype=out['out_data'].dtype)
+    indices = np.zeros(data.shape, dtype=np.int32)
+    data[rows, slots] = best.data
+    indices[rows, slots] = best.indices
+    out['out_data'][start:end] = data
+    out['out_indices'][start:end] = indices
+    out['out_count'][start:end] = counts
+    for name in ['out_data', 'out_indices', 'out_count']:
+        out[name].flush()
+
+
+def _compact_output(work_dir, n_rows, n_cols, dtype):
+    """
+    Writes the padded top-K arrays as a csr matrix in work_dir/S,
+    a block of rows at a time, and returns it memory mapped
+    """
+    out = _open_output(work_dir)
+    counts = np.asarray(out['out_count'], dtype=np.int64)
+    folder = os.path.join(work_dir, 'S')
+    os.makedirs(folder, exist_ok=True)
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    nnz = int(indptr[-1])
+    data = np.lib.format.open_memmap(os.path.join(folder, 'data.npy'),
+                                     mode='w+', dtype=dtype, shape=(nnz,))
+    indices = np.lib.format.open_memmap(os.path.join(folder, 'indices.npy'),
+                                        mode='w+', dtype=np.int32,
+                                        shape=(nnz,))
+    k = out['out_data'].shape[1]
+    step = max(1, (1 << 22) // max(1, k))
+    for start in range(0, n_rows, step):
+        end = min(start + step, n_rows)
+        mask = np.arange(k) < counts[start:end, None]
+        data[indptr[start]:indptr[end]] = out['out_data'][start:end][mask]
+        indices[indptr[start]:indptr[end]] = \
+            out['out_indices'][start:end][mask]
+    data.flush()
+    indices.flush()
+    del data, indices, out
+    np.save(os.path.join(folder, 'indptr.npy'), indptr)
+    np.save(os.path.join(folder, 'shape.npy'), np.array([n_rows, n_cols]))
+    return load_sparse_matrix(folder, mmap_mode='r')
+
+
+def _load_manifest(work_dir):
+    path = os.path.join(work_dir, 'manifest.json')
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(work_dir, manifest):
+    path = os.path.join(work_dir, 'manifest.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,252 @@
+import os
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import scipy.sparse as sps
+from scipy.sparse import csr_matrix
+import numpy as np
+
+# Environment variable holding the number of cores the process may use.
+# It is inherited by the child processes, so a worker started by a
+# parallel runner sees the budget it has been assigned.
+CORE_BUDGET_ENV = 'RECSYS_CORE_BUDGET'
+
+
+def get_core_budget():
+    """
+    Returns the number of cores this process may use,
+    all the cores if no budget has been set
+    """
+    budget = os.environ.get(CORE_BUDGET_ENV)
+    if budget:
+        return max(1, int(budget))
+    return mp.cpu_count()
+
+
+def set_core_budget(n_cores):
+    """
+    Sets the number of cores this process and its children may use
+    """
+    os.environ[CORE_BUDGET_ENV] = str(max(1, int(n_cores)))
+
+
+def get_n_workers(n_threads=0):
+    """
+    Returns the number of workers of a pool:
+    n_threads if it is given, the core budget otherwise
+    """
+    if n_threads:
+        return n_threads
+    return get_core_budget()
+
+
+def _share_array(array):
+    """
+    Copies array in a new shared memory block,
+    returns the block and the description of the array
+    """
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    shared[:] = array
+    return block, (block.name, array.dtype.str, array.shape)
+
+
+def _attach_array(description):
+    """
+    Returns the array described by description and its block
+    """
+    block_name, dtype, shape = description
+    block = shared_memory.SharedMemory(name=block_name)
+    array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return array, block
+
+
+def share_matrix(matrix):
+    """
+    Publishes a sparse matrix (as csr) or a dense array in shared memory.
+    Returns a SharedCSR or a SharedArray, pass its handle to the workers
+    """
+    if sps.issparse(matrix):
+        return SharedCSR(matrix)
+    return SharedArray(matrix)
+
+
+def attach_matrix(handle):
+    """
+    Returns (matrix, blocks) for the handle of a SharedCSR or SharedArray.
+    Delete every reference to matrix before closing the blocks
+    """
+    if handle['kind'] == 'csr':
+        return SharedCSR.attach(handle)
+    return SharedArray.attach(handle)
+
+
+def close_blocks(blocks):
+    """
+    Detaches the process from the blocks returned by attach_matrix
+    """
+    for block in blocks:
+        block.close()
+
+
+class SharedArray(object):
+    """
+    A dense array in a shared memory block, see SharedCSR
+    """
+
+    def __init__(self, array):
+        block, description = _share_array(np.asarray(array))
+        self.blocks = [block]
+        self.handle = {'kind': 'array', 'array': description}
+
+    @staticmethod
+    def attach(handle):
+        array, block = _attach_array(handle['array'])
+        return array, [block]
+
+    def unlink(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+class SharedCSR(object):
+    """
+    A csr matrix whose data, indices and indptr live in shared memory
+    blocks. The handle is a small picklable description of the blocks
+    that other processes use to attach to the same matrix without
+    copying it.
+    The process creating it must call unlink when done.
+    """
+
+    def __init__(self, matrix):
+        matrix = matrix.tocsr()
+        self.blocks = []
+        arrays = {}
+        for name in ['data', 'indices', 'indptr']:
+            block, arrays[name] = _share_array(getattr(matrix, name))
+            self.blocks.append(block)
+        self.handle = {'kind': 'csr', 'arrays': arrays,
+                       'shape': matrix.shape}
+
+    @staticmethod
+    def attach(handle):
+        """
+        Returns (matrix, blocks): the csr matrix described by handle,
+        backed by the shared blocks, and the blocks to close when
+        the matrix is not needed anymore
+        """
+        blocks = []
+        arrays = {}
+        for name, description in handle['arrays'].items():
+            arrays[name], block = _attach_array(description)
+            blocks.append(block)
+        matrix = csr_matrix(
+            (arrays['data'], arrays['indices'], arrays['indptr']),
+            shape=handle['shape'], copy=False)
+        return matrix, blocks
+
+    def unlink(self):
+        """
+        Releases the shared blocks
+        """
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+# Number of tasks per worker made by balanced_chunks for run_tasks:
+# more tasks than workers let the idle workers pick up the remaining ones
+TASKS_PER_WORKER = 4
+
+
+def balanced_chunks(weights, n_chunks):
+    """
+    Splits [0, len(weights)) in at most n_chunks contiguous ranges
+    {'start', 'end'} with about the same total weight
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    n = weights.shape[0]
+    if n == 0:
+        return []
+    n_chunks = max(1, min(n_chunks, n))
+    cumulative = np.cumsum(weights)
+    # cut where the cumulative weight crosses each multiple of the share
+    targets = cumulative[-1] * np.arange(1, n_chunks) / n_chunks
+    cuts = np.searchsorted(cumulative, targets, side='right')
+    bounds = np.unique(np.r_[0, cuts, n])
+    return [{'start': int(s), 'end': int(e)}
+            for s, e in zip(bounds[:-1], bounds[1:])]
+
+
+def product_row_costs(X, Y):
+    """
+    Returns the estimated cost of each row of X * Y: the number of
+    multiplications it needs, plus one for the row itself
+    """
+    if not sps.issparse(X):
+        return np.full(X.shape[0], Y.shape[1], dtype=np.float64)
+    X = X.tocsr()
+    if sps.issparse(Y):
+        y_row_nnz = np.diff(Y.tocsr().indptr).astype(np.float64)
+    else:
+        y_row_nnz = np.full(Y.shape[0], Y.shape[1], dtype=np.float64)
+    X_ones = sps.csr_matrix((np.ones_like(X.data, dtype=np.float64),
+                             X.indices, X.indptr), shape=X.shape)
+    return X_ones.dot(y_row_nnz) + 1
+
+
+def _timed_call(params):
+    """
+    Runs a task of run_tasks measuring its time
+    """
+    function, index, task = params
+    start = time.time()
+    result = function(task)
+    return index, result, os.getpid(), time.time() - start
+
+
+def run_tasks(function, tasks, n_workers, weights=None):
+    """
+    Runs function on each task in a pool of n_workers processes.
+    The tasks are queued heaviest first (by weights) and every worker
+    takes the next one as soon as it is idle, so uneven tasks do not
+    leave workers waiting for the slowest one.
+    Prints the busy time of each worker and returns the results in
+    the order of tasks
+    """
+    if weights is None:
+        order = range(len(tasks))
+    else:
+        order = np.argsort(-np.asarray(weights), kind='stable')
+    queue = [(function, int(i), tasks[i]) for i in order]
+
+    results = [None] * len(tasks)
+    busy = {}
+    start = time.time()
+    with mp.Pool(n_workers) as pool:
+        print('Running {:d} tasks on {:d} workers...'.format(len(tasks),
+                                                           n_workers))
+        for index, result, pid, elapsed in pool.imap_unordered(_timed_call,
+                                                               queue):
+            results[index] = result
+            busy[pid] = busy.get(pid, 0) + elapsed
+    print_busy_time(busy, time.time() - start)
+    return results
+
+
+def print_busy_time(busy, elapsed):
+    """
+    Prints the busy time of each worker {pid: seconds} against the
+    elapsed time, with the max / mean imbalance
+    """
+    if not busy:
+        return
+    times = np.array(list(busy.values()))
+    for pid, seconds in sorted(busy.items()):
+        print('[ {:d} ] busy {:.2f}s of {:.2f}s'.format(pid, seconds, elapsed))
+    print('Worker imbalance (max / mean busy time): {:.2f}'.format(
+        times.max() / max(times.mean(), 1e-12)))
@@ -0,0 +1,157 @@
+import os
+import hashlib
+import numpy as np
+import scipy.sparse as sps
+
+# Directory of the similarity cache used by compute_cosine when no cache
+# is passed, caching is disabled if it is not set
+SIM_CACHE_ENV = 'RECSYS_SIM_CACHE'
+# Size cap of that cache in megabytes
+SIM_CACHE_MB_ENV = 'RECSYS_SIM_CACHE_MB'
+SIM_CACHE_DEFAULT_MB = 2048
+# Bump it when the way similarities are computed changes,
+# it invalidates all the stored matrices
+SIM_CACHE_VERSION = 1
+# Number of elements of an array hashed at a time
+HASH_SLICE = 1 << 22
+
+
+class SimilarityCache(object):
+    """
+    Content addressed store of similarity matrices.
+    A matrix is keyed by the hash of the bytes of its input matrices and
+    of the parameters it was computed with, and written as a compressed
+    csr npz file. When the files exceed max_bytes the least recently
+    used ones are removed.
+    """
+
+    def __init__(self, cache_dir='./data/cache/similarity/',
+                 max_bytes=SIM_CACHE_DEFAULT_MB * 1024 ** 2):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_env(cls):
+        """
+        Returns the cache configured by the environment,
+        None if caching is disabled
+        """
+        cache_dir = os.environ.get(SIM_CACHE_ENV)
+        if not cache_dir:
+            return None
+        size_mb = float(os.environ.get(SIM_CACHE_MB_ENV,
+                                       SIM_CACHE_DEFAULT_MB))
+        return cls(cache_dir, int(size_mb * 1024 ** 2))
+
+    def key(self, matrices, params):
+        """
+        Returns the hex digest of matrices (sparse or dense) and params
+        """
+        return fingerprint(matrices, params)
+
+    def get(self, key):
+        """
+        Returns the matrix stored with key, None if there is none
+        """
+        path = self._path(key)
+        try:
+            matrix = sps.load_npz(path)
+        except (IOError, ValueError):
+            return None
+        # mark it as recently used
+        os.utime(path)
+        print("Similarity loaded from cache " + path)
+        return matrix
+
+    def put(self, key, matrix):
+        """
+        Stores the sparse matrix with key and evicts the least recently
+        used matrices over the size cap
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        # write to a temporary file and rename, a concurrent reader
+        # never sees a partial file
+        tmp_path = '{}.{:d}.tmp.npz'.format(path[:-len('.npz')], os.getpid())
+        sps.save_npz(tmp_path, sps.csr_matrix(matrix), compressed=True)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used matrices until the cache fits
+        in max_bytes
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz') or '.tmp.' in name:
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, 'sim_' + key + '.npz')
+
+
+def fingerprint(matrices, params):
+    """
+    Returns the hex digest of the content of matrices (sparse or dense)
+    and of params
+    """
+    h = hashlib.sha1()
+    h.update(str(SIM_CACHE_VERSION).encode())
+    h.update(repr(params).encode())
+    for matrix in matrices:
+        _update_with_matrix(h, matrix)
+    return h.hexdigest()
+
+
+def _update_with_matrix(h, matrix):
+    """
+    Adds the type, shape and content of matrix to the hash h
+    """
+    if sps.issparse(matrix):
+        matrix = matrix.tocsr()
+        if not matrix.has_canonical_format:
+            matrix = matrix.copy()
+            matrix.sum_duplicates()
+        h.update(repr(('csr', matrix.shape, matrix.dtype.str)).encode())
+        for array in [matrix.indptr, matrix.indices, matrix.data]:
+            # in slices, the arrays may be memory mapped
+            for start in range(0, array.shape[0], HASH_SLICE):
+                piece = array[start:start + HASH_SLICE]
+                # the index dtype may change without changing the matrix
+                if array is not matrix.data:
+                    piece = piece.astype(np.int64)
+                h.update(np.ascontiguousarray(piece).data)
+    else:
+        matrix = np.ascontiguousarray(matrix)
+        h.update(repr(('dense', matrix.shape, matrix.dtype.str)).encode())
+        h.update(matrix.data)
+
+
+def resolve_cache(cache):
+    """
+    Returns the SimilarityCache to use for the cache argument of
+    compute_cosine: the environment one for None, none for False
+    """
+    if cache is None:
+        return SimilarityCache.from_env()
+    if cache is False:
+        return None
+    if cache is True:
+        return SimilarityCache()
+    return cache
@@ -0,0 +1,70 @@
+import sys
+import time
+import contextlib
+import io
+import numpy as np
+import scipy.sparse as sps
+from src.utils import matrix_utils
+from src.utils.matrix_utils import compute_cosine
+from src.utils.parallel import product_row_costs
+
+# Times compute_cosine on the item-item similarity of random binary
+# matrices with the normal and the symmetric path, to place
+# SYMMETRIC_MIN_PRODUCTS and SYMMETRIC_MIN_PRODUCTS_SHRINKAGE:
+#   python -m src.utils.symmetric_benchmark [n_rows n_cols]
+
+
+def timed_cosine(M, k, shrinkage, symmetric):
+    """
+    Returns the seconds and the result of the item-item cosine of M,
+    symmetric forces the symmetric path
+    """
+    thresholds = (matrix_utils.SYMMETRIC_MIN_PRODUCTS,
+                  matrix_utils.SYMMETRIC_MIN_PRODUCTS_SHRINKAGE)
+    if symmetric:
+        matrix_utils.SYMMETRIC_MIN_PRODUCTS = 0
+        matrix_utils.SYMMETRIC_MIN_PRODUCTS_SHRINKAGE = 0
+    try:
+        start_time = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            S = compute_cosine(M.transpose().tocsr(), M, k,
+                               shrinkage=shrinkage, symmetric=symmetric,
+                               cache=False)
+        return time.time() - start_time, S
+    finally:
+        matrix_utils.SYMMETRIC_MIN_PRODUCTS, \
+            matrix_utils.SYMMETRIC_MIN_PRODUCTS_SHRINKAGE = thresholds
+
+
+def same_top_k(A, B):
+    """
+    True if every row of A and B keeps the same values, the columns
+    may differ between entries tied up to rounding
+    """
+    A = np.sort(A.toarray(), axis=1)
+    B = np.sort(B.toarray(), axis=1)
+    return np.allclose(A, B, atol=1e-5)
+
+
+def main(n_rows=20000, n_cols=6000, k=100):
+    print('density shrinkage products/entry normal symmetric speedup '
+          'chosen same')
+    for density in [0.005, 0.01, 0.02, 0.03, 0.05]:
+        M = sps.random(n_rows, n_cols, density=density, format='csr',
+                       random_state=0, dtype=np.float32)
+        M.data[:] = 1
+        costs = product_row_costs(M.transpose().tocsr(), M)
+        products = costs.sum() / np.minimum(costs, n_cols).sum()
+        for shrinkage in [0, 10]:
+            normal, S = timed_cosine(M, k, shrinkage, False)
+            symmetric, S_sym = timed_cosine(M, k, shrinkage, True)
+            chosen = matrix_utils._symmetric_pays_off(
+                M.transpose().tocsr(), M, shrinkage)
+            print('{:.3f} {:d} {:.1f} {:.2f}s {:.2f}s {:.2f}x {} {}'.format(
+                density, shrinkage, products, normal, symmetric,
+                normal / symmetric, 'symmetric' if chosen else 'normal',
+                same_top_k(S, S_sym)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
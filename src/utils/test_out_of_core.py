@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse as sps
+from src.utils import out_of_core
+from src.utils.matrix_utils import compute_cosine
+from src.utils.numeric import set_float_dtype
+
+# Parity of compute_cosine_out_of_core with compute_cosine, including a
+# run interrupted after some blocks and resumed. Run from the root of
+# the repository:
+#   python -m src.utils.test_out_of_core
+
+# small enough to split the rows in blocks and the columns in tiles
+MEMORY_MB = 0.02
+
+
+class Interrupted(Exception):
+    pass
+
+
+def same_csr(A, B):
+    """
+    True if the csr matrices have the same entries
+    """
+    A = sps.csr_matrix(A, copy=True)
+    B = sps.csr_matrix(B, copy=True)
+    A.sort_indices()
+    B.sort_indices()
+    return A.shape == B.shape and \
+        np.array_equal(A.indptr, B.indptr) and \
+        np.array_equal(A.indices, B.indices) and \
+        np.allclose(A.data, B.data, rtol=1e-9, atol=1e-12)
+
+
+def report(name, ok):
+    print('{}: {}'.format(name, 'ok' if ok else 'MISMATCH'))
+    return ok
+
+
+def counting_block_top_k(calls, fail_after=None):
+    """
+    Wraps out_of_core._block_top_k counting its calls in calls[0], it
+    raises Interrupted at the call after fail_after
+    """
+    block_top_k = out_of_core._block_top_k
+
+    def wrapper(*args, **kwargs):
+        if fail_after is not None and calls[0] >= fail_after:
+            raise Interrupted()
+        calls[0] += 1
+        return block_top_k(*args, **kwargs)
+    return wrapper
+
+
+def run(X, Y, k, work_dir, shrinkage, calls, fail_after=None):
+    """
+    compute_cosine_out_of_core with a counted _block_top_k, returns
+    the similarity or None if it was interrupted
+    """
+    block_top_k = out_of_core._block_top_k
+    out_of_core._block_top_k = counting_block_top_k(calls, fail_after)
+    try:
+        return out_of_core.compute_cosine_out_of_core(
+            X, Y, k, work_dir, shrinkage=shrinkage, memory_mb=MEMORY_MB)
+    except Interrupted:
+        return None
+    finally:
+        out_of_core._block_top_k = block_top_k
+
+
+def check_out_of_core(work_root):
+    """
+    Full and resumed out of core runs against compute_cosine, with and
+    without shrinkage and k below and above the number of columns
+    """
+    # items x features, item 5 has no features
+    icm = sps.random(300, 120, density=0.05, format='csr', random_state=3)
+    icm = sps.diags((np.arange(300) != 5).astype(np.float64)).dot(icm)
+    icm = icm.tocsr()
+    icm.eliminate_zeros()
+    X = icm
+    Y = icm.transpose().tocsr()
+    ok = True
+    for shrinkage in [0, 10]:
+        for k in [10, 500]:
+            name = 'shrinkage={} k={}'.format(shrinkage, k)
+            expected = compute_cosine(X, Y, k, shrinkage=shrinkage,
+                                      cache=False)
+
+            work_dir = os.path.join(work_root, 'full')
+            shutil.rmtree(work_dir, ignore_errors=True)
+            full = run(X, Y, k, work_dir, shrinkage, [0])
+            ok &= report('out of core ' + name, same_csr(expected, full))
+            del full
+
+            work_dir = os.path.join(work_root, 'resumed')
+            shutil.rmtree(work_dir, ignore_errors=True)
+            first = [0]
+            interrupted = run(X, Y, k, work_dir, shrinkage, first,
+                              fail_after=2)
+            with open(os.path.join(work_dir, 'manifest.json')) as f:
+                n_blocks = len(json.load(f)['blocks'])
+            second = [0]
+            resumed = run(X, Y, k, work_dir, shrinkage, second)
+            third = [0]
+            again = run(X, Y, k, work_dir, shrinkage, third)
+            ok &= report('interrupted run stopped ' + name,
+                         interrupted is None and n_blocks > 2)
+            ok &= report('resumed run computes the missing blocks ' + name,
+                         second[0] == n_blocks - 2 and third[0] == 0)
+            ok &= report('resumed run ' + name, same_csr(expected, resumed)
+                         and same_csr(expected, again))
+            del resumed, again
+    return ok
+
+
+def main():
+    # in float64 both paths round the same way
+    set_float_dtype('float64')
+    work_root = tempfile.mkdtemp(prefix='test_out_of_core_')
+    try:
+        ok = check_out_of_core(work_root)
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+    print('Out of core similarity matches' if ok else
+          'Out of core similarity does not match')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()